@@ -1,14 +1,38 @@
 #!/usr/bin/env python3
 # analyze_kpi.py: сравнение KPI между baseline и opt сценариями
-# Использует tripinfos.xml, summary.xml, edgeData.xml, laneData.xml из out/<run>/
+# Использует tripinfos.xml, summary.xml, edgeData.xml, laneData.xml (или *.xml.gz) из out/<run>/;
+# у прогона, продолженного с контрольной точки, — из всех сегментов (out/<run>/resume_*/, segments.py)
+# Файлы разбираются потоково: память не зависит от их размера; edgeData/laneData сохраняются
+# как memory-mapped временные ряды (meandata.py) для сравнения прогонов по рёбрам и интервалам
 
 import os
-import sys
+import json
+import gzip
+import re
+import csv
+import glob
+import math
+import hashlib
+import argparse
+from array import array
 import statistics as stats
 import xml.etree.ElementTree as ET
-from typing import Dict, Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, List, Optional
+import numpy as np
+from meandata import MeanDataStore, HIGHER_IS_WORSE, SOURCES, top_changes, interval_deltas
+from segments import Segment, segment_files
 
 Run = Tuple[str, str]  # (name, path)
+Sources = List[Tuple[str, Segment]]  # [(выходной файл, сегмент прогона)]
+
+# Размер буфера для точного p95; при большем числе значений используется оценка P²
+QUANTILE_BUFFER_SIZE = 1_000_000
+# Кэш разобранных KPI в каталоге прогона (скаляры и ряды по шагам); версия меняется вместе с форматом метрик
+CACHE_FILE = ".kpi_cache.npz"
+CACHE_VERSION = 4
+# Каталог прогона runner.py: <mode>_seed<S>_x<K>
+RUN_NAME_RE = re.compile(r"^(?P<mode>.+?)_seed(?P<seed>-?\d+)(?:_x(?P<scale>[\d.]+))?$")
 
 
 def pct(values: List[float], p: float) -> float:
@@ -25,7 +49,142 @@ def pct(values: List[float], p: float) -> float:
     return d0 + d1
 
 
-def parse_tripinfos(path: str) -> Dict[str, float]:
+class RunningMean:
+    """Среднее и сумма без хранения значений"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class P2Quantile:
+    """Оценка квантиля алгоритмом P² (Jain & Chlamtac): пять маркеров, O(1) памяти"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.q: List[float] = []  # высоты маркеров
+        self.n = [0, 1, 2, 3, 4]  # позиции маркеров
+        self.np = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]  # желаемые позиции
+        self.dn = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x: float):
+        q = self.q
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self.n
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+        for i in range(1, 4):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Параболическая поправка, при выходе за соседей — линейная
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self) -> float:
+        if not self.q:
+            return 0.0
+        if len(self.q) < 5:
+            return pct(self.q, self.p)
+        return self.q[2]
+
+
+class QuantileTracker:
+    """Точный квантиль по предвыделенному NumPy-буферу, при переполнении — оценка P²"""
+
+    def __init__(self, p: float, capacity: int = QUANTILE_BUFFER_SIZE):
+        self.p = p
+        self.buffer = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.overflow = False
+        self.sketch = P2Quantile(p)
+
+    def add(self, value: float):
+        self.sketch.add(value)
+        if self.size < len(self.buffer):
+            self.buffer[self.size] = value
+            self.size += 1
+        else:
+            self.overflow = True
+
+    def value(self) -> float:
+        if self.overflow:
+            return self.sketch.value()
+        if not self.size:
+            return 0.0
+        return float(np.percentile(self.buffer[:self.size], self.p * 100))
+
+
+def open_xml(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def iter_elements(path: str, tag: str):
+    """Потоковый обход элементов с тегом tag (атрибуты доступны на событии start).
+    Завершённые элементы очищаются и удаляются из родителя, так что память не растёт с размером файла.
+    """
+    with open_xml(path) as f:
+        stack = []
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                if elem.tag.endswith(tag):
+                    yield elem
+                continue
+            stack.pop()
+            elem.clear()
+            # Завершённый элемент — всегда последний ребёнок своего родителя
+            if stack:
+                del stack[-1][-1]
+
+
+def as_sources(sources) -> Sources:
+    """Путь к одному файлу — один сегмент без окна"""
+    if isinstance(sources, str):
+        return [(sources, Segment(os.path.dirname(sources)))]
+    return sources
+
+
+def _float_attr(elem, *names):
+    for name in names:
+        value = elem.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except Exception:
+                return None
+    return None
+
+
+def parse_tripinfos(sources) -> Dict[str, float]:
     m = {
         "departed": 0,
         "arrived": 0,
@@ -33,106 +192,359 @@ def parse_tripinfos(path: str) -> Dict[str, float]:
         "p95_travel": 0.0,
         "avg_wait": 0.0,
     }
-    if not os.path.exists(path):
-        return m
-    durations, waits = [], []
-    arrived = 0
-    try:
-        for evt in ET.iterparse(path, events=("start",)):
-            tag = evt[1].tag
-            if tag.endswith("tripinfo"):
-                arrived += 1
-                dur = float(evt[1].get("duration", "0") or 0)
-                wt = float(evt[1].get("waitingTime", "0") or 0)
-                durations.append(dur)
-                waits.append(wt)
-    except Exception:
-        pass
+    durations, waits = RunningMean(), RunningMean()
+    p95 = QuantileTracker(0.95)
+    for path, segment in as_sources(sources):
+        if not os.path.exists(path):
+            continue
+        try:
+            for elem in iter_elements(path, "tripinfo"):
+                # Поездка принадлежит сегменту, в окне которого она завершилась
+                if not segment.contains(float(elem.get("arrival", "0") or 0)):
+                    continue
+                dur = float(elem.get("duration", "0") or 0)
+                wt = float(elem.get("waitingTime", "0") or 0)
+                durations.add(dur)
+                p95.add(dur)
+                waits.add(wt)
+        except Exception:
+            pass
+    arrived = durations.count
     m["arrived"] = arrived
-    m["avg_travel"] = sum(durations) / len(durations) if durations else 0.0
-    m["p95_travel"] = pct(durations, 0.95)
-    m["avg_wait"] = sum(waits) / len(waits) if waits else 0.0
+    m["avg_travel"] = durations.mean
+    m["p95_travel"] = p95.value()
+    m["avg_wait"] = waits.mean
     # departed можно получить из summary.xml; здесь приблизим как arrived
     m["departed"] = arrived
     return m
 
 
-def parse_summary(path: str) -> Dict[str, float]:
+# Ряды summary.xml по шагам (атрибут <step> -> ключ секции summary); кэшируются вместе со скалярами
+SUMMARY_SERIES = {"time": "series_time", "running": "series_running", "halting": "series_halting",
+                  "meanSpeed": "series_mean_speed"}
+
+
+def parse_summary(sources) -> Dict[str, float]:
     m = {
         "mean_speed": 0.0,
         "total_waiting_time": 0.0,
         "stopped_veh_avg": 0.0,
     }
-    if not os.path.exists(path):
-        return m
-    speeds, stopped, waiting = [], [], []
-    try:
-        for evt in ET.iterparse(path, events=("start",)):
-            tag = evt[1].tag
-            if tag.endswith("step"):
+    series = {name: array("d") for name in SUMMARY_SERIES.values()}
+    speeds, stopped, waiting = RunningMean(), RunningMean(), RunningMean()
+    for path, segment in as_sources(sources):
+        if not os.path.exists(path):
+            continue
+        try:
+            for elem in iter_elements(path, "step"):
+                time = _float_attr(elem, "time")
+                if time is not None and not segment.contains(time):
+                    continue
                 # поля зависят от версии SUMO; стараемся быть толерантными
-                ms = evt[1].get("meanSpeed") or evt[1].get("mean speed")
+                ms = _float_attr(elem, "meanSpeed", "mean speed")
                 if ms is not None:
-                    try:
-                        speeds.append(float(ms))
-                    except Exception:
-                        pass
-                st = evt[1].get("stoppedVehicles")
+                    speeds.add(ms)
+                st = _float_attr(elem, "stoppedVehicles")
                 if st is not None:
-                    try:
-                        stopped.append(float(st))
-                    except Exception:
-                        pass
-                wt = evt[1].get("waitingTime")
+                    stopped.add(st)
+                wt = _float_attr(elem, "waitingTime")
                 if wt is not None:
-                    try:
-                        waiting.append(float(wt))
-                    except Exception:
-                        pass
-    except Exception:
-        pass
-    m["mean_speed"] = sum(speeds) / len(speeds) if speeds else 0.0
-    m["stopped_veh_avg"] = sum(stopped) / len(stopped) if stopped else 0.0
-    m["total_waiting_time"] = sum(waiting) if waiting else 0.0
+                    waiting.add(wt)
+                for attr, name in SUMMARY_SERIES.items():
+                    value = _float_attr(elem, attr)
+                    series[name].append(np.nan if value is None else value)
+        except Exception:
+            pass
+        # Ряды одинаковой длины даже при обрыве файла посреди шага
+        n = min(len(values) for values in series.values())
+        for values in series.values():
+            del values[n:]
+    m["mean_speed"] = speeds.mean
+    m["stopped_veh_avg"] = stopped.mean
+    m["total_waiting_time"] = waiting.total
+    m.update({name: np.frombuffer(values, dtype=np.float64).copy() for name, values in series.items()})
     return m
 
 
-def parse_lane_edge(path: str) -> Dict[str, float]:
-    m = {"lane_speed_avg": 0.0, "lane_occupancy_avg": 0.0}
-    if not os.path.exists(path):
+def parse_lane_edge(sources, kind: str = "lane") -> Dict[str, float]:
+    """KPI meandata (laneData.xml/edgeData.xml) по хранилищу временных рядов meandata.py:
+    speed/occupancy есть только у элементов полос и рёбер, не у <interval>"""
+    m = {f"{kind}_speed_avg": 0.0, f"{kind}_occupancy_avg": 0.0, f"{kind}_density_avg": 0.0,
+         f"{kind}_time_loss": 0.0, f"{kind}_waiting_time": 0.0}
+    sources = as_sources(sources)
+    try:
+        store = MeanDataStore.combine([(MeanDataStore.from_source(path, kind), segment) for path, segment in sources])
+    except Exception as e:
+        print(f"Не удалось разобрать {', '.join(path for path, _ in sources)}: {e}")
+        return m
+    if store is None:
         return m
-    speeds, occs = [], []
+    m.update(store.summary(kind))
+    return m
+
+
+def parse_edge_data(sources) -> Dict[str, float]:
+    return parse_lane_edge(sources, "edge")
+
+
+# Секция KPI -> (выходной файл прогона, парсер)
+SECTIONS = {
+    "trip": ("tripinfos.xml", parse_tripinfos),
+    "summary": ("summary.xml", parse_summary),
+    "lane": ("laneData.xml", parse_lane_edge),
+    "edge": ("edgeData.xml", parse_edge_data),
+}
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_fingerprint(path: str, cached: Optional[Dict] = None) -> Dict:
+    """Отпечаток файла: размер, mtime и хэш содержимого.
+    Хэш пересчитывается только если размер или mtime отличаются от закэшированных.
+    """
+    if not os.path.exists(path):
+        return {"path": os.path.basename(path), "missing": True}
+    st = os.stat(path)
+    fp = {"path": os.path.basename(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if cached and cached.get("size") == fp["size"] and cached.get("mtime_ns") == fp["mtime_ns"]:
+        fp["hash"] = cached.get("hash")
+    else:
+        fp["hash"] = file_hash(path)
+    return fp
+
+
+def fingerprint_matches(fp: Dict, cached: Optional[Dict]) -> bool:
+    """Совпадение по содержимому: файл мог быть перезаписан без изменений (другой mtime)"""
+    if not cached:
+        return False
+    if fp.get("missing") or cached.get("missing"):
+        return fp.get("missing") == cached.get("missing") and fp["path"] == cached.get("path")
+    return fp["path"] == cached.get("path") and fp["size"] == cached.get("size") and fp["hash"] == cached.get("hash")
+
+
+def sources_fingerprint(sources: Sources, cached: Optional[Dict] = None) -> Dict:
+    """Отпечаток входа секции: файлы всех сегментов и их окна времени"""
+    cached_files = {fp.get("path"): fp for fp in (cached or {}).get("files", [])}
+    files = []
+    for path, segment in sources:
+        name = os.path.relpath(path, sources[0][1].directory)
+        fp = file_fingerprint(path, cached_files.get(name))
+        files.append(dict(fp, path=name))
+    return {"files": files, "windows": [[segment.begin, segment.end] for _, segment in sources]}
+
+
+def sources_match(fp: Dict, cached: Optional[Dict]) -> bool:
+    if not cached or fp["windows"] != cached.get("windows") or len(fp["files"]) != len(cached.get("files", [])):
+        return False
+    return all(fingerprint_matches(a, b) for a, b in zip(fp["files"], cached["files"]))
+
+
+def read_cache(run_path: str) -> Tuple[Dict, Dict]:
+    """(отпечатки, метрики) из кэша прогона; пустые словари, если кэша нет или он другой версии"""
+    path = os.path.join(run_path, CACHE_FILE)
     try:
-        for evt in ET.iterparse(path, events=("start",)):
-            tag = evt[1].tag
-            if tag.endswith("interval"):
-                # meandata intervals may have aggregated stats
-                sp = evt[1].get("speed")
-                oc = evt[1].get("occupancy")
-                if sp is not None:
-                    try:
-                        speeds.append(float(sp))
-                    except Exception:
-                        pass
-                if oc is not None:
-                    try:
-                        occs.append(float(oc))
-                    except Exception:
-                        pass
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["__meta__"]))
+            if meta.get("version") != CACHE_VERSION:
+                return {}, {}
+            metrics: Dict[str, Dict] = {}
+            for key in data.files:
+                if key == "__meta__":
+                    continue
+                section, name = key.split("/", 1)
+                value = data[key]
+                metrics.setdefault(section, {})[name] = value.item() if value.ndim == 0 else value
+            return meta.get("fingerprints", {}), metrics
     except Exception:
+        return {}, {}
+
+
+def write_cache(run_path: str, fingerprints: Dict, metrics: Dict):
+    """Метрики и массивы по интервалам в компактный npz (атомарная запись)"""
+    arrays = {"__meta__": np.array(json.dumps({"version": CACHE_VERSION, "fingerprints": fingerprints}))}
+    for section, values in metrics.items():
+        for name, value in values.items():
+            arrays[f"{section}/{name}"] = np.asarray(value)
+    path = os.path.join(run_path, CACHE_FILE)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Не удалось сохранить кэш KPI {path}: {e}")
+
+
+def load_run(run_path: str, use_cache: bool = True) -> Dict[str, Dict[str, float]]:
+    """KPI прогона. С кэшем перечитываются только секции, чьи входные файлы изменились.
+    Продолженный прогон собирается из сегментов: каждый файл даёт только своё окно времени."""
+    cached_fps, cached_metrics = read_cache(run_path) if use_cache else ({}, {})
+    result, fingerprints = {}, {}
+    stale = False
+    for section, (name, parser) in SECTIONS.items():
+        sources = segment_files(run_path, name)
+        if not use_cache:
+            result[section] = parser(sources)
+            continue
+        fp = sources_fingerprint(sources, cached_fps.get(section))
+        fingerprints[section] = fp
+        if section in cached_metrics and sources_match(fp, cached_fps.get(section)):
+            result[section] = cached_metrics[section]
+        else:
+            result[section] = parser(sources)
+            stale = True
+        if cached_fps.get(section) != fp:
+            stale = True
+    if use_cache and stale and os.path.isdir(run_path):
+        write_cache(run_path, fingerprints, result)
+    return result
+
+
+def scalar_kpi(result: Dict[str, Dict]) -> Dict[str, Dict[str, float]]:
+    """Только скалярные KPI прогона (без рядов по шагам) — для JSON"""
+    return {section: {name: value for name, value in values.items() if np.ndim(value) == 0}
+            for section, values in result.items()}
+
+
+def load_runs(run_paths: List[str], use_cache: bool = True) -> List[Dict[str, Dict[str, float]]]:
+    """Разбор нескольких прогонов параллельно (разбор XML упирается в CPU, поэтому процессы)"""
+    if len(run_paths) < 2:
+        return [load_run(p, use_cache) for p in run_paths]
+    workers = min(len(run_paths), os.cpu_count() or 1)
+    chunksize = max(1, len(run_paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(load_run, run_paths, [use_cache] * len(run_paths), chunksize=chunksize))
+
+
+def run_info(run_path: str) -> Dict:
+    """Режим, seed и масштаб спроса прогона: из scenario.json (runner.py), иначе из имени каталога"""
+    try:
+        with open(os.path.join(run_path, "scenario.json")) as f:
+            spec = json.load(f)
+        return {"mode": spec["mode"], "seed": spec.get("seed"), "scale": float(spec.get("scale", 1.0))}
+    except (OSError, ValueError, KeyError):
         pass
-    m["lane_speed_avg"] = sum(speeds) / len(speeds) if speeds else 0.0
-    m["lane_occupancy_avg"] = sum(occs) / len(occs) if occs else 0.0
-    return m
+    name = os.path.basename(os.path.normpath(run_path))
+    match = RUN_NAME_RE.match(name)
+    if match is None:
+        return {"mode": name, "seed": None, "scale": 1.0}
+    return {"mode": match["mode"], "seed": int(match["seed"]), "scale": float(match["scale"] or 1.0)}
 
 
-def load_run(run_path: str) -> Dict[str, Dict[str, float]]:
-    return {
-        "trip": parse_tripinfos(os.path.join(run_path, "tripinfos.xml")),
-        "summary": parse_summary(os.path.join(run_path, "summary.xml")),
-        "lane": parse_lane_edge(os.path.join(run_path, "laneData.xml")),
-        # edgeData.xml можно разобрать аналогично laneData.xml при необходимости
-    }
+def group_label(info: Dict) -> str:
+    return info["mode"] if info["scale"] == 1.0 else f"{info['mode']}_x{info['scale']:g}"
+
+
+def flatten_kpi(result: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """Скалярные KPI прогона: section.name -> значение"""
+    return {f"{section}.{name}": float(value) for section, values in result.items()
+            for name, value in values.items() if np.ndim(value) == 0}
+
+
+def t_quantile(p: float, df: int) -> float:
+    """Квантиль распределения Стьюдента: точно для df 1-2, разложение Корниша-Фишера (ошибка < 1%) для df >= 3"""
+    if df < 1:
+        return math.nan
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = stats.NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+def describe(values: np.ndarray, confidence: float) -> Dict[str, np.ndarray]:
+    """По столбцам (прогоны × KPI, NaN — нет значения): n, среднее, ст. отклонение и доверительный интервал среднего"""
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    filled = np.where(valid, values, 0.0)
+    mean = np.divide(filled.sum(axis=0), n, out=np.full(n.shape, np.nan), where=n > 0)
+    squares = np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+    std = np.sqrt(np.divide(squares, n - 1, out=np.full(n.shape, np.nan), where=n > 1))
+    t = np.array([t_quantile((1 + confidence) / 2, int(k) - 1) for k in n])
+    half = t * std / np.sqrt(np.maximum(n, 1))
+    return {"n": n, "mean": mean, "std": std, "ci_low": mean - half, "ci_high": mean + half}
+
+
+def compare_runs(run_paths: List[str], reference: str = "baseline", confidence: float = 0.95,
+                 use_cache: bool = True) -> Dict:
+    """Статистика KPI по группам прогонов (режим и масштаб спроса) и парные разности с группой reference
+    по совпадающим seed. Значения собираются в матрицы прогоны × KPI, статистики считаются по столбцам."""
+    results = load_runs(run_paths, use_cache)
+    infos = [run_info(path) for path in run_paths]
+    flat = [flatten_kpi(result) for result in results]
+    kpis = sorted({name for values in flat for name in values})
+    matrix = np.array([[values.get(name, np.nan) for name in kpis] for values in flat], dtype=np.float64).reshape(len(flat), len(kpis))
+    labels = np.array([group_label(info) for info in infos])
+    groups = {}
+    for label in sorted(set(labels.tolist())):
+        rows = np.flatnonzero(labels == label)
+        groups[label] = {"runs": [run_paths[k] for k in rows], **describe(matrix[rows], confidence)}
+    paired = {}
+    if reference in groups:
+        ref_rows = {(infos[k]["seed"], infos[k]["scale"]): k for k in np.flatnonzero(labels == reference)
+                    if infos[k]["seed"] is not None}
+        for label in groups:
+            if label == reference:
+                continue
+            pairs = [(k, ref_rows[(infos[k]["seed"], infos[k]["scale"])]) for k in np.flatnonzero(labels == label)
+                     if (infos[k]["seed"], infos[k]["scale"]) in ref_rows]
+            if not pairs:
+                continue
+            rows, ref = np.array(pairs).T
+            paired[f"{label}-{reference}"] = {"seeds": [infos[k]["seed"] for k in rows],
+                                              **describe(matrix[rows] - matrix[ref], confidence)}
+    return {"kpis": kpis, "confidence": confidence, "reference": reference, "groups": groups, "paired": paired}
+
+
+def _jsonable(block: Dict) -> Dict:
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in block.items()}
+
+
+def write_report(report: Dict, prefix: str) -> Tuple[str, str]:
+    """prefix.json (все статистики) и prefix.csv (строка на группу или пару и KPI)"""
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    json_path, csv_path = prefix + ".json", prefix + ".csv"
+    with open(json_path, "w") as f:
+        json.dump({"kpis": report["kpis"], "confidence": report["confidence"], "reference": report["reference"],
+                   "groups": {label: _jsonable(block) for label, block in report["groups"].items()},
+                   "paired": {label: _jsonable(block) for label, block in report["paired"].items()}}, f, indent=2)
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["kind", "group", "kpi", "n", "mean", "std", "ci_low", "ci_high"])
+        for kind in ("groups", "paired"):
+            for label, block in report[kind].items():
+                for k, kpi in enumerate(report["kpis"]):
+                    writer.writerow([kind[:-1] if kind == "groups" else kind, label, kpi, int(block["n"][k]),
+                                     *(f"{block[key][k]:.6g}" for key in ("mean", "std", "ci_low", "ci_high"))])
+    return json_path, csv_path
+
+
+def print_report(report: Dict):
+    """Таблица: среднее ± полуширина доверительного интервала по группам и парные разности (* — интервал без 0)"""
+    columns = [(label, block, False) for label, block in report["groups"].items()]
+    columns += [(label, block, True) for label, block in report["paired"].items()]
+    header = f"{'KPI':32}" + "".join(f"{label + ' (n=' + str(int(block['n'].max(initial=0))) + ')':>26}"
+                                     for label, block, _ in columns)
+    print(f"KPI statistics ({report['confidence']:.0%} CI):")
+    print(header)
+    for k, kpi in enumerate(report["kpis"]):
+        cells = []
+        for _, block, paired in columns:
+            mean, half = block["mean"][k], (block["ci_high"][k] - block["ci_low"][k]) / 2
+            mark = "*" if paired and (block["ci_low"][k] > 0 or block["ci_high"][k] < 0) else " "
+            cells.append(f"{fmt(mean) + ' ± ' + fmt(half) + mark:>26}" if not math.isnan(half)
+                         else f"{fmt(mean) + '  ':>26}")
+        print(f"{kpi:32}" + "".join(cells))
 
 
 def fmt(v: float) -> str:
@@ -145,13 +557,48 @@ def print_compare(name: str, base: float, opt: float, better_when_lower: bool =
     print(f"{name:24} base={fmt(base)}  opt={fmt(opt)}  diff={fmt(delta)} {sign}")
 
 
+def print_meandata_diff(base_dir: str, opt_dir: str, kind: str, metric: str, top: int):
+    """Худшие по изменению метрики рёбра/полосы и изменение по интервалам (opt относительно baseline)"""
+    base, opt = MeanDataStore.open(base_dir, kind), MeanDataStore.open(opt_dir, kind)
+    if base is None or opt is None:
+        print(f"{SOURCES[kind]} нет в {base_dir if base is None else opt_dir}")
+        return
+    better = "lower" if HIGHER_IS_WORSE[metric] else "higher"
+    print(f"\nWorst {kind}s by {metric} change (opt - base, mean over intervals, {better} is better):")
+    for object_id, mean_base, mean_opt, delta in top_changes(base, opt, metric, top):
+        print(f"  {object_id:40} base={fmt(mean_base)}  opt={fmt(mean_opt)}  diff={fmt(delta)}")
+    print(f"\n{metric} by interval ({kind}s):")
+    for begin, mean_base, mean_opt, delta in zip(*interval_deltas(base, opt, metric)):
+        print(f"  t={begin:7.0f}  base={fmt(mean_base)}  opt={fmt(mean_opt)}  diff={fmt(delta)}")
+
+
 def main():
-    base_dir = os.path.join("out", "baseline")
-    opt_dir = os.path.join("out", "opt")
-    if len(sys.argv) >= 3:
-        base_dir, opt_dir = sys.argv[1], sys.argv[2]
-    base = load_run(base_dir)
-    opt = load_run(opt_dir)
+    parser = argparse.ArgumentParser(description="KPI comparison between baseline and opt runs")
+    parser.add_argument("base_dir", nargs="?", default=os.path.join("out", "baseline"))
+    parser.add_argument("opt_dir", nargs="?", default=os.path.join("out", "opt"))
+    parser.add_argument("--no-cache", action="store_true", help=f"Не читать и не писать {CACHE_FILE}")
+    parser.add_argument("--top", type=int, default=0,
+                        help="Показать столько худших рёбер/полос по изменению --metric и изменение по интервалам")
+    parser.add_argument("--metric", choices=sorted(HIGHER_IS_WORSE), default="speed", help="Метрика для --top")
+    parser.add_argument("--kind", choices=sorted(SOURCES), default="edge", help="Рёбра (edgeData) или полосы (laneData)")
+    parser.add_argument("--runs", nargs="+", metavar="GLOB",
+                        help="Статистика по N прогонам (шаблоны каталогов, напр. 'out/runs/*'): группы по режиму, "
+                             "среднее, доверительный интервал и парные по seed разности с --reference")
+    parser.add_argument("--reference", default="baseline", help="Группа для парных разностей (--runs)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Уровень доверительного интервала (--runs)")
+    parser.add_argument("--report", default=os.path.join("out", "kpi_stats"),
+                        help="Префикс файлов отчёта --runs: <report>.json и <report>.csv")
+    args = parser.parse_args()
+    if args.runs:
+        run_paths = sorted({path for pattern in args.runs for path in glob.glob(pattern) if os.path.isdir(path)})
+        if not run_paths:
+            parser.error(f"нет каталогов прогонов по шаблонам: {' '.join(args.runs)}")
+        report = compare_runs(run_paths, args.reference, args.confidence, use_cache=not args.no_cache)
+        print_report(report)
+        json_path, csv_path = write_report(report, args.report)
+        print(f"Отчёт: {json_path}, {csv_path}")
+        return
+    base, opt = load_runs([args.base_dir, args.opt_dir], use_cache=not args.no_cache)
     print("KPI comparison (baseline vs opt):")
     print_compare("arrived", base["trip"]["arrived"], opt["trip"]["arrived"], better_when_lower=False)
     print_compare("avg travel time [s]", base["trip"]["avg_travel"], opt["trip"]["avg_travel"], True)
@@ -162,6 +609,10 @@ def main():
     print_compare("total waiting time [s]", base["summary"]["total_waiting_time"], opt["summary"]["total_waiting_time"], True)
     print_compare("lane speed avg [m/s]", base["lane"]["lane_speed_avg"], opt["lane"]["lane_speed_avg"], better_when_lower=False)
     print_compare("lane occupancy avg", base["lane"]["lane_occupancy_avg"], opt["lane"]["lane_occupancy_avg"], True)
+    print_compare("edge speed avg [m/s]", base["edge"]["edge_speed_avg"], opt["edge"]["edge_speed_avg"], better_when_lower=False)
+    print_compare("edge time loss [s]", base["edge"]["edge_time_loss"], opt["edge"]["edge_time_loss"], True)
+    if args.top > 0:
+        print_meandata_diff(args.base_dir, args.opt_dir, args.kind, args.metric, args.top)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,39 @@
+# backend.py: Выбор реализации TraCI — сокет (traci) или in-process (libsumo)
+# Все модули используют `from backend import traci`, поэтому API вызовов одинаков для обоих бэкендов.
+import importlib
+from config import BACKEND
+
+BACKENDS = ("traci", "libsumo")
+
+
+class _TraciProxy:
+    """Прокси на модуль traci/libsumo; атрибуты кэшируются после первого обращения"""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def use(self, name):
+        """Переключить бэкенд (до traci.start)"""
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown SUMO backend: {name}")
+        self.__dict__.clear()
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    @property
+    def name(self):
+        return self._name
+
+    def __getattr__(self, attr):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        value = getattr(module, attr)
+        # Кэшируем, чтобы горячий цикл не проходил через __getattr__ каждый раз
+        self.__dict__[attr] = value
+        return value
+
+
+traci = _TraciProxy(BACKEND)
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+# benchmark.py: бенчмарки горячих участков (near-miss и т.д.) на синтетических данных
+#   python3 benchmark.py near-miss --sizes 100 1000 5000 10000
+#   python3 benchmark.py solver --trials 500
+#   python3 benchmark.py mpc --candidates 500 2000 10000
+#   python3 benchmark.py scenario --multipliers 1 2 5 10 --baseline bench_baseline.json
+#   python3 benchmark.py startup --repeat 3 --max-first-step 2.0
+#   python3 benchmark.py risk-sampling --every 1 5 10 --adaptive
+
+import os
+import sys
+import json
+import time
+import heapq
+import argparse
+import platform
+import subprocess
+import contextlib
+import multiprocessing as mp
+import xml.etree.ElementTree as ET
+import numpy as np
+from config import PROXIMITY_THRESHOLD, SIM_STEPS, BACKEND
+from near_miss import compute_near_miss, TTC_THRESHOLD
+from phase_solver import PhaseObjective, AnalyticSolver, CvxpySolver
+from mpc import predict_delay, candidate_plans, cycle_lengths
+
+
+def synthetic_vehicles(n: int, density: float = 0.002, seed: int = 0):
+    """Случайные ТС на квадрате с постоянной плотностью (ТС на м²)"""
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(n / density)
+    positions = rng.uniform(0.0, side, size=(n, 2))
+    speeds = rng.uniform(0.0, 20.0, size=n)
+    return positions, speeds
+
+
+def brute_force_near_miss(positions, speeds):
+    """Эталон: исходный O(n²) перебор пар"""
+    near_miss_count = 0
+    risk_metrics = []
+    n = len(positions)
+    for i in range(n):
+        for j in range(i + 1, n):
+            dist = np.linalg.norm(positions[i] - positions[j])
+            if dist > PROXIMITY_THRESHOLD:
+                continue
+            rel_speed = abs(speeds[i] - speeds[j])
+            if rel_speed > 0 and dist / rel_speed < TTC_THRESHOLD:
+                near_miss_count += 1
+                risk_metrics.append(dist / rel_speed)
+    avg_risk = np.mean(risk_metrics) if risk_metrics else 0
+    return near_miss_count, avg_risk
+
+
+def time_call(fn, *args, repeat: int = 5) -> float:
+    """Медианное время вызова (сек)"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def bench_near_miss(args) -> int:
+    # Проверка совпадения с эталоном на небольших выборках
+    for seed in range(5):
+        positions, speeds = synthetic_vehicles(300, args.density, seed)
+        ref = brute_force_near_miss(positions, speeds)
+        got = compute_near_miss(positions, speeds)
+        if ref[0] != got[0] or not np.isclose(ref[1], got[1]):
+            print(f"MISMATCH seed={seed}: brute={ref} grid={got}")
+            return 1
+    print("near-miss: grid == brute force on 5 random sets of 300 vehicles")
+    print(f"{'vehicles':>10} {'grid [ms]':>12} {'brute [ms]':>12} {'near-miss':>10}")
+    for n in args.sizes:
+        positions, speeds = synthetic_vehicles(n, args.density)
+        t_grid = time_call(compute_near_miss, positions, speeds, repeat=args.repeat)
+        brute = "-"
+        if n <= args.brute_max:
+            brute = f"{time_call(brute_force_near_miss, positions, speeds, repeat=1) * 1000:.1f}"
+        count, _ = compute_near_miss(positions, speeds)
+        print(f"{n:>10} {t_grid * 1000:>12.2f} {brute:>12} {count:>10}")
+    return 0
+
+
+def bench_solver(args) -> int:
+    """Время аналитического решателя и cvxpy на случайных линейных задачах
+    (эквивалентность решений проверяет tests/test_phase_solver.py)"""
+    rng = np.random.default_rng(args.seed)
+    analytic, cvx = AnalyticSolver(), CvxpySolver()
+    t_analytic, t_cvxpy = [], []
+    for trial in range(args.trials):
+        num_phases = int(rng.integers(2, 9))
+        lo = int(rng.integers(1, 10))
+        hi = lo + int(rng.integers(1, 60))
+        total = int(rng.integers(num_phases * lo, num_phases * hi + 1))
+        objective = PhaseObjective(linear=rng.normal(size=num_phases), constant=float(rng.integers(0, 100)))
+        t0 = time.perf_counter()
+        analytic.solve(objective, None, lo, hi, total)
+        t_analytic.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        cvx.solve(objective, None, lo, hi, total)
+        t_cvxpy.append(time.perf_counter() - t0)
+    print(f"analytic: median {np.median(t_analytic) * 1e6:.1f} us | cvxpy: median {np.median(t_cvxpy) * 1e3:.2f} ms "
+          f"({args.trials} random problems)")
+    return 0
+
+
+def step_queue_delay(plan, queues, arrivals, green, horizon, saturation_flow, dt=0.01):
+    """Эталон: та же модель очередей, проинтегрированная мелким шагом по времени на horizon секунд"""
+    q = np.array(queues, dtype=np.float64)
+    delay = 0.0
+    steps = int(round(horizon / dt))
+    phases = np.repeat(np.arange(len(plan)), np.rint(np.asarray(plan) / dt).astype(np.int64))
+    for k in range(steps):
+        rate = arrivals - saturation_flow * green[phases[k % len(phases)]]
+        q_next = np.maximum(0.0, q + rate * dt)
+        delay += 0.5 * (q + q_next).sum() * dt
+        q = q_next
+    return delay
+
+
+def bench_mpc(args) -> int:
+    """Точность модели очередей (против пошагового интегрирования) и время оценки планов"""
+    rng = np.random.default_rng(args.seed)
+    num_phases, num_lanes = 6, 8
+    green = rng.random((num_phases, num_lanes)) < 0.35
+    queues = rng.integers(0, 15, num_lanes).astype(np.float64)
+    arrivals = rng.uniform(0.0, 0.15, num_lanes)
+    free = np.ones(num_phases, dtype=bool)
+    base = np.full(num_phases, 20.0)
+    plans = candidate_plans(base, free, 20, rng, total=cycle_lengths(base, free))
+    got = predict_delay(plans, queues, arrivals, green, args.horizon)
+    ref = np.array([step_queue_delay(plan, queues, arrivals, green, args.horizon, 0.5) for plan in plans])
+    if not np.allclose(got, ref, rtol=1e-3):
+        print(f"MISMATCH: model={got[:5]} reference={ref[:5]}")
+        return 1
+    print(f"mpc: queue model == time-stepped integration on {len(plans)} plans")
+    print(f"{'candidates':>10} {'plans [ms]':>12} {'predict [ms]':>13}")
+    for count in args.candidates:
+        cycles = cycle_lengths(base, free)
+        t_plans = time_call(lambda: candidate_plans(base, free, count, rng, total=cycles), repeat=args.repeat)
+        plans = candidate_plans(base, free, count, rng, total=cycles)
+        t_predict = time_call(predict_delay, plans, queues, arrivals, green, args.horizon, repeat=args.repeat)
+        print(f"{count:>10} {t_plans * 1000:>12.2f} {t_predict * 1000:>13.2f}")
+    return 0
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TRIPS_FILE = os.path.join(ROOT_DIR, "osm.passenger.trips.xml")
+# Метрики сравнения с эталоном: путь в результатах и направление (True — больше лучше)
+REGRESSION_METRICS = [
+    ("steps_per_sec", True),
+    ("near_miss_ms.p95", False),
+    ("optimizer_ms_p95", False),
+    ("peak_rss_mb", False),
+]
+
+
+def scale_trips(src, dst, multiplier, spread):
+    """Потоковая перезапись маршрутов: каждая поездка повторяется multiplier раз со сдвигом отправления
+    на k * spread / multiplier сек. Файл читается iterparse, копии ждут своей очереди в куче, так что
+    порядок отправлений сохраняется, а в памяти только поездки в пределах окна spread."""
+    pending = []  # (depart, seq, xml)
+    seq = 0
+    trips = 0
+    with open(src, "rb") as f_in, open(dst, "w") as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n<routes>\n')
+        depth = 0
+        for event, elem in ET.iterparse(f_in, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            elem.tail = None
+            if elem.tag != "trip":
+                out.write("    " + ET.tostring(elem, encoding="unicode") + "\n")
+                elem.clear()
+                continue
+            depart = float(elem.get("depart"))
+            # Всё, что отправляется не позже текущей поездки, уже можно писать
+            while pending and pending[0][0] <= depart:
+                out.write(heapq.heappop(pending)[2])
+            base_id = elem.get("id")
+            for k in range(multiplier):
+                elem.set("id", base_id if k == 0 else f"{base_id}_x{k}")
+                elem.set("depart", f"{depart + k * spread / multiplier:.2f}")
+                heapq.heappush(pending, (depart + k * spread / multiplier, seq,
+                                         "    " + ET.tostring(elem, encoding="unicode") + "\n"))
+                seq += 1
+            trips += 1
+            elem.clear()
+        while pending:
+            out.write(heapq.heappop(pending)[2])
+        out.write("</routes>\n")
+    return trips * multiplier
+
+
+def trip_headway(path):
+    """Средний интервал между отправлениями в исходном файле поездок"""
+    departs = []
+    for _, elem in ET.iterparse(path):
+        if elem.tag == "trip":
+            departs.append(float(elem.get("depart")))
+            elem.clear()
+    if len(departs) < 2:
+        return 1.0
+    return (max(departs) - min(departs)) / (len(departs) - 1)
+
+
+def _scenario_run(spec):
+    """Один прогон main.run_simulation в чистом процессе: пропускная способность, near-miss, оптимизатор, RSS"""
+    import resource
+    os.chdir(ROOT_DIR)
+    import main
+    from recorder import load_table
+    os.makedirs(spec["output_dir"], exist_ok=True)
+    argv = ["--mode", spec["mode"], "--backend", spec["backend"], "--steps", str(spec["steps"]),
+            "--output-dir", spec["output_dir"], "--route-files", spec["route_file"],
+            "--non-interactive", "--no-gui", "--profile", "--no-export-csv"]
+    with open(os.path.join(spec["output_dir"], "run.log"), "w") as log, contextlib.redirect_stdout(log):
+        t0 = time.perf_counter()
+        result = main.run_simulation(argv)
+        wall = time.perf_counter() - t0
+    report = result["profiler"].report()
+    loop_sec = sum(st["total_ms"] for st in report.values()) / 1000
+    vehicles = load_table(spec["output_dir"], "step_metrics")["vehicles"]
+    near_ms = np.frombuffer(result["profiler"].samples["near_miss"], dtype=np.int64) / 1e6
+    n = min(len(vehicles), len(near_ms))
+    vehicles, near_ms = vehicles[:n], near_ms[:n]
+    # Время near-miss по диапазонам числа ТС (квантильные корзины) и наклон линейной аппроксимации
+    by_vehicles = []
+    edges = np.unique(np.quantile(vehicles, np.linspace(0, 1, 6)).round())
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        mask = (vehicles >= lo) & ((vehicles < hi) if hi < edges[-1] else (vehicles <= hi))
+        if mask.any():
+            by_vehicles.append({"vehicles": [int(lo), int(hi)], "steps": int(mask.sum()),
+                                "mean_ms": round(float(near_ms[mask].mean()), 4)})
+    slope = float(np.polyfit(vehicles, near_ms, 1)[0]) * 100 if np.ptp(vehicles) > 0 else 0.0
+    optimizer = result["optimizer"] or {}
+    rss_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        "multiplier": spec["multiplier"],
+        "trips": spec["trips"],
+        "steps": result["steps"],
+        "wall_sec": round(wall, 3),
+        "steps_per_sec": round(result["steps"] / loop_sec, 1) if loop_sec else None,
+        "vehicles_mean": round(float(vehicles.mean()), 1),
+        "vehicles_max": int(vehicles.max()),
+        "near_miss_ms": {k: report["near_miss"][f"{k}_ms"] for k in ("mean", "p50", "p95")},
+        "near_miss_ms_per_100_vehicles": round(slope, 4),
+        "near_miss_by_vehicles": by_vehicles,
+        "optimizer_ms_p95": optimizer.get("wall_ms_p95"),
+        "optimizer": optimizer,
+        "peak_rss_mb": round(rss_kb / 1024, 1),
+        "total_delay": result["total_delay"],
+        "total_near_miss": result["total_near_miss"],
+    }
+
+
+def _metric(entry, path):
+    for key in path.split("."):
+        if not isinstance(entry, dict) or entry.get(key) is None:
+            return None
+        entry = entry[key]
+    return entry
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Регрессии относительно эталона: [(множитель, метрика, эталон, текущее)]"""
+    regressions = []
+    print(f"{'x':>4} {'metric':20} {'baseline':>12} {'current':>12} {'change':>8}")
+    for mult, entry in results.items():
+        base_entry = baseline.get(mult)
+        if base_entry is None:
+            continue
+        for path, higher_is_better in REGRESSION_METRICS:
+            base, cur = _metric(base_entry, path), _metric(entry, path)
+            if base is None or cur is None or base == 0:
+                continue
+            change = (cur - base) / base
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            print(f"{mult:>4} {path:20} {base:>12} {cur:>12} {change * 100:>7.1f}%{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append((mult, path, base, cur))
+    return regressions
+
+
+def bench_scenario(args) -> int:
+    """Прогоны osm-сценария с кратным спросом; результаты в JSON и сравнение с эталоном"""
+    os.makedirs(args.out, exist_ok=True)
+    # Копии поездки распределяются внутри среднего интервала отправлений: форма спроса во времени сохраняется
+    spread = trip_headway(args.trips)
+    specs = []
+    for mult in args.multipliers:
+        route_file = os.path.abspath(os.path.join(args.out, f"trips_x{mult}.xml"))
+        trips = scale_trips(args.trips, route_file, mult, spread)
+        specs.append({"multiplier": mult, "trips": trips, "route_file": route_file, "mode": args.mode,
+                      "backend": args.backend, "steps": args.steps,
+                      "output_dir": os.path.abspath(os.path.join(args.out, f"x{mult}"))})
+    results = {}
+    # Прогоны по очереди (параллельные исказят пропускную способность), каждый в чистом процессе
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+        for entry in pool.imap(_scenario_run, specs):
+            results[str(entry["multiplier"])] = entry
+            print(f"x{entry['multiplier']:<3} trips={entry['trips']:<6} {entry['steps_per_sec']} steps/s, "
+                  f"vehicles max {entry['vehicles_max']}, near-miss p95 {entry['near_miss_ms']['p95']} ms, "
+                  f"optimizer p95 {entry['optimizer_ms_p95']} ms, peak RSS {entry['peak_rss_mb']} MB")
+    meta = {"python": platform.python_version(), "platform": platform.platform(), "backend": args.backend,
+            "mode": args.mode, "steps": args.steps, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    path = os.path.join(args.out, "bench_results.json")
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Результаты: {path}")
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"Эталон обновлён: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"Эталон {args.baseline} не найден (создать: --update-baseline)")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Регрессий: {len(regressions)} (допуск {args.tolerance * 100:.0f}%)")
+        return 1
+    print("Регрессий нет")
+    return 0
+
+
+# Необязательные подсистемы, которые не должны загружаться на пути до первого шага
+HEAVY_MODULES = ("matplotlib", "cvxpy", "scipy", "pandas")
+
+# Запуск в чистом интерпретаторе: время импорта main, время до первого шага, загруженные тяжёлые модули
+_STARTUP_SCRIPT = """
+import sys, time, json, contextlib, io
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter() - t0
+with contextlib.redirect_stdout(io.StringIO()):
+    result = main.run_simulation(sys.argv[1:])
+print("STARTUP " + json.dumps({"import_sec": t_import, "first_step_sec": result["time_to_first_step"],
+                               "total_sec": time.perf_counter() - t0,
+                               "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def bench_startup(args) -> int:
+    """Время импорта и до первого шага (чистый процесс на каждый запуск) по режимам и бэкендам"""
+    failures = []
+    print(f"{'mode':9} {'backend':8} {'import s':>9} {'first step s':>13} {'total s':>8}  heavy modules")
+    for mode in args.modes:
+        for backend in args.backends:
+            runs = []
+            for r in range(args.repeat):
+                output_dir = os.path.abspath(os.path.join(args.out, f"{mode}_{backend}"))
+                cmd = [sys.executable, "-c", _STARTUP_SCRIPT, "--mode", mode, "--backend", backend, "--steps", "1",
+                       "--output-dir", output_dir, "--non-interactive", "--no-gui", "--no-plot", "--no-export-csv"]
+                proc = subprocess.run(cmd, cwd=ROOT_DIR, capture_output=True, text=True)
+                lines = [line for line in proc.stdout.splitlines() if line.startswith("STARTUP ")]
+                if proc.returncode != 0 or not lines:
+                    print(proc.stderr[-2000:])
+                    failures.append((mode, backend, "run failed"))
+                    break
+                runs.append(json.loads(lines[-1][len("STARTUP "):]))
+            if not runs:
+                continue
+            # Медиана по повторам: первый запуск платит за холодный дисковый кэш
+            med = {key: float(np.median([run[key] for run in runs])) for key in ("import_sec", "first_step_sec", "total_sec")}
+            heavy = sorted({m for run in runs for m in run["heavy"]})
+            print(f"{mode:9} {backend:8} {med['import_sec']:>9.3f} {med['first_step_sec']:>13.3f} {med['total_sec']:>8.3f}  "
+                  f"{', '.join(heavy) or '-'}")
+            if heavy:
+                failures.append((mode, backend, f"heavy modules loaded: {', '.join(heavy)}"))
+            if args.max_first_step is not None and med["first_step_sec"] > args.max_first_step:
+                failures.append((mode, backend, f"first step {med['first_step_sec']:.3f}s > {args.max_first_step}s"))
+    for mode, backend, reason in failures:
+        print(f"FAIL {mode}/{backend}: {reason}")
+    return 1 if failures else 0
+
+
+def _risk_sampling_run(spec):
+    """Прогон с выборочным поиском near-miss в чистом процессе: стоимость стадии near_miss и итоги"""
+    os.chdir(ROOT_DIR)
+    import main
+    from recorder import load_table
+    argv = ["--mode", spec["mode"], "--backend", spec["backend"], "--steps", str(spec["steps"]),
+            "--output-dir", spec["output_dir"], "--risk-every", str(spec["every"]),
+            "--risk-adaptive" if spec["adaptive"] else "--no-risk-adaptive",
+            "--non-interactive", "--no-gui", "--profile", "--no-export-csv", "--no-plot"]
+    os.makedirs(spec["output_dir"], exist_ok=True)
+    with open(os.path.join(spec["output_dir"], "run.log"), "w") as log, contextlib.redirect_stdout(log):
+        result = main.run_simulation(argv)
+    report = result["profiler"].report()
+    risk = load_table(spec["output_dir"], "step_metrics")["risk"]
+    return {"every": spec["every"], "adaptive": spec["adaptive"], "steps": result["steps"],
+            "sampled_share": (result["risk_sampling"] or {}).get("sampled_share", 1.0),
+            "near_miss_ms_total": report["near_miss"]["total_ms"], "total_near_miss": result["total_near_miss"],
+            "total_delay": result["total_delay"], "mean_risk": float(risk.mean()) if len(risk) else 0.0}
+
+
+def bench_risk_sampling(args) -> int:
+    """Выборочный поиск near-miss: стоимость стадии near_miss и отклонение итогов от поиска на каждом шаге"""
+    specs = [{"every": k, "adaptive": adaptive} for k in sorted(set([1] + args.every))
+             for adaptive in ([False, True] if args.adaptive and k > 1 else [False])]
+    for spec in specs:
+        spec.update(mode=args.mode, backend=args.backend, steps=args.steps, output_dir=os.path.abspath(
+            os.path.join(args.out, f"every{spec['every']}{'_adaptive' if spec['adaptive'] else ''}")))
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+        results = list(pool.imap(_risk_sampling_run, specs))
+    exact = results[0]
+    print(f"{'every':>5} {'adaptive':>8} {'sampled':>8} {'near-miss ms':>13} {'near-miss':>10} {'error':>7} "
+          f"{'mean risk':>10} {'delay':>10}")
+    for entry in results:
+        error = (entry["total_near_miss"] - exact["total_near_miss"]) / exact["total_near_miss"] \
+            if exact["total_near_miss"] else 0.0
+        entry["near_miss_error"] = round(error, 4)
+        print(f"{entry['every']:>5} {str(entry['adaptive']):>8} {entry['sampled_share']:>8.3f} "
+              f"{entry['near_miss_ms_total']:>13.1f} {entry['total_near_miss']:>10} {error * 100:>6.1f}% "
+              f"{entry['mean_risk']:>10.4f} {entry['total_delay']:>10.0f}")
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, "risk_sampling.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Результаты: {path}")
+    failed = [entry for entry in results if abs(entry["near_miss_error"]) > args.tolerance]
+    for entry in failed:
+        print(f"FAIL every={entry['every']} adaptive={entry['adaptive']}: "
+              f"near-miss error {entry['near_miss_error'] * 100:.1f}% > {args.tolerance * 100:.0f}%")
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the simulation hot path")
+    sub = parser.add_subparsers(dest="command", required=True)
+    nm = sub.add_parser("near-miss", help="Масштабирование detect_near_miss по числу ТС")
+    nm.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000, 10000])
+    nm.add_argument("--density", type=float, default=0.002, help="Плотность ТС на м²")
+    nm.add_argument("--repeat", type=int, default=5)
+    nm.add_argument("--brute-max", type=int, default=1000, help="Максимум ТС для O(n²) эталона")
+    nm.set_defaults(func=bench_near_miss)
+    sv = sub.add_parser("solver", help="Время аналитического решателя фаз и cvxpy")
+    sv.add_argument("--trials", type=int, default=200)
+    sv.add_argument("--seed", type=int, default=0)
+    sv.set_defaults(func=bench_solver)
+    mc = sub.add_parser("mpc", help="Модель очередей MPC: точность и время оценки кандидатов")
+    mc.add_argument("--candidates", type=int, nargs="+", default=[500, 2000, 10000])
+    mc.add_argument("--horizon", type=float, default=300, help="Горизонт прогноза, сек")
+    mc.add_argument("--repeat", type=int, default=5)
+    mc.add_argument("--seed", type=int, default=0)
+    mc.set_defaults(func=bench_mpc)
+    sc = sub.add_parser("scenario", help="osm-сценарий с кратным спросом: steps/s, near-miss, оптимизатор, RSS")
+    sc.add_argument("--multipliers", type=int, nargs="+", default=[1, 2, 5, 10])
+    sc.add_argument("--steps", type=int, default=SIM_STEPS)
+    sc.add_argument("--mode", choices=["baseline", "opt"], default="opt")
+    sc.add_argument("--backend", choices=["traci", "libsumo"], default=BACKEND)
+    sc.add_argument("--trips", default=TRIPS_FILE, help="Исходный файл поездок")
+    sc.add_argument("--out", default=os.path.join("out", "bench"))
+    sc.add_argument("--baseline", default="bench_baseline.json", help="Эталонные результаты для сравнения")
+    sc.add_argument("--update-baseline", action="store_true", help="Сохранить текущие результаты как эталон")
+    sc.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение (доля)")
+    sc.set_defaults(func=bench_scenario)
+    st = sub.add_parser("startup", help="Время импорта и до первого шага в чистом процессе")
+    st.add_argument("--modes", nargs="+", choices=["baseline", "opt"], default=["baseline", "opt"])
+    st.add_argument("--backends", nargs="+", choices=["traci", "libsumo"], default=["traci", "libsumo"])
+    st.add_argument("--repeat", type=int, default=3)
+    st.add_argument("--max-first-step", type=float, default=None, help="Бюджет времени до первого шага (сек), иначе код 1")
+    st.add_argument("--out", default=os.path.join("out", "bench_startup"))
+    st.set_defaults(func=bench_startup)
+    rs = sub.add_parser("risk-sampling", help="Поиск near-miss каждые K шагов: стоимость и точность итогов")
+    rs.add_argument("--every", type=int, nargs="+", default=[2, 5, 10])
+    rs.add_argument("--adaptive", action="store_true", help="Также адаптивный режим для каждого K")
+    rs.add_argument("--steps", type=int, default=SIM_STEPS)
+    rs.add_argument("--mode", choices=["baseline", "opt"], default="opt")
+    rs.add_argument("--backend", choices=["traci", "libsumo"], default=BACKEND)
+    rs.add_argument("--tolerance", type=float, default=0.25, help="Допустимое отклонение итога near-miss (доля)")
+    rs.add_argument("--out", default=os.path.join("out", "bench_risk"))
+    rs.set_defaults(func=bench_risk_sampling)
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
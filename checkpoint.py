@@ -0,0 +1,155 @@
+# checkpoint.py: Контрольные точки длинных прогонов и продолжение (--resume)
+# Точка = состояние SUMO (saveState с генераторами случайных чисел) + установленные программы opt_N
+# (additional-файл tlLogic) + состояние контроллера, счётчиков и частей выходных файлов (pickle).
+# Продолжение запускает SUMO с --load-state: маршруты с отправлением до момента состояния не загружаются
+# повторно, поэтому продолженный прогон совпадает с непрерывным. Выходные файлы контроллера ротируются на каждой
+# точке, так что записанное до неё уже закрыто, а записанное после (до сбоя) при продолжении удаляется. Файлы SUMO
+# продолженного прогона пишутся в новый сегмент resume_NNNNNNN/ (segments.py). Продолженный SUMO начинает
+# интервалы meandata (edgeData/laneData) заново с момента состояния, поэтому точка ставится только на границе
+# интервалов: сетка интервалов продолженного прогона совпадает с непрерывным.
+import os
+import json
+import gzip
+import pickle
+import shutil
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+from backend import traci
+from config import CHECKPOINT_KEEP, SUMOCFG_FILE
+
+CHECKPOINT_DIR = "checkpoints"
+LATEST_FILE = "latest.json"
+STATE_FILE = "state.xml.gz"
+PROGRAMS_FILE = "programs.add.xml"
+PAYLOAD_FILE = "controller.pkl"
+CHECKPOINT_VERSION = 2
+# Опции SUMO, без которых состояние не воспроизводит прогон точно (случайные числа, точность скоростей)
+STATE_OPTIONS = ["--save-state.rng", "--save-state.precision", "17"]
+# Тип программы traci.trafficlight.Logic -> атрибут type tlLogic
+TLS_TYPES = {0: "static", 3: "actuated", 4: "NEMA", 5: "delay_based"}
+MEANDATA_TAGS = ("edgeData", "laneData")
+
+
+def config_additional_files(sumocfg=SUMOCFG_FILE):
+    """Additional-файлы из конфига SUMO (абсолютные пути): --additional-files в командной строке их заменяет"""
+    elem = ET.parse(sumocfg).getroot().find("input/additional-files")
+    config_dir = os.path.dirname(os.path.abspath(sumocfg))
+    files = elem.get("value", "").split(",") if elem is not None else []
+    return [os.path.join(config_dir, name.strip()) for name in files if name.strip()]
+
+
+def meandata_grids(files):
+    """Сетки интервалов meandata из additional-файлов: [(begin, period)]"""
+    grids = []
+    for path in files:
+        try:
+            with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+                for _, elem in ET.iterparse(f):
+                    if elem.tag in MEANDATA_TAGS:
+                        period = float(elem.get("period", elem.get("freq", "0")) or 0)
+                        if period > 0:
+                            grids.append((float(elem.get("begin", "0") or 0), period))
+                    elem.clear()
+        except (OSError, ET.ParseError, ValueError):
+            continue
+    return grids
+
+
+def on_grid(time, grids):
+    """Время на границе интервалов всех сеток (до begin сетки интервалов ещё нет)"""
+    return all(time <= begin or (time - begin) % period == 0 for begin, period in grids)
+
+
+def write_programs(path, programs):
+    """additional-файл с программами [(tls_id, LogicInfo)]"""
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" ?>\n<additional>\n')
+        for tls_id, logic in programs:
+            f.write(f'    <tlLogic id={quoteattr(tls_id)} type="{TLS_TYPES.get(logic.type, "static")}" '
+                    f'programID={quoteattr(logic.programID)} offset="0">\n')
+            for phase in logic.phases:
+                name = f" name={quoteattr(phase.name)}" if phase.name else ""
+                f.write(f'        <phase duration="{phase.duration}" state={quoteattr(phase.state)} '
+                        f'minDur="{phase.minDur}" maxDur="{phase.maxDur}"{name}/>\n')
+            f.write('    </tlLogic>\n')
+        f.write('</additional>\n')
+
+
+def latest_checkpoint(output_dir):
+    """Последняя контрольная точка каталога прогона: payload (+ "directory") или None"""
+    directory = os.path.join(output_dir, CHECKPOINT_DIR)
+    try:
+        with open(os.path.join(directory, LATEST_FILE)) as f:
+            latest = json.load(f)
+        path = os.path.join(directory, latest["directory"])
+        with open(os.path.join(path, PAYLOAD_FILE), "rb") as f:
+            payload = pickle.load(f)
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+        return None
+    if payload.get("version") != CHECKPOINT_VERSION:
+        return None
+    payload["directory"] = path
+    return payload
+
+
+def resume_options(checkpoint):
+    """Опции SUMO для продолжения: состояние и программы opt_N (вместе с additional-файлами конфига)"""
+    directory = checkpoint["directory"]
+    additional = config_additional_files() + [os.path.join(directory, PROGRAMS_FILE)]
+    return ["--load-state", os.path.join(directory, STATE_FILE), "--additional-files", ",".join(additional)]
+
+
+class Checkpointer:
+    """Сохранение контрольных точек каждые interval шагов в output_dir/checkpoints/step_NNNNNNN/.
+    sumo_dir — каталог --output-prefix SUMO (None — без префикса). Точка откладывается до ближайшей границы
+    интервалов meandata (grids, по умолчанию — из additional-файлов конфига)."""
+
+    def __init__(self, output_dir, interval, tls_index, tls_ids, sumo_dir=None, keep=CHECKPOINT_KEEP, step=0,
+                 grids=None):
+        self.directory = os.path.join(output_dir, CHECKPOINT_DIR)
+        self.interval = int(interval)
+        self.sumo_dir = sumo_dir
+        self.keep = max(1, int(keep))
+        self.tls_ids = list(tls_ids)
+        # Программы из сети: в additional-файл попадают только установленные во время прогона
+        self.initial_programs = {tls_id: set(tls_index.programs(tls_id)) for tls_id in self.tls_ids}
+        self.next_step = step + self.interval
+        self.saved = 0
+        self.grids = meandata_grids(config_additional_files()) if grids is None else list(grids)
+
+    def due(self, step):
+        if self.interval <= 0 or step < self.next_step:
+            return False
+        return not self.grids or on_grid(traci.simulation.getTime(), self.grids)
+
+    def _save_state(self, path):
+        # SUMO дописывает --output-prefix к имени файла состояния: сохраняем по имени и переносим
+        if self.sumo_dir is None:
+            traci.simulation.saveState(path)
+            return
+        traci.simulation.saveState(STATE_FILE)
+        shutil.move(os.path.join(self.sumo_dir, STATE_FILE), path)
+
+    def save(self, step, tls_index, payload):
+        """Точка после step шагов: состояние SUMO, программы и payload (состояние контроллера и выходных файлов)"""
+        name = f"step_{step:07d}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        self._save_state(os.path.join(path, STATE_FILE))
+        write_programs(os.path.join(path, PROGRAMS_FILE),
+                       [(tls_id, logic) for tls_id in self.tls_ids for program_id, logic in tls_index.programs(tls_id).items()
+                        if program_id not in self.initial_programs[tls_id]])
+        payload = dict(payload, version=CHECKPOINT_VERSION, step=step)
+        with open(os.path.join(path, PAYLOAD_FILE + ".tmp"), "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(os.path.join(path, PAYLOAD_FILE + ".tmp"), os.path.join(path, PAYLOAD_FILE))
+        # Указатель на последнюю точку меняется атомарно, когда все её файлы уже на диске
+        latest = os.path.join(self.directory, LATEST_FILE)
+        with open(latest + ".tmp", "w") as f:
+            json.dump({"step": step, "directory": name}, f)
+        os.replace(latest + ".tmp", latest)
+        for old in sorted(d for d in os.listdir(self.directory) if d.startswith("step_"))[:-self.keep]:
+            shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+        self.next_step = step + self.interval
+        self.saved += 1
+        print(f"Step {step}: контрольная точка {path}")
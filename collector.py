@@ -0,0 +1,70 @@
+# collector.py: Сбор данных шага через подписки TraCI (один bulk-запрос на шаг)
+from typing import NamedTuple, Tuple
+import numpy as np
+from backend import traci
+import traci.constants as tc
+
+# Переменные ТС, на которые подписываемся при отправлении
+VEHICLE_VARS = (tc.VAR_POSITION, tc.VAR_SPEED, tc.VAR_WAITING_TIME, tc.VAR_LANE_ID, tc.VAR_ANGLE)
+# Геттеры тех же переменных: значения ТС в шаге отправления, если подписка их ещё не вернула
+VEHICLE_GETTERS = {tc.VAR_POSITION: "getPosition", tc.VAR_SPEED: "getSpeed", tc.VAR_WAITING_TIME: "getWaitingTime",
+                   tc.VAR_LANE_ID: "getLaneID", tc.VAR_ANGLE: "getAngle"}
+# Переменные светофоров
+TLS_VARS = (tc.TL_CURRENT_PHASE,)
+
+
+class StepSnapshot(NamedTuple):
+    """Состояние всех ТС и отслеживаемых светофоров на текущем шаге"""
+    ids: Tuple[str, ...]
+    positions: np.ndarray   # (n, 2)
+    speeds: np.ndarray      # (n,)
+    waiting: np.ndarray     # (n,)
+    lanes: Tuple[str, ...]
+    angles: np.ndarray      # (n,)
+    tls_phases: np.ndarray  # (m,) — текущая фаза, выровнена по tls_ids коллектора
+
+
+class StepCollector:
+    """Подписывает ТС при отправлении и светофоры при старте, собирает снимок шага"""
+
+    def __init__(self, tls_ids=()):
+        self.tls_ids = tuple(tls_ids)
+        # Список отправившихся ТС получаем той же подпиской, без отдельного запроса
+        traci.simulation.subscribe([tc.VAR_DEPARTED_VEHICLES_IDS])
+        # ТС, уже находящиеся в сети на момент старта
+        for veh in traci.vehicle.getIDList():
+            traci.vehicle.subscribe(veh, VEHICLE_VARS)
+        for tls_id in self.tls_ids:
+            traci.trafficlight.subscribe(tls_id, TLS_VARS)
+
+    def step(self) -> StepSnapshot:
+        """Вызывать после traci.simulationStep(): подписывает новые ТС и возвращает снимок.
+        ТС, отправившиеся на этом шаге, входят в снимок сразу (как в цикле по getIDList)."""
+        departed = traci.simulation.getSubscriptionResults().get(tc.VAR_DEPARTED_VEHICLES_IDS, ())
+        for veh in departed:
+            traci.vehicle.subscribe(veh, VEHICLE_VARS)
+        # Подписки прибывших ТС SUMO удаляет сам
+        results = traci.vehicle.getAllSubscriptionResults()
+        # Ответ на subscribe обычно уже содержит значения шага; иначе — один раз через геттеры
+        missing = [veh for veh in departed if veh not in results]
+        if missing:
+            results = dict(results)
+            for veh in missing:
+                results[veh] = {var: getattr(traci.vehicle, getter)(veh) for var, getter in VEHICLE_GETTERS.items()}
+        n = len(results)
+        ids = tuple(results.keys())
+        positions = np.empty((n, 2), dtype=np.float64)
+        speeds = np.empty(n, dtype=np.float64)
+        waiting = np.empty(n, dtype=np.float64)
+        angles = np.empty(n, dtype=np.float64)
+        lanes = []
+        for k, values in enumerate(results.values()):
+            positions[k] = values[tc.VAR_POSITION]
+            speeds[k] = values[tc.VAR_SPEED]
+            waiting[k] = values[tc.VAR_WAITING_TIME]
+            angles[k] = values[tc.VAR_ANGLE]
+            lanes.append(values[tc.VAR_LANE_ID])
+        tls_results = traci.trafficlight.getAllSubscriptionResults()
+        tls_phases = np.fromiter((tls_results[t][tc.TL_CURRENT_PHASE] for t in self.tls_ids),
+                                 dtype=np.int64, count=len(self.tls_ids))
+        return StepSnapshot(ids, positions, speeds, waiting, tuple(lanes), angles, tls_phases)
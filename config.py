@@ -1,17 +1,68 @@
 # config.py: Константы и настройки
 import os
+import sys
 # Путь к SUMO_HOME (установите в переменных окружения или здесь)
 SUMO_HOME = os.environ.get('SUMO_HOME', '/Users/maksim/Sumo/2025-11-01-12-22-54/venv/lib/python3.9/site-packages/sumo') # Путь к pip установке eclipse-sumo
 # Параметры симуляции
 SIM_STEPS = 3600 # 1 час симуляции (секунды)
 OPTIMIZE_INTERVAL = 300 # Оптимизация каждые 5 мин (шаги)
-GUI = True # Запускать с GUI (True) или без (False)
+# Событийная оптимизация: светофор пересчитывается раньше OPTIMIZE_INTERVAL при превышении порогов,
+# при тех же (округлённых) входах решение берётся из памяти, неизменный план не переустанавливается
+EVENT_OPTIMIZE = True
+TRIGGER_MIN_STEPS = 60 # Не чаще одного пересчёта светофора за столько шагов
+# Пороги раннего пересчёта (None — не учитывать). На osm-сценарии ранние пересчёты ухудшали задержку,
+# поэтому по умолчанию выключены; пример: TRIGGER_NEAR_MISS_RATE = 1.0, TRIGGER_QUEUE = 20
+TRIGGER_NEAR_MISS_RATE = None # near-miss на светофоре в среднем за шаг интервала
+TRIGGER_RISK = None # Средний риск интервала
+TRIGGER_QUEUE = None # ТС в очереди на одной полосе светофора (нужен учёт полос: PHASE_CONTROLLER = 'mpc')
+MEMO_DECIMALS = 2 # Округление входов (риск, интенсивности прибытия) для памяти решений
+MEMO_SIZE = 4096 # Решений в памяти (старые вытесняются)
+ASYNC_OPTIMIZE = False # Решать в фоне, не останавливая шаги симуляции
+ASYNC_APPLY_DELAY = 5 # Через сколько шагов после снимка входов применять решение (< OPTIMIZE_INTERVAL)
+ASYNC_DEADLINE_POLICY = 'wait' # Решение не готово к шагу применения: wait (дождаться, воспроизводимо) или skip
+# Linux без дисплея (сервер, CI): sumo-gui не запустится, поэтому по умолчанию headless
+HEADLESS = sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+GUI = not HEADLESS # Запускать с GUI (True) или без (False)
+PLOT = True # Сохранять график риска risk_trend.png в конце прогона (matplotlib)
+BACKEND = os.environ.get('SUMO_BACKEND', 'traci') # traci (сокет) или libsumo (in-process, только без GUI)
+# Запись метрик (recorder.py)
+RECORDER_CHUNK_SIZE = 4096 # Строк в блоке до сброса на диск
+RECORDER_FORMAT = 'auto' # auto (Arrow IPC при наличии pyarrow), arrow или npz
+EXPORT_CSV = True # Экспорт tls_observed.csv/step_metrics.csv из бинарных метрик в конце прогона
+# Контрольные точки (checkpoint.py): состояние SUMO и контроллера каждые CHECKPOINT_INTERVAL шагов (0 — выключены);
+# на каждой точке выходные файлы прогона (метрики, tls_changes.csv, tlslog.xml) переходят к следующей части
+CHECKPOINT_INTERVAL = 0
+CHECKPOINT_KEEP = 2 # Хранить последних контрольных точек
 # Файлы SUMO
 NET_FILE = "./osm.net.xml.gz"
 SUMOCFG_FILE = "./osm.sumocfg"
 # Параметры оптимизации
 MIN_PHASE_DURATION = 5
 MAX_PHASE_DURATION = 60
-CYCLE_TIME = 120 # Общий цикл светофора (сек)
+CYCLE_TIME = 120 # Общий цикл светофора (сек); для MPC — наибольший цикл кандидатов
+PHASE_SOLVER = 'auto' # auto (по структуре цели), analytic или cvxpy
+SOLVER_LATENCY_WINDOW = 4096 # Последних вызовов оптимизатора для p95 латентности (средние — по всем вызовам)
+PHASE_CONTROLLER = 'mpc' # mpc (прогноз очередей, mpc.py) или objective (линейная цель + PHASE_SOLVER)
+MPC_HORIZON = 300 # Горизонт прогноза (сек): планы с разной длиной цикла сравниваются на одном отрезке
+MPC_CYCLE_STEP = 5 # Шаг длин цикла кандидатов MPC (сек): от наименьшей допустимой до CYCLE_TIME
+MPC_CANDIDATES = 2000 # Кандидатных планов на светофор за интервал
+MPC_RISK_WEIGHT = 0.1 # Вес риска: доля разброса задержки кандидатов за весь разброс ожидаемых near-miss (влияет на план только при риске по фазам, --risk-scope junction)
+MPC_SEED = 0 # Seed генерации кандидатов (прогоны воспроизводимы)
+SATURATION_FLOW = 0.5 # Поток насыщения полосы на зелёном (ТС/с, 1800 ТС/ч)
+WHATIF = False # Проверять кандидатные планы прогоном «что если» (whatif.py) перед установкой
+WHATIF_WORKERS = 2 # Процессов SUMO для прогонов «что если»
+WHATIF_CANDIDATES = 4 # Кандидатов на светофор
+WHATIF_HORIZON = 120 # Шагов прогона каждого кандидата
+WHATIF_BUDGET_SEC = 5.0 # Бюджет времени на всю проверку за интервал (сек)
 # Близость для near-miss (m)
-PROXIMITY_THRESHOLD = 50 # Фильтр dist для эффективности
\ No newline at end of file
+PROXIMITY_THRESHOLD = 50 # Фильтр dist для эффективности
+# Область поиска near-miss: network (все ТС сети) или junction (зоны управляемых перекрёстков, junction_risk.py)
+RISK_SCOPE = 'network'
+APPROACH_RADIUS = 75 # Радиус подхода вокруг формы перекрёстка (м)
+# Выборочный поиск near-miss (risk_sampling.py) для длинных прогонов: каждые RISK_SAMPLE_EVERY шагов (1 — каждый шаг),
+# на пропущенных шагах повторяются значения последнего поиска. Адаптивно — раньше, если число ТС изменилось
+# больше чем на RISK_SAMPLE_DENSITY_CHANGE (доля) с последнего поиска
+RISK_SAMPLE_EVERY = 1
+RISK_SAMPLE_ADAPTIVE = False
+RISK_SAMPLE_DENSITY_CHANGE = 0.2
+RISK_TREND_POINTS = 2000 # Точек тренда риска для risk_trend.png (корзины min/max/среднее)
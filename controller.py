@@ -0,0 +1,579 @@
+# controller.py: Состояние управляемых светофоров: отслеживание фаз, эпохи, интервальный риск, оптимизация
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, NamedTuple, Optional
+import numpy as np
+from backend import traci
+from config import OPTIMIZE_INTERVAL, ASYNC_APPLY_DELAY, ASYNC_DEADLINE_POLICY
+from config import TRIGGER_MIN_STEPS, TRIGGER_NEAR_MISS_RATE, TRIGGER_RISK, TRIGGER_QUEUE, MEMO_DECIMALS, MEMO_SIZE
+from utils import compute_phase_durations, apply_phase_durations
+from tls_index import TlsIndex
+
+if TYPE_CHECKING:
+    from mpc import LaneTraffic
+
+# Скорость, ниже которой ТС на полосе считается стоящим в очереди (м/с)
+QUEUE_SPEED_THRESHOLD = 0.1
+
+
+def _phase_averages(phases, durations):
+    """{phase_index: (средняя длительность, число переключений)}"""
+    counts = np.bincount(phases)
+    sums = np.bincount(phases, weights=durations)
+    return {int(p): (round(float(sums[p]) / int(counts[p]), 2), int(counts[p])) for p in np.flatnonzero(counts)}
+
+
+SWITCH_COLUMNS = [("step", np.int64), ("tls", np.int32), ("phase_index", np.int32), ("state", np.int32),
+                  ("duration", np.float64), ("epoch", np.int32)]
+
+
+class TlsState:
+    """Отслеживание фаз и эпох одного светофора"""
+
+    def __init__(self, tls_id):
+        self.tls_id = tls_id
+        self.prev_phase_index = None
+        self.prev_switch_time = None
+        # Epoch: 0 = до первой оптимизации, 1 = после первой, и т.д.
+        self.current_epoch = 0
+
+    def start(self, phase_index, current_time):
+        """Первое наблюдение: восстанавливаем время последнего переключения"""
+        self.prev_phase_index = phase_index
+        try:
+            elapsed = traci.trafficlight.getTimeSinceLastSwitch(self.tls_id)
+            self.prev_switch_time = max(0.0, current_time - elapsed)
+        except Exception:
+            self.prev_switch_time = current_time
+
+    def switch(self, phase_index, current_time):
+        """Смена фазы: возвращает (индекс, длительность) завершившейся фазы"""
+        observed_duration = max(0.0, current_time - self.prev_switch_time)
+        closed_phase = self.prev_phase_index
+        self.prev_phase_index = phase_index
+        self.prev_switch_time = current_time
+        return closed_phase, observed_duration
+
+
+class OptimizationJob(NamedTuple):
+    """Входы оптимизации одного светофора, снятые в конце интервала"""
+    k: int
+    near_miss: int
+    avg_risk: float
+    logic: object
+    traffic: Optional["LaneTraffic"] = None  # очереди/прибытия по полосам (если track_lanes)
+    steps: int = 1  # длина интервала, шагов
+    phase_risk: Optional[np.ndarray] = None  # near-miss в секунду по фазам (зоны перекрёстков)
+
+
+class NetworkController:
+    """Набор управляемых светофоров. Интервальные накопители хранятся массивами по всем TLS,
+    поэтому накладные расходы шага не растут с числом светофоров (кроме реальных переключений).
+    """
+
+    # Состояние, накапливаемое по ходу прогона (контрольные точки, checkpoint.py)
+    CHECKPOINT_FIELDS = ("states", "state_names", "_state_codes", "prev_vehicle_lane", "lane_queues", "prev_phases",
+                         "memo", "trigger_armed", "phase_risk", "phase_near_miss", "link_near_miss", "opt_stats",
+                         "interval_near_miss", "interval_risk_sum", "interval_arrivals", "interval_steps",
+                         "interval_phase_near_miss", "interval_phase_steps", "forecasts", "forecast_queue",
+                         "forecast_steps", "model_check")
+
+    def __init__(self, tls_ids, switch_recorder=None, changes_writer=None, tls_index=None, tlslog_writer=None,
+                 track_lanes=False, event_optimize=False):
+        self.tls_ids = list(tls_ids)
+        self.states = [TlsState(tls_id) for tls_id in self.tls_ids]
+        # Переключения фаз (ColumnarRecorder со столбцами SWITCH_COLUMNS); состояние фазы — код в state_names
+        self.switch_recorder = switch_recorder
+        self.state_names = []
+        self._state_codes = {}
+        self.tlslog_writer = tlslog_writer
+        self.changes_writer = changes_writer
+        # Полосы, связи и программы — из индекса; TraCI опрашивается только при его построении
+        self.tls_index = tls_index if tls_index is not None else TlsIndex.load_or_build(self.tls_ids)
+        # Полоса -> индекс светофора, контролирующего её
+        self.lane_to_tls = {}
+        # Все контролируемые полосы сети (индекс полосы -> первый светофор) и полосы/связи каждого светофора
+        self.lane_index = {}
+        self.tls_lanes = []
+        self.tls_link_lanes = []
+        for k, tls_id in enumerate(self.tls_ids):
+            for lane in self.tls_index.controlled_lanes(tls_id):
+                self.lane_to_tls.setdefault(lane, k)
+                self.lane_index.setdefault(lane, len(self.lane_index))
+            own = list(dict.fromkeys(self.tls_index.controlled_lanes(tls_id)))
+            position = {lane: j for j, lane in enumerate(own)}
+            self.tls_lanes.append(np.array([self.lane_index[lane] for lane in own], dtype=np.int64))
+            self.tls_link_lanes.append(np.array([position.get(links[0][0], -1) if links else -1
+                                                 for links in self.tls_index.controlled_links(tls_id)], dtype=np.int64))
+        # Индекс светофора по индексу полосы; последний элемент (-1) — для ТС вне контролируемых полос
+        self.lane_tls = np.array([self.lane_to_tls[lane] for lane in self.lane_index] + [-1], dtype=np.int64)
+        # Полосы всех светофоров подряд для максимума очереди по светофору (reduceat);
+        # у светофора без полос — фиктивная полоса с нулевой очередью
+        own_lanes = [lanes if len(lanes) else np.array([len(self.lane_index)]) for lanes in self.tls_lanes]
+        self._queue_lanes = np.concatenate(own_lanes) if own_lanes else np.empty(0, dtype=np.int64)
+        self._queue_offsets = np.cumsum([0] + [len(lanes) for lanes in own_lanes[:-1]]).astype(np.int64)
+        # Оценка очередей и прибытий по полосам для MPC (ТС -> полоса на прошлом шаге)
+        self.track_lanes = track_lanes
+        self.prev_vehicle_lane = {}
+        self.lane_queues = np.zeros(len(self.lane_index), dtype=np.float64)
+        self.prev_phases = None
+        # Пул «что если» (whatif.WhatIfPool): проверка кандидатных планов перед установкой
+        self.whatif = None
+        # Событийная оптимизация: ранний пересчёт по порогам, память решений, без переустановки того же плана
+        self.event_optimize = event_optimize
+        self.memo = {} if event_optimize else None
+        # Ранний пересчёт — только при пересечении порога: светофор «взведён», если при его последней
+        # оптимизации пороги не были превышены (устойчиво высокая нагрузка — пересчёт по расписанию)
+        self.trigger_armed = np.ones(len(self.tls_ids), dtype=bool)
+        # Конфликты по фазам и связям (режим зон перекрёстков, junction_risk.py): включается add_phase_risk
+        self.phase_risk = False
+        self.max_phases = max([len(logic.phases) for tls_id in self.tls_ids
+                               for logic in self.tls_index.programs(tls_id).values()] + [1])
+        self.max_links = max([len(self.tls_index.controlled_links(tls_id)) for tls_id in self.tls_ids] + [1])
+        self.phase_near_miss = np.zeros((len(self.tls_ids), self.max_phases), dtype=np.int64)
+        self.link_near_miss = np.zeros((len(self.tls_ids), self.max_links), dtype=np.int64)
+        self.has_triggers = any(t is not None for t in (TRIGGER_NEAR_MISS_RATE, TRIGGER_RISK, TRIGGER_QUEUE))
+        self.opt_stats = {"scheduled": 0, "early": 0, "solved": 0, "memo_hits": 0, "applied": 0, "unchanged": 0}
+        # Проверка модели MPC по SUMO: прогноз очереди (ТС·с) для действующего плана против измеренной суммы
+        # очередей на полосах светофора за время его действия (track_lanes)
+        self.forecasts = [None] * len(self.tls_ids)  # (длительности, состояния фаз, LaneTraffic) на момент установки
+        self.forecast_queue = np.zeros(len(self.tls_ids), dtype=np.float64)
+        self.forecast_steps = np.zeros(len(self.tls_ids), dtype=np.int64)
+        self.model_check = {"intervals": 0, "predicted": 0.0, "measured": 0.0, "abs_error": 0.0}
+        self.reset_interval()
+
+    def checkpoint_state(self):
+        """Состояние для контрольной точки: поля CHECKPOINT_FIELDS и программы светофоров из индекса"""
+        state = {name: getattr(self, name) for name in self.CHECKPOINT_FIELDS}
+        state["programs"] = {tls_id: (dict(self.tls_index.programs(tls_id)), self.tls_index.active_program(tls_id))
+                             for tls_id in self.tls_ids}
+        return state
+
+    def restore(self, state):
+        """Продолжение с контрольной точки (тот же набор светофоров)"""
+        state = dict(state)
+        for tls_id, (programs, active) in state.pop("programs").items():
+            entry = self.tls_index.entries[tls_id]
+            entry["programs"] = dict(programs)
+            entry["active_program"] = active
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def reset_interval(self, ks=None):
+        """Сброс интервальных накопителей всех светофоров или только ks"""
+        n = len(self.tls_ids)
+        if ks is None:
+            self.interval_near_miss = np.zeros(n, dtype=np.int64)
+            self.interval_risk_sum = np.zeros(n, dtype=np.float64)
+            self.interval_arrivals = np.zeros(len(self.lane_index), dtype=np.int64)
+            # Шагов в интервале каждого светофора (с его последней оптимизации)
+            self.interval_steps = np.zeros(n, dtype=np.int64)
+            self.interval_phase_near_miss = np.zeros((n, self.max_phases), dtype=np.int64)
+            self.interval_phase_steps = np.zeros((n, self.max_phases), dtype=np.int64)
+            return
+        ks = np.asarray(ks, dtype=np.int64)
+        self.interval_near_miss[ks] = 0
+        self.interval_risk_sum[ks] = 0.0
+        self.interval_steps[ks] = 0
+        self.interval_phase_near_miss[ks] = 0
+        self.interval_phase_steps[ks] = 0
+        for k in ks:
+            self.interval_arrivals[self.tls_lanes[k]] = 0
+
+    def vehicle_lanes(self, lanes):
+        """Индекс контролируемой полосы для каждого ТС (-1, если полоса не контролируется)"""
+        lane_index = self.lane_index
+        return np.fromiter((lane_index.get(lane, -1) for lane in lanes), dtype=np.int64, count=len(lanes))
+
+    def vehicle_tls(self, lanes):
+        """Индекс светофора для каждого ТС по его полосе (-1, если полоса не контролируется)"""
+        return self.lane_tls[self.vehicle_lanes(lanes)]
+
+    def observe_vehicles(self, snapshot):
+        """Индекс светофора для каждого ТС снимка; при track_lanes — ещё очереди и прибытия по полосам"""
+        vehicle_lane = self.vehicle_lanes(snapshot.lanes)
+        if self.track_lanes:
+            on_lane = vehicle_lane >= 0
+            halting = on_lane & (snapshot.speeds < QUEUE_SPEED_THRESHOLD)
+            self.lane_queues = np.bincount(vehicle_lane[halting], minlength=len(self.lane_index)).astype(np.float64)
+            # Прибытие: ТС на контролируемой полосе, где его не было на прошлом шаге
+            prev = self.prev_vehicle_lane
+            prev_lane = np.fromiter((prev.get(v, -1) for v in snapshot.ids), dtype=np.int64, count=len(snapshot.ids))
+            entered = on_lane & (vehicle_lane != prev_lane)
+            self.interval_arrivals += np.bincount(vehicle_lane[entered], minlength=len(self.lane_index))
+            self.prev_vehicle_lane = dict(zip(snapshot.ids, vehicle_lane.tolist()))
+            if len(self._queue_lanes):
+                queues = np.append(self.lane_queues, 0.0)
+                self.forecast_queue += np.add.reduceat(queues[self._queue_lanes], self._queue_offsets)
+            self.forecast_steps += 1
+        return self.lane_tls[vehicle_lane]
+
+    def add_step_risk(self, counts, ttc_sums):
+        """Накопление near-miss и среднего TTC шага по каждому светофору"""
+        self.interval_near_miss += counts
+        step_risk = np.zeros(len(self.tls_ids), dtype=np.float64)
+        np.divide(ttc_sums, counts, out=step_risk, where=counts > 0)
+        self.interval_risk_sum += step_risk
+        self.interval_steps += 1
+
+    def add_phase_risk(self, phases, phase_counts, link_counts):
+        """Конфликты шага по фазам и связям (ZoneRisk) и время в текущей фазе каждого светофора"""
+        self.phase_risk = True
+        phases = np.asarray(phases, dtype=np.int64)
+        rows = np.flatnonzero((phases >= 0) & (phases < self.max_phases))
+        self.interval_phase_steps[rows, phases[rows]] += 1
+        self.interval_phase_near_miss += phase_counts
+        self.phase_near_miss += phase_counts
+        self.link_near_miss += link_counts
+
+    def interval_phase_risk(self, k):
+        """near-miss в секунду по фазам активной программы светофора k за интервал (0 — фаза не наблюдалась)"""
+        num_phases = len(self.tls_index.active_logic(self.tls_ids[k]).phases)
+        counts = self.interval_phase_near_miss[k, :num_phases]
+        return counts / np.maximum(self.interval_phase_steps[k, :num_phases], 1)
+
+    def conflict_summary(self):
+        """{tls_id: (near-miss по фазам {фаза: n}, по связям [(связь, n, "in -> out")] по убыванию)}"""
+        summary = {}
+        for k, tls_id in enumerate(self.tls_ids):
+            links = self.tls_index.controlled_links(tls_id)
+            by_phase = {int(p): int(self.phase_near_miss[k, p]) for p in np.flatnonzero(self.phase_near_miss[k])}
+            by_link = [(int(l), int(self.link_near_miss[k, l]),
+                        f"{links[l][0][0]} -> {links[l][0][1]}" if l < len(links) and links[l] else "?")
+                       for l in np.argsort(-self.link_near_miss[k], kind="stable") if self.link_near_miss[k, l] > 0]
+            summary[tls_id] = (by_phase, by_link)
+        return summary
+
+    def tls_max_queue(self):
+        """Наибольшая очередь на полосе каждого светофора (ТС)"""
+        queues = np.append(self.lane_queues, 0.0)
+        if not len(self._queue_lanes):
+            return np.zeros(len(self.tls_ids))
+        return np.maximum.reduceat(queues[self._queue_lanes], self._queue_offsets)
+
+    def over_thresholds(self):
+        """(число TLS,) bool: за интервал превышен порог near-miss, риска или очереди"""
+        steps = self.interval_steps
+        hot = np.zeros(len(self.tls_ids), dtype=bool)
+        if TRIGGER_NEAR_MISS_RATE is not None:
+            hot |= (steps > 0) & (self.interval_near_miss >= TRIGGER_NEAR_MISS_RATE * steps)
+        if TRIGGER_RISK is not None:
+            hot |= (steps > 0) & (self.interval_risk_sum >= TRIGGER_RISK * steps)
+        if self.track_lanes and TRIGGER_QUEUE is not None:
+            hot |= self.tls_max_queue() >= TRIGGER_QUEUE
+        return hot
+
+    def due_tls(self):
+        """Индексы светофоров, которым пора пересчитать план: по расписанию (OPTIMIZE_INTERVAL шагов
+        с прошлой оптимизации) или раньше, но не чаще TRIGGER_MIN_STEPS, — при пересечении порогов"""
+        steps = self.interval_steps
+        scheduled = steps >= OPTIMIZE_INTERVAL
+        due = scheduled
+        if self.event_optimize:
+            ready = steps >= TRIGGER_MIN_STEPS
+            if self.has_triggers and (ready & self.trigger_armed).any():
+                early = ~scheduled & ready & self.trigger_armed & self.over_thresholds()
+                self.opt_stats["early"] += int(early.sum())
+                due = scheduled | early
+        self.opt_stats["scheduled"] += int(scheduled.sum())
+        due = np.flatnonzero(due)
+        if self.event_optimize and self.has_triggers and len(due):
+            self.trigger_armed[due] = ~self.over_thresholds()[due]
+        return due
+
+    def track_phases(self, step, current_time, phases):
+        """Фиксация фактических длительностей фаз по переключениям"""
+        if self.prev_phases is None:
+            for state, phase_index in zip(self.states, phases):
+                state.start(int(phase_index), current_time)
+            self.prev_phases = phases.copy()
+            return
+        for k in np.flatnonzero(phases != self.prev_phases):
+            state = self.states[k]
+            closed_phase, observed_duration = state.switch(int(phases[k]), current_time)
+            # Состояние завершившейся фазы из логики (индекс, без запроса к TraCI)
+            phase_state = self.tls_index.phase_state(state.tls_id, closed_phase) or "?"
+            if self.switch_recorder is not None:
+                self.switch_recorder.append(step, k, closed_phase, self._state_code(phase_state),
+                                            observed_duration, state.current_epoch)
+            if self.tlslog_writer:
+                self.tlslog_writer.add_switch(state.tls_id, phase_state, round(observed_duration, 2))
+        self.prev_phases = phases.copy()
+
+    def _state_code(self, phase_state):
+        code = self._state_codes.get(phase_state)
+        if code is None:
+            code = self._state_codes[phase_state] = len(self.state_names)
+            self.state_names.append(phase_state)
+        return code
+
+    def observed_summary(self):
+        """Средние фактические длительности фаз по записанным переключениям:
+        {tls_id: (по всему прогону {фаза: (avg, count)}, по эпохам {epoch: {фаза: (avg, count)}})}
+        """
+        summary = {}
+        if self.switch_recorder is None or not self.switch_recorder.rows:
+            return summary
+        tls = self.switch_recorder.column("tls")
+        phases = self.switch_recorder.column("phase_index")
+        durations = self.switch_recorder.column("duration")
+        epochs = self.switch_recorder.column("epoch")
+        for k in np.unique(tls):
+            mask = tls == k
+            by_epoch = {int(e): _phase_averages(phases[mask & (epochs == e)], durations[mask & (epochs == e)])
+                        for e in np.unique(epochs[mask])}
+            summary[self.tls_ids[k]] = (_phase_averages(phases[mask], durations[mask]), by_epoch)
+        return summary
+
+    def export_switches_csv(self, path):
+        """tls_observed.csv из записанных переключений"""
+        self.switch_recorder.export_csv(
+            path, header=["switch_step", "tls_id", "phase_index", "state", "observed_duration_sec", "epoch"],
+            formatters={"tls": self.tls_ids.__getitem__, "state": self.state_names.__getitem__,
+                        "duration": lambda d: round(d, 2)})
+
+    def lane_traffic(self, k):
+        """Очереди (текущие) и интенсивности прибытия (за интервал, ТС/с) по полосам светофора k"""
+        from mpc import LaneTraffic
+        lanes = self.tls_lanes[k]
+        return LaneTraffic(queues=self.lane_queues[lanes].copy(),
+                           arrivals=self.interval_arrivals[lanes] / max(1, int(self.interval_steps[k])),
+                           link_lanes=self.tls_link_lanes[k])
+
+    def interval_inputs(self, ks=None):
+        """Снимок входов оптимизации за интервал: [OptimizationJob] по всем TLS или только ks"""
+        steps = np.maximum(self.interval_steps, 1)
+        avg_interval_risk = self.interval_risk_sum / steps
+        jobs = []
+        for k in (range(len(self.states)) if ks is None else ks):
+            k = int(k)
+            traffic = self.lane_traffic(k) if self.track_lanes else None
+            phase_risk = self.interval_phase_risk(k) if self.phase_risk else None
+            jobs.append(OptimizationJob(k, int(self.interval_near_miss[k]), float(avg_interval_risk[k]),
+                                        self.tls_index.active_logic(self.tls_ids[k]), traffic, int(steps[k]),
+                                        phase_risk))
+        return jobs
+
+    def memo_key(self, job):
+        """Округлённые входы решателя: одинаковый ключ — одинаковое решение"""
+        lanes = None
+        if job.traffic is not None:
+            lanes = (tuple(np.rint(job.traffic.queues).astype(np.int64).tolist()),
+                     tuple(np.round(job.traffic.arrivals, MEMO_DECIMALS).tolist()))
+        durations = tuple(phase.duration for phase in job.logic.phases)
+        phase_risk = None if job.phase_risk is None else tuple(np.round(job.phase_risk, MEMO_DECIMALS).tolist())
+        return (self.tls_ids[job.k], durations, job.near_miss, job.steps, round(job.avg_risk, MEMO_DECIMALS), lanes,
+                phase_risk)
+
+    def memo_lookup(self, jobs):
+        """(ключи, решения из памяти или None — нужно решать) для задач jobs"""
+        if self.memo is None:
+            return [None] * len(jobs), [None] * len(jobs)
+        keys = [self.memo_key(job) for job in jobs]
+        cached = [self.memo.get(key) for key in keys]
+        self.opt_stats["memo_hits"] += sum(1 for hit in cached if hit is not None)
+        return keys, cached
+
+    def solve(self, jobs, cached, snapshot=None, stale=None):
+        """Решения для задач без ответа в памяти (+ проверка «что если» по snapshot); ответы из памяти — как есть.
+        TraCI основного прогона не используется: можно вызывать из рабочего потока.
+        stale() — результат больше не нужен: оставшиеся задачи не решаются."""
+        todo = [job for job, hit in zip(jobs, cached) if hit is None]
+        solved = iter(solve_jobs(todo, self.tls_ids, stale))
+        results = [list(hit) if hit is not None else next(solved) for hit in cached]
+        if snapshot is not None and not (stale and stale()):
+            fresh = [None if hit is not None else result for hit, result in zip(cached, results)]
+            checked = self.whatif.select(snapshot, jobs, fresh, self.tls_ids, self.tls_index)
+            results = [result if hit is not None else best for hit, result, best in zip(cached, results, checked)]
+        return results
+
+    def apply_results(self, step, jobs, keys, results):
+        """Запоминание решений и установка программ (основной поток)"""
+        self.opt_stats["solved"] += sum(1 for key, result in zip(keys, results)
+                                        if result is not None and (self.memo is None or key not in self.memo))
+        for job, key, new_durations in zip(jobs, keys, results):
+            if new_durations is None:
+                continue
+            if self.memo is not None:
+                self.memo[key] = tuple(new_durations)
+                if len(self.memo) > MEMO_SIZE:
+                    del self.memo[next(iter(self.memo))]
+            self.apply_result(step, job, new_durations)
+
+    def check_forecast(self, k, job=None, new_durations=None):
+        """Сверка прогноза модели для плана, действовавшего на светофоре k, с измеренной очередью;
+        затем (если есть job) запоминается прогноз для нового плана"""
+        forecast, steps = self.forecasts[k], int(self.forecast_steps[k])
+        if forecast is not None and steps > 0:
+            from mpc import green_matrix, predict_delay
+            durations, states, traffic = forecast
+            green = green_matrix(states, traffic.link_lanes, len(traffic.queues))
+            predicted = float(predict_delay([durations], traffic.queues, traffic.arrivals, green, horizon=steps)[0])
+            measured = float(self.forecast_queue[k])
+            check = self.model_check
+            check["intervals"] += 1
+            check["predicted"] += predicted
+            check["measured"] += measured
+            check["abs_error"] += abs(predicted - measured)
+        self.forecasts[k] = None
+        if job is not None and job.traffic is not None:
+            self.forecasts[k] = (list(new_durations), [phase.state for phase in job.logic.phases], job.traffic)
+        self.forecast_queue[k] = 0.0
+        self.forecast_steps[k] = 0
+
+    def model_check_summary(self):
+        """Прогноз модели против SUMO по всем сверенным интервалам (None — сверок не было)"""
+        check = self.model_check
+        if not check["intervals"] or check["measured"] <= 0:
+            return None
+        return {"intervals": check["intervals"], "predicted_veh_s": round(check["predicted"], 1),
+                "measured_veh_s": round(check["measured"], 1),
+                "ratio": round(check["predicted"] / check["measured"], 3),
+                "relative_abs_error": round(check["abs_error"] / check["measured"], 3)}
+
+    def apply_result(self, step, job, new_durations):
+        """Установка рассчитанных длительностей, запись в tls_changes.csv и смена эпохи"""
+        k, near_miss, avg_risk, current_logic = job.k, job.near_miss, job.avg_risk, job.logic
+        state = self.states[k]
+        tls_id = state.tls_id
+        if self.track_lanes:
+            self.check_forecast(k, job, new_durations)
+        if self.event_optimize:
+            # План не изменился — программа и текущая фаза остаются, без обращений к TraCI
+            active_logic = self.tls_index.active_logic(tls_id)
+            if active_logic is not None and [p.duration for p in active_logic.phases] == list(new_durations):
+                self.opt_stats["unchanged"] += 1
+                print(f"Step {step} [{tls_id}]: Plan unchanged {list(new_durations)}, keeping program {active_logic.programID}")
+                return
+        try:
+            apply_phase_durations(new_durations, current_logic, tls_id, self.tls_index)
+            # Применённые длительности фаз из активной логики (индекс обновлён при установке opt_N)
+            applied_logic = self.tls_index.active_logic(tls_id)
+            applied_durations = [p.duration for p in applied_logic.phases]
+            active_program_id = self.tls_index.active_program(tls_id)
+            print(f"Step {step} [{tls_id}]: Program {active_program_id} | Optimized: {new_durations} | Applied: {applied_durations}")
+            # Сохраняем в CSV для последующей проверки
+            if self.changes_writer:
+                self.changes_writer.writerow([step, tls_id, ";".join(map(str, new_durations)),
+                                              ";".join(map(str, applied_durations)), near_miss, round(avg_risk, 4)])
+            # После успешной оптимизации переключаем эпоху ("после оптимизации")
+            state.current_epoch += 1
+            self.opt_stats["applied"] += 1
+        except Exception as e:
+            print(f"Step {step} [{tls_id}]: Error optimizing phases: {e}")
+            print("Continuing with current settings")
+
+    def apply_plans(self, step, plans):
+        """Установка заданных планов [(tls_id, длительности)] без оптимизатора (--mode replay)"""
+        index = {tls_id: k for k, tls_id in enumerate(self.tls_ids)}
+        for tls_id, _ in plans:
+            if tls_id not in index:
+                print(f"Step {step} [{tls_id}]: светофор не управляется, план пропущен")
+        plans = [(index[tls_id], durations) for tls_id, durations in plans if tls_id in index]
+        ks = [k for k, _ in plans]
+        for job, (_, durations) in zip(self.interval_inputs(ks), plans):
+            self.apply_result(step, job, durations)
+        self.reset_interval(ks)
+
+    def optimize_all(self, step, ks=None):
+        """Пакетный проход оптимизации по светофорам ks (по умолчанию — всем) в конце их интервала"""
+        jobs = self.interval_inputs(ks)
+        keys, cached = self.memo_lookup(jobs)
+        snapshot = None
+        if self.whatif is not None and any(hit is None for hit in cached):
+            # Проверка кандидатов прогоном с сохранённого состояния до установки программ
+            snapshot = self.whatif.snapshot(self.tls_ids, self.tls_index)
+        results = self.solve(jobs, cached, snapshot)
+        self.apply_results(step, jobs, keys, results)
+        self.reset_interval(ks)
+
+
+def solve_job(job, tls_id):
+    return compute_phase_durations(job.near_miss, job.avg_risk, job.logic, tls_id, job.traffic, job.steps,
+                                   job.phase_risk)
+
+
+def solve_jobs(jobs, tls_ids, stale=None):
+    """Расчёт длительностей для снимка входов (без TraCI, можно выполнять в рабочем потоке);
+    когда stale() истинно, оставшиеся задачи получают None"""
+    results = []
+    for job in jobs:
+        if stale is not None and stale():
+            results.append(None)
+            continue
+        try:
+            results.append(solve_job(job, tls_ids[job.k]))
+        except Exception as e:
+            print(f"[{tls_ids[job.k]}]: Error optimizing phases: {e}")
+            results.append(None)
+    return results
+
+
+class AsyncOptimizer:
+    """Асинхронная оптимизация: входы интервала снимаются на шаге N, решение считается в рабочем потоке,
+    пока симуляция идёт дальше, и применяется строго на шаге N + apply_delay.
+    Если к этому шагу решение не готово: policy "wait" — дождаться (прогон воспроизводим),
+    "skip" — оставить текущие программы (без блокировки, но зависит от скорости машины).
+    future.cancel() не останавливает уже запущенное решение, поэтому у каждого запуска есть номер поколения:
+    пропущенное решение становится устаревшим, прерывается между светофорами и отбрасывается при получении.
+    """
+
+    def __init__(self, controller, apply_delay=ASYNC_APPLY_DELAY, policy=ASYNC_DEADLINE_POLICY):
+        self.controller = controller
+        self.apply_delay = max(0, min(int(apply_delay), OPTIMIZE_INTERVAL - 1))
+        self.policy = policy
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="optimizer")
+        self.pending = None  # (submit_step, apply_step, generation, jobs, keys, future)
+        self.generation = 0  # поколение последнего запуска, результат которого ещё нужен
+        self.deadline_misses = 0
+
+    def submit(self, step, ks=None):
+        """Снимок входов интервала светофоров ks (по умолчанию — всех) и запуск решения в фоне"""
+        if self.pending is not None:
+            # Предыдущий результат ещё не применён — применяем сейчас, чтобы не копить очередь
+            self._resolve(step)
+        controller = self.controller
+        jobs = controller.interval_inputs(ks)
+        controller.reset_interval(ks)
+        keys, cached = controller.memo_lookup(jobs)
+        # Состояние для проверки «что если» сохраняется здесь (TraCI — только из основного потока)
+        snapshot = None
+        if controller.whatif is not None and any(hit is None for hit in cached):
+            snapshot = controller.whatif.snapshot(controller.tls_ids, controller.tls_index)
+        self.generation += 1
+        future = self.executor.submit(self._solve, self.generation, jobs, cached, snapshot)
+        self.pending = (step, step + self.apply_delay, self.generation, jobs, keys, future)
+
+    def _solve(self, generation, jobs, cached, snapshot):
+        """Рабочий поток: (поколение, результаты)"""
+        return generation, self.controller.solve(jobs, cached, snapshot, stale=lambda: generation != self.generation)
+
+    def poll(self, step):
+        """Вызывать на каждом шаге: применяет результат на запланированном шаге"""
+        if self.pending is not None and step >= self.pending[1]:
+            self._resolve(step)
+
+    def _resolve(self, step):
+        submit_step, apply_step, generation, jobs, keys, future = self.pending
+        self.pending = None
+        if not future.done():
+            self.deadline_misses += 1
+            if self.policy == "skip":
+                # Решение в рабочем потоке устаревает: следующее не ждёт его полного завершения
+                self.generation += 1
+                future.cancel()
+                print(f"Step {step}: optimization from step {submit_step} missed its deadline, keeping current programs")
+                return
+            print(f"Step {step}: optimization from step {submit_step} missed its deadline, waiting for the result")
+        solved_generation, results = future.result()
+        if solved_generation != self.generation:
+            print(f"Step {step}: optimization from step {submit_step} is stale, result dropped")
+            return
+        self.controller.apply_results(step, jobs, keys, results)
+
+    def shutdown(self):
+        """Незавершённый результат (симуляция закончилась раньше шага применения) отбрасывается"""
+        if self.pending is not None:
+            print(f"Optimization from step {self.pending[0]} was not applied: simulation ended")
+            self.pending = None
+            self.generation += 1
+        self.executor.shutdown(wait=True)
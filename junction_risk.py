@@ -0,0 +1,208 @@
+# junction_risk.py: Near-miss в зонах конфликтов управляемых перекрёстков
+# Вместо всех ТС сети рассматриваются только ТС не дальше APPROACH_RADIUS от формы перекрёстка
+# (контекстная подписка TraCI на перекрёсток). Каждый конфликт относится к светофору, к связи
+# (движению) участвующего ТС; конфликт на связи с зелёным сигналом — ещё и к активной фазе (риск её обслуживания).
+from typing import NamedTuple
+import numpy as np
+from backend import traci
+import traci.constants as tc
+from config import APPROACH_RADIUS, PROXIMITY_THRESHOLD
+from near_miss import near_miss_pairs, attribute_near_miss
+from utils import get_junction_info, extract_junctions_from_cluster
+
+# Переменные ТС в контекстной подписке перекрёстка
+ZONE_VARS = (tc.VAR_POSITION, tc.VAR_SPEED, tc.VAR_LANE_ID, tc.VAR_ROUTE_INDEX, tc.VAR_EDGES)
+
+
+def shape_segments(shape):
+    """Стороны многоугольника: (начала (S, 2), концы (S, 2), векторы (S, 2), квадраты длин (S,))"""
+    a = np.asarray(shape, dtype=np.float64).reshape(-1, 2)
+    b = np.roll(a, -1, axis=0)
+    ab = b - a
+    length2 = (ab ** 2).sum(axis=1)
+    return a, b, ab, np.where(length2 > 0, length2, 1.0)
+
+
+def boundary_distance(points, segments):
+    """Расстояние от точек (n, 2) до ближайшей стороны многоугольника"""
+    a, _, ab, length2 = segments
+    ap = points[:, None, :] - a[None, :, :]
+    t = np.clip((ap * ab).sum(axis=2) / length2, 0.0, 1.0)
+    closest = a[None, :, :] + t[:, :, None] * ab[None, :, :]
+    return np.hypot(*(points[:, None, :] - closest).transpose(2, 0, 1)).min(axis=1)
+
+
+def distance_to_shape(points, shape, segments=None):
+    """Расстояние от точек (n, 2) до многоугольника shape (внутри — 0); segments — заранее из shape_segments"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    segments = segments if segments is not None else shape_segments(shape)
+    a, b, ab, _ = segments
+    if len(a) == 0 or len(points) == 0:
+        return np.full(len(points), np.inf)
+    dist = boundary_distance(points, segments)
+    if len(a) >= 3:
+        # Чётно-нечётное правило: луч вправо от точки пересекает стороны
+        x, y = points[:, :1], points[:, 1:]
+        dy = np.where(ab[:, 1] == 0, 1.0, ab[:, 1])
+        crosses = ((a[:, 1] > y) != (b[:, 1] > y)) & (x < a[:, 0] + (y - a[:, 1]) * ab[:, 0] / dy)
+        dist[crosses.sum(axis=1) % 2 == 1] = 0.0
+    return dist
+
+
+class ZoneRisk(NamedTuple):
+    """Near-miss шага в зонах перекрёстков"""
+    near_miss: int
+    risk: float                # средний TTC пар
+    tls_counts: np.ndarray     # (число TLS,)
+    tls_ttc_sums: np.ndarray   # (число TLS,)
+    phase_counts: np.ndarray   # (число TLS, max_phases) — по активной фазе, если связь в ней зелёная
+    link_counts: np.ndarray    # (число TLS, max_links) — по связи (движению) ТС
+    vehicles: int              # ТС в зонах
+
+
+class JunctionZones:
+    """Зоны конфликтов светофоров: форма перекрёстка (из tls_index) + радиус подхода"""
+
+    def __init__(self, tls_ids, tls_index, radius=APPROACH_RADIUS):
+        self.tls_ids = list(tls_ids)
+        self.tls_index = tls_index
+        self.radius = radius
+        self.zones = []  # (junction_id, индекс TLS, форма (S, 2), стороны формы, центр, радиус «точно внутри»)
+        # Связи светофора: внутренняя полоса -> связь, входящая полоса -> [(связь, выходное ребро)]
+        self.via_link = []
+        self.lane_links = []
+        for k, tls_id in enumerate(self.tls_ids):
+            junctions = tls_index.junctions(tls_id) if tls_id in tls_index else []
+            if not junctions:
+                junctions = [info for info in (get_junction_info(traci, j) for j in extract_junctions_from_cluster(tls_id))
+                             if info is not None]
+            if not junctions:
+                print(f"[{tls_id}]: перекрёсток не найден, зона конфликтов пуста")
+            for junction in junctions:
+                shape = np.asarray(junction["shape"], dtype=np.float64).reshape(-1, 2)
+                center = np.asarray(junction["position"], dtype=np.float64)
+                # Контекстная подписка — круг вокруг центра, покрывающий форму с радиусом подхода
+                extent = float(np.hypot(*(shape - center).T).max()) if len(shape) else 0.0
+                try:
+                    traci.junction.subscribeContext(junction["id"], tc.CMD_GET_VEHICLE_VARIABLE, extent + radius, ZONE_VARS)
+                except traci.TraCIException as e:
+                    print(f"[{tls_id}]: не удалось подписаться на перекрёсток {junction['id']}: {e}")
+                    continue
+                shape = shape if len(shape) else center[None, :]
+                segments = shape_segments(shape)
+                # ТС ближе inner к центру заведомо в зоне (вписанный в форму круг + радиус подхода):
+                # точная проверка по сторонам нужна только остальным
+                inner = radius
+                if distance_to_shape(center, shape, segments)[0] == 0:
+                    inner += float(boundary_distance(center[None, :], segments)[0])
+                self.zones.append((junction["id"], k, shape, segments, center, inner))
+            via, lanes = {}, {}
+            for link_index, links in enumerate(tls_index.controlled_links(tls_id)):
+                for in_lane, out_lane, via_lane in links:
+                    if via_lane:
+                        via.setdefault(via_lane, link_index)
+                    lanes.setdefault(in_lane, []).append((link_index, out_lane.rsplit("_", 1)[0]))
+            self.via_link.append(via)
+            self.lane_links.append(lanes)
+        self.max_phases = max([len(logic.phases) for tls_id in self.tls_ids
+                               for logic in tls_index.programs(tls_id).values()] + [1])
+        self._links = {}  # ТС -> (полоса, связь) на прошлом шаге: связь пересчитывается при смене полосы
+        self._green = {}  # (индекс TLS, программа) -> (фазы, связи) bool
+        self.max_links = max([len(tls_index.controlled_links(tls_id)) for tls_id in self.tls_ids] + [1])
+
+    def vehicle_link(self, k, values):
+        """Связь (индекс в controlled_links) ТС на подходе или внутри перекрёстка; -1 — не определена"""
+        lane = values[tc.VAR_LANE_ID]
+        link = self.via_link[k].get(lane)
+        if link is not None:
+            return link
+        options = self.lane_links[k].get(lane)
+        if not options:
+            return -1
+        if len(options) == 1:
+            return options[0][0]
+        # Несколько движений с полосы: по следующему ребру маршрута
+        edges, route_index = values[tc.VAR_EDGES], values[tc.VAR_ROUTE_INDEX]
+        next_edge = edges[route_index + 1] if 0 <= route_index < len(edges) - 1 else None
+        for link, out_edge in options:
+            if out_edge == next_edge:
+                return link
+        return options[0][0]
+
+    def green_matrix(self, k):
+        """(фазы, связи) bool: связь зелёная (G/g) в фазе активной программы светофора k"""
+        logic = self.tls_index.active_logic(self.tls_ids[k])
+        key = (k, logic.programID)
+        green = self._green.get(key)
+        if green is None:
+            green = np.zeros((self.max_phases, self.max_links), dtype=bool)
+            for p, phase in enumerate(logic.phases[:self.max_phases]):
+                green[p, :len(phase.state)] = [c in "Gg" for c in phase.state[:self.max_links]]
+            green = self._green[key] = green
+        return green
+
+    def green_links(self, tls, phases, links):
+        """bool по парам: связь зелёная в активной фазе своего светофора"""
+        green = np.zeros(len(links), dtype=bool)
+        known = links >= 0
+        for k in np.unique(tls[known]):
+            mask = known & (tls == k)
+            green[mask] = self.green_matrix(int(k))[phases[mask], links[mask]]
+        return green
+
+    def step(self, tls_phases):
+        """Вызывать после traci.simulationStep(): near-miss шага по ТС в зонах перекрёстков"""
+        n = len(self.tls_ids)
+        results = traci.junction.getAllContextSubscriptionResults()
+        seen = set()
+        links = {}
+        positions, speeds, vehicle_tls, vehicle_link = [], [], [], []
+        for junction_id, k, shape, segments, center, inner in self.zones:
+            vehicles = results.get(junction_id)
+            if not vehicles:
+                continue
+            ids = [veh for veh in vehicles if veh not in seen]
+            if not ids:
+                continue
+            points = np.array([vehicles[veh][tc.VAR_POSITION] for veh in ids], dtype=np.float64).reshape(-1, 2)
+            inside = np.hypot(*(points - center).T) <= inner
+            rest = np.flatnonzero(~inside)
+            if len(rest):
+                inside[rest] = distance_to_shape(points[rest], shape, segments) <= self.radius
+            for veh, point, keep in zip(ids, points, inside):
+                if not keep:
+                    continue
+                seen.add(veh)
+                values = vehicles[veh]
+                positions.append(point)
+                speeds.append(values[tc.VAR_SPEED])
+                vehicle_tls.append(k)
+                lane = values[tc.VAR_LANE_ID]
+                cached = self._links.get(veh)
+                link = cached[1] if cached is not None and cached[0] == lane else self.vehicle_link(k, values)
+                links[veh] = (lane, link)
+                vehicle_link.append(link)
+        self._links = links
+        phase_counts = np.zeros((n, self.max_phases), dtype=np.int64)
+        link_counts = np.zeros((n, self.max_links), dtype=np.int64)
+        if len(positions) < 2:
+            return ZoneRisk(0, 0, np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.float64),
+                            phase_counts, link_counts, len(positions))
+        vehicle_tls = np.array(vehicle_tls, dtype=np.int64)
+        vehicle_link = np.array(vehicle_link, dtype=np.int64)
+        i, j, ttc = near_miss_pairs(np.array(positions), np.array(speeds, dtype=np.float64), PROXIMITY_THRESHOLD)
+        counts, ttc_sums = attribute_near_miss(i, j, ttc, vehicle_tls, n)
+        if len(ttc):
+            # Пара относится к светофору первого ТС; связь — первого ТС, иначе второго того же светофора
+            pair_tls = vehicle_tls[i]
+            pair_link = np.where(vehicle_link[i] >= 0, vehicle_link[i],
+                                 np.where(vehicle_tls[j] == pair_tls, vehicle_link[j], -1))
+            phases = np.asarray(tls_phases, dtype=np.int64)[pair_tls]
+            ok = (phases >= 0) & (phases < self.max_phases) & self.green_links(pair_tls, phases, pair_link)
+            phase_counts = np.bincount(pair_tls[ok] * self.max_phases + phases[ok],
+                                       minlength=n * self.max_phases).reshape(n, self.max_phases)
+            ok = (pair_link >= 0) & (pair_link < self.max_links)
+            link_counts = np.bincount(pair_tls[ok] * self.max_links + pair_link[ok],
+                                      minlength=n * self.max_links).reshape(n, self.max_links)
+        risk = float(ttc.mean()) if len(ttc) else 0
+        return ZoneRisk(int(len(ttc)), risk, counts, ttc_sums, phase_counts, link_counts, len(positions))
@@ -1,295 +1,481 @@
 # main.py: Основной скрипт, который запускает симуляцию, собирает метрики и оптимизирует фазы. Здесь основной цикл.
 import os
 import sys
+import time
 import argparse
-import csv
-import traci
-from sumolib import checkBinary
-from config import SUMO_HOME, SIM_STEPS, OPTIMIZE_INTERVAL, GUI, SUMOCFG_FILE
-from utils import detect_near_miss, optimize_phases, visualize_results, select_traffic_light
-from utils import analyze_tlslog
+import numpy as np
+from backend import traci, BACKENDS
+from config import SUMO_HOME, SIM_STEPS, OPTIMIZE_INTERVAL, GUI, HEADLESS, PLOT, BACKEND, SUMOCFG_FILE
+from config import ASYNC_OPTIMIZE, ASYNC_APPLY_DELAY, ASYNC_DEADLINE_POLICY, EXPORT_CSV, PHASE_CONTROLLER
+from config import EVENT_OPTIMIZE, RISK_SCOPE, APPROACH_RADIUS
+from config import RISK_SAMPLE_EVERY, RISK_SAMPLE_ADAPTIVE, RISK_SAMPLE_DENSITY_CHANGE, RISK_TREND_POINTS
+from config import WHATIF, WHATIF_WORKERS, WHATIF_BUDGET_SEC, CHECKPOINT_INTERVAL
+# Тяжёлые необязательные подсистемы (cvxpy, matplotlib, анализ tlslog, sumolib) импортируются по месту
+from utils import detect_near_miss_by_tls, visualize_results, select_traffic_lights
+from utils import program_counter, restore_program_counter
+from tlslog import TlsLogWriter
+from collector import StepCollector
+from controller import NetworkController, AsyncOptimizer, SWITCH_COLUMNS
+from recorder import ColumnarRecorder, RotatingCsvWriter
+from checkpoint import Checkpointer, latest_checkpoint, resume_options, STATE_OPTIONS
+from segments import segment_dir, write_segment
+from tls_index import TlsIndex
+from profiler import StageProfiler, NullProfiler
+from risk_sampling import RiskSampler, RiskTrend
 
-TLSLOG_FILE = os.path.join(os.path.dirname(__file__), 'tlslog.xml')
 if SUMO_HOME:
     tools = os.path.join(SUMO_HOME, 'tools')
     sys.path.append(tools)
 else:
     sys.exit("Please declare environment variable 'SUMO_HOME'")
 
-def generate_tlslog_from_observations(observed_csv_path, output_xml_path, tls_id):
-    """Генерирует tlslog.xml из CSV с наблюдаемыми переключениями фаз"""
-    import xml.etree.ElementTree as ET
-    from xml.dom import minidom
-    
-    root = ET.Element('tlsStates')
-    cumulative_time = 0.0
-    
-    try:
-        with open(observed_csv_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['tls_id'] == tls_id:
-                    state = row['state']
-                    duration = float(row['observed_duration_sec'])
-                    
-                    # Добавляем событие переключения в начало фазы
-                    tls_state = ET.SubElement(root, 'tlsState')
-                    tls_state.set('time', str(round(cumulative_time, 2)))
-                    tls_state.set('id', tls_id)
-                    tls_state.set('state', state)
-                    
-                    cumulative_time += duration
-    except Exception as e:
-        print(f"Ошибка при чтении {observed_csv_path}: {e}")
-        return
-    
-    # Записываем XML с форматированием
-    xml_str = minidom.parseString(ET.tostring(root)).toprettyxml(indent="    ")
-    with open(output_xml_path, 'w') as f:
-        f.write(xml_str)
-
-def start_sumo():
-    """Запуск SUMO симуляции"""
-    if GUI:
-        # Используем тот же путь, что и в script.py для GUI-версии
-        sumo_binary = "/Library/Frameworks/EclipseSUMO.framework/Versions/Current/EclipseSUMO/share/sumo/bin/sumo-gui"
+def start_sumo(backend=BACKEND, gui=GUI, seed=None, scale=None, output_dir=None, port=None, extra_args=()):
+    """Запуск SUMO симуляции через выбранный бэкенд (traci или libsumo).
+    seed/scale передаются в SUMO, output_dir — как --output-prefix для всех выходных файлов SUMO,
+    extra_args — дополнительные опции командной строки SUMO. port — порт TraCI только для backend traci
+    (libsumo работает in-process и порт игнорирует); None — свободный порт, занятый заданный заменяется свободным.
+    """
+    traci.use(backend)
+    if gui and backend == "libsumo":
+        print("libsumo работает только без GUI, запускаем sumo в headless-режиме")
+        gui = False
+    if gui and HEADLESS:
+        print("Нет дисплея (DISPLAY/WAYLAND_DISPLAY), запускаем sumo в headless-режиме")
+        gui = False
+    if gui:
         # Для GUI-версии убираем флаги скрытия вывода, чтобы показать окно
+        from sumolib import checkBinary
+        sumo_binary = checkBinary("sumo-gui")
         sumo_cmd = [sumo_binary, "-c", SUMOCFG_FILE]
     else:
-        # Для не-GUI версии тоже используем проверенный путь
-        sumo_binary = "/Library/Frameworks/EclipseSUMO.framework/Versions/Current/EclipseSUMO/share/sumo/bin/sumo"
-        # Для не-GUI версии добавляем флаги скрытия вывода
+        # Для не-GUI версии добавляем флаги скрытия вывода; libsumo бинарник не запускает — sumolib не нужен
+        if backend == "libsumo":
+            sumo_binary = "sumo"
+        else:
+            from sumolib import checkBinary
+            sumo_binary = checkBinary("sumo")
         sumo_cmd = [sumo_binary, "-c", SUMOCFG_FILE, "--no-step-log", "true", "-v", "false"]
+    if seed is not None:
+        sumo_cmd += ["--seed", str(seed)]
+    if scale is not None:
+        sumo_cmd += ["--scale", str(scale)]
+    if output_dir:
+        # SUMO дописывает префикс к путям из конфига относительно его каталога
+        config_dir = os.path.dirname(os.path.abspath(SUMOCFG_FILE))
+        sumo_cmd += ["--output-prefix", os.path.join(os.path.relpath(os.path.abspath(output_dir), config_dir), "")]
+    sumo_cmd += list(extra_args)
     
-    traci.start(sumo_cmd)
-    print(f"SUMO запущен с конфигом: {SUMOCFG_FILE}")
+    # Явный порт нужен только сокетному traci (libsumo работает in-process). Без порта traci.start сам берёт
+    # свободный (sumolib.miscutils.getFreeSocketPort) и повторяет запуск, если SUMO не смог его занять
+    if backend == "traci" and port is not None:
+        try:
+            traci.start(sumo_cmd, port=port)
+        except traci.FatalTraCIError:
+            print(f"Порт TraCI {port} занят, запускаем SUMO на свободном порту")
+            traci.start(sumo_cmd)
+    else:
+        traci.start(sumo_cmd)
+    print(f"SUMO запущен с конфигом: {SUMOCFG_FILE} (backend: {backend})")
 
-def run_simulation():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='SUMO Traffic Light Control Script')
-    parser.add_argument('--tls', type=str, help='ID конкретного светофора для управления')
-    parser.add_argument('--mode', choices=['baseline', 'opt'], default='opt', help='Режим: baseline (без оптимизации) или opt (с оптимизацией)')
-    args = parser.parse_args()
-    enable_optimization = (args.mode != 'baseline')
+    parser.add_argument('--tls', type=str, help='ID светофора, список ID через запятую или "all" для всех светофоров сети')
+    parser.add_argument('--mode', choices=['baseline', 'opt', 'replay'], default='opt', help='Режим: baseline (без оптимизации), opt (с оптимизацией) или replay (планы из --replay-from)')
+    parser.add_argument('--replay-from', type=str, help='tls_changes.csv или каталог прогона: расписание планов для --mode replay')
+    parser.add_argument('--near-miss', action=argparse.BooleanOptionalAction, default=True, help='Поиск near-miss на каждом шаге (по умолчанию включён во всех режимах; --no-near-miss — только в baseline и replay)')
+    parser.add_argument('--risk-every', type=int, default=RISK_SAMPLE_EVERY, help='Искать near-miss каждые K шагов (между поисками — значения последнего)')
+    parser.add_argument('--risk-adaptive', action=argparse.BooleanOptionalAction, default=RISK_SAMPLE_ADAPTIVE, help='Искать near-miss раньше K шагов, если число ТС заметно изменилось')
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND, help='traci (сокет) или libsumo (in-process, без GUI)')
+    parser.add_argument('--non-interactive', action='store_true', help='Без вопросов в консоли (по умолчанию управляются все светофоры; так же без терминала на stdin)')
+    parser.add_argument('--plot', action=argparse.BooleanOptionalAction, default=PLOT, help='Сохранять risk_trend.png (matplotlib)')
+    parser.add_argument('--gui', action=argparse.BooleanOptionalAction, default=GUI, help='Запускать sumo-gui (по умолчанию из config.GUI)')
+    parser.add_argument('--seed', type=int, help='Seed случайных чисел SUMO (по умолчанию из osm.sumocfg)')
+    parser.add_argument('--scale', type=float, help='Масштаб спроса SUMO (--scale)')
+    parser.add_argument('--steps', type=int, default=SIM_STEPS, help='Число шагов симуляции')
+    parser.add_argument('--output-dir', type=str, help='Каталог для всех выходных файлов прогона (по умолчанию рядом со скриптом)')
+    parser.add_argument('--route-files', type=str, help='Файл(ы) маршрутов вместо заданных в osm.sumocfg (через запятую)')
+    parser.add_argument('--port', type=int, help='Порт TraCI для backend traci (по умолчанию свободный; занятый заменяется свободным, libsumo порт игнорирует)')
+    parser.add_argument('--event-opt', action=argparse.BooleanOptionalAction, default=EVENT_OPTIMIZE, help='Ранний пересчёт по порогам, память решений, без переустановки того же плана')
+    parser.add_argument('--async-opt', action=argparse.BooleanOptionalAction, default=ASYNC_OPTIMIZE, help='Оптимизация в рабочем потоке без остановки шагов')
+    parser.add_argument('--apply-delay', type=int, default=ASYNC_APPLY_DELAY, help='Шагов от снимка входов до применения решения (async)')
+    parser.add_argument('--deadline-policy', choices=['wait', 'skip'], default=ASYNC_DEADLINE_POLICY, help='Если решение не готово к шагу применения (async)')
+    parser.add_argument('--profile', action='store_true', help='Замер латентности стадий шага, отчёт p50/p95/p99 и profile.json')
+    parser.add_argument('--risk-scope', choices=['network', 'junction'], default=RISK_SCOPE, help='Near-miss по всей сети или в зонах управляемых перекрёстков')
+    parser.add_argument('--approach-radius', type=float, default=APPROACH_RADIUS, help='Радиус подхода вокруг формы перекрёстка, м (--risk-scope junction)')
+    parser.add_argument('--whatif', action=argparse.BooleanOptionalAction, default=WHATIF, help='Проверять кандидатные планы прогоном «что если» в процессах SUMO')
+    parser.add_argument('--whatif-workers', type=int, default=WHATIF_WORKERS, help='Процессов SUMO для прогонов «что если»')
+    parser.add_argument('--whatif-budget', type=float, default=WHATIF_BUDGET_SEC, help='Бюджет времени проверки за интервал (сек)')
+    parser.add_argument('--export-csv', action=argparse.BooleanOptionalAction, default=EXPORT_CSV, help='Экспорт tls_observed.csv и step_metrics.csv из бинарных метрик')
+    parser.add_argument('--checkpoint-interval', type=int, default=CHECKPOINT_INTERVAL, help='Контрольная точка каждые N шагов (0 — выключено), с ротацией выходных файлов')
+    parser.add_argument('--resume', action='store_true', help='Продолжить прогон в --output-dir с последней контрольной точки')
+    args = parser.parse_args(argv)
+    if args.mode == 'replay' and not args.replay_from:
+        parser.error('--mode replay требует --replay-from')
+    if args.risk_every < 1:
+        parser.error('--risk-every должен быть >= 1')
+    if args.mode == 'opt' and not args.near_miss:
+        parser.error('--no-near-miss несовместим с --mode opt: оптимизатору нужен риск')
+    return args
+
+def run_simulation(argv=None):
+    t_start = time.perf_counter()
+    args = parse_args(argv)
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(output_dir, exist_ok=True)
+    tlslog_path = os.path.join(output_dir, 'tlslog.xml')
+    enable_optimization = (args.mode == 'opt')
+    use_whatif = enable_optimization and args.whatif
+    # Расписание планов читается целиком до старта: --replay-from может указывать на этот же каталог
+    schedule = None
+    if args.mode == 'replay':
+        from replay import ReplaySchedule
+        try:
+            schedule = ReplaySchedule(args.replay_from)
+        except (OSError, KeyError, ValueError) as e:
+            sys.exit(f"Не удалось прочитать расписание планов: {e}")
+        print(f"Воспроизведение: {schedule.plans} планов из {schedule.path}")
+    # Продолжение с контрольной точки (--resume): светофоры, состояние контроллера и части выходных файлов — из неё
+    checkpoint = None
+    if args.resume:
+        checkpoint = latest_checkpoint(output_dir)
+        if checkpoint is None:
+            sys.exit(f"Контрольная точка не найдена в {output_dir}")
+        if checkpoint["mode"] != args.mode:
+            sys.exit(f"Контрольная точка записана в режиме {checkpoint['mode']}, а не {args.mode}")
+        print(f"Продолжение с шага {checkpoint['step']}: {checkpoint['directory']}")
+    # Для прогонов «что если» и контрольных точек состояние сохраняется вместе с генераторами случайных чисел
+    extra_args = list(STATE_OPTIONS) if use_whatif or args.checkpoint_interval > 0 or checkpoint else []
+    if args.route_files:
+        extra_args += ["--route-files", args.route_files]
+    # Выходные файлы SUMO продолженного прогона — в своём подкаталоге (SUMO перезаписал бы файлы до сбоя)
+    sumo_dir = args.output_dir
+    sumo_args = list(extra_args)
+    if checkpoint:
+        sumo_dir = segment_dir(output_dir, checkpoint["step"])
+        os.makedirs(sumo_dir, exist_ok=True)
+        # Начало сегмента: анализ берёт из файлов до сбоя только записанное до этого времени
+        write_segment(sumo_dir, checkpoint["step"], checkpoint.get("time", checkpoint["step"]))
+        sumo_args += resume_options(checkpoint)
 
     try:
-        start_sumo()
+        start_sumo(args.backend, args.gui, args.seed, args.scale, sumo_dir, args.port, sumo_args)
     except traci.TraCIException as e:
         sys.exit(f"Failed to start SUMO: {e}")
    
     tls_ids = traci.trafficlight.getIDList()
     print(f"Доступные светофоры (TLS IDs): {tls_ids}")
-    tls_id = select_traffic_light(traci, tls_ids, args.tls)
-    if not tls_id:
-        traci.close()
-        sys.exit("Не удалось выбрать светофор")
-
-    # Проверяем, является ли выбранный ID светофором
-    if tls_id not in tls_ids:
-        print(f"ВНИМАНИЕ: {tls_id} не является ID светофора в SUMO.")
-        print("Будет использован первый доступный светофор.")
-        tls_id = tls_ids[0] if tls_ids else None
-        if not tls_id:
+    if checkpoint:
+        controlled = list(checkpoint["controlled"])
+    else:
+        # Без терминала (пакетные прогоны, CI) вопросы в консоли не задаются
+        interactive = not args.non_interactive and sys.stdin is not None and sys.stdin.isatty()
+        selected = select_traffic_lights(traci, tls_ids, args.tls, interactive=interactive)
+        if not selected:
             traci.close()
-            sys.exit("Нет доступных светофоров")
+            sys.exit("Не удалось выбрать светофор")
 
-    step = 0
-    total_near_miss = 0
-    total_delay = 0
-    risk_history = []
-    interval_near_miss = 0
-    interval_delay = 0
-    interval_risk_sum = 0
-    interval_steps = 0
+        # Проверяем, являются ли выбранные ID светофорами
+        controlled = []
+        for tls_id in selected:
+            if tls_id in tls_ids:
+                controlled.append(tls_id)
+            else:
+                print(f"ВНИМАНИЕ: {tls_id} не является ID светофора в SUMO.")
+        if not controlled:
+            print("Будет использован первый доступный светофор.")
+            if not tls_ids:
+                traci.close()
+                sys.exit("Нет доступных светофоров")
+            controlled = [tls_ids[0]]
+        # Убираем дубликаты, сохраняя порядок
+        controlled = list(dict.fromkeys(controlled))
 
-    # Подготовка CSV для логирования применённых длительностей фаз
-    csv_path = os.path.join(os.path.dirname(__file__), 'tls_changes.csv')
+    step = checkpoint["step"] if checkpoint else 0
+    first_step = None
+    outputs = checkpoint["outputs"] if checkpoint else {}
+    # Метрики шага — в колоночном буфере (блоки сбрасываются в step_metrics.arrow/.npz)
+    step_recorder = ColumnarRecorder("step_metrics", [
+        ("step", "i8"), ("time", "f8"), ("vehicles", "i4"), ("near_miss", "i8"), ("risk", "f8"), ("delay", "f8"),
+        ("sampled", "i1"),  # 1 — near-miss искались на этом шаге, 0 — повторены с последнего поиска (--risk-every)
+        ("tls_near_miss", "i4", (len(controlled),)),
+    ], output_dir, resume=outputs.get("step_metrics"))
+
+    # Подготовка CSV для логирования применённых длительностей фаз (части при контрольных точках)
+    csv_path = os.path.join(output_dir, 'tls_changes.csv')
+    csv_writer = None
     try:
-        csv_file = open(csv_path, mode='w', newline='')
-        csv_writer = csv.writer(csv_file)
-        csv_writer.writerow(["step", "tls_id", "requested_durations", "applied_durations"])
+        csv_writer = RotatingCsvWriter(csv_path, ["step", "tls_id", "requested_durations", "applied_durations",
+                                                  "interval_near_miss", "avg_interval_risk"],
+                                       resume=outputs.get("tls_changes"))
     except Exception as e:
-        csv_file = None
         print(f"Не удалось открыть файл для логирования изменений светофора: {e}")
-    # Подготовка CSV для наблюдаемых (реально отработанных) длительностей фаз
-    observed_csv_path = os.path.join(os.path.dirname(__file__), 'tls_observed.csv')
+    # Наблюдаемые (реально отработанные) длительности фаз; epoch разделяет "до"/"после" оптимизации
+    switch_recorder = ColumnarRecorder("tls_switches", SWITCH_COLUMNS, output_dir, resume=outputs.get("tls_switches"))
+
+    # tlslog.xml пишется потоково по мере переключений фаз
+    tlslog_writer = None
     try:
-        observed_file = open(observed_csv_path, mode='w', newline='')
-        observed_writer = csv.writer(observed_file)
-        # Добавляем epoch для разделения "до"/"после" оптимизации
-        observed_writer.writerow(["switch_step", "tls_id", "phase_index", "state", "observed_duration_sec", "epoch"])
+        tlslog_writer = TlsLogWriter(tlslog_path, controlled, resume=outputs.get("tlslog"))
     except Exception as e:
-        observed_file = None
-        print(f"Не удалось открыть файл для наблюдаемых длительностей фаз: {e}")
+        print(f"Не удалось открыть tlslog.xml: {e}")
 
-    # Инициализация отслеживания длительности фаз по переключениям
-    current_time = 0.0
-    prev_phase_index = None
-    prev_switch_time = None
-    observed_stats = {}  # phase_index -> {sum: float, count: int}
-    # Epoch: 0 = до первой оптимизации, 1 = после первой, и т.д.
-    current_epoch = 0
-    observed_stats_epochs = {}  # epoch -> {phase_index -> {sum: float, count: int}}
+    # Состояние по каждому управляемому светофору (фазы, эпохи, интервальный риск)
+    # Индекс светофоров (полосы, связи, программы) строится один раз и кэшируется на диске
+    tls_index = TlsIndex.load_or_build(controlled)
+    controller = NetworkController(controlled, switch_recorder, csv_writer, tls_index, tlslog_writer,
+                                   track_lanes=enable_optimization and PHASE_CONTROLLER == 'mpc',
+                                   event_optimize=enable_optimization and args.event_opt)
+    print(f"Управляемых светофоров: {len(controlled)}")
+    checkpointer = None
+    if args.checkpoint_interval > 0:
+        # Программы сети запоминаются до восстановления: в точку пишутся только установленные прогоном
+        checkpointer = Checkpointer(output_dir, args.checkpoint_interval, tls_index, controlled, sumo_dir, step=step)
+    # Оптимизатор (mpc, phase_solver) импортируется только в режиме opt
+    if enable_optimization:
+        from mpc import call_counters, restore_call_counters
+        from phase_solver import solver_latency
+        solver_latency.reset()
+    else:
+        call_counters, restore_call_counters = dict, lambda calls: None
+    if checkpoint:
+        controller.restore(checkpoint["controller"])
+        restore_program_counter(checkpoint["program_counter"])
+        restore_call_counters(checkpoint["mpc_calls"])
+    whatif_pool = None
+    if use_whatif:
+        from whatif import WhatIfPool
+        whatif_pool = WhatIfPool(sumo_dir or output_dir, args.backend, args.seed, args.scale, prefixed=bool(sumo_dir),
+                                 extra_args=extra_args, workers=args.whatif_workers, budget=args.whatif_budget)
+        controller.whatif = whatif_pool
+        print(f"Проверка «что если»: {args.whatif_workers} процессов SUMO, бюджет {args.whatif_budget} с")
+    async_optimizer = None
+    if enable_optimization and args.async_opt:
+        async_optimizer = AsyncOptimizer(controller, args.apply_delay, args.deadline_policy)
+        print(f"Асинхронная оптимизация: применение через {async_optimizer.apply_delay} шагов, политика {args.deadline_policy}")
 
-    # Вспомогательная функция: получить активную логику по текущему programID
-    def get_active_logic(tls_id_local):
-        try:
-            active_id = traci.trafficlight.getProgram(tls_id_local)
-            all_logics = traci.trafficlight.getAllProgramLogics(tls_id_local)
-            for lg in all_logics:
-                if lg.programID == active_id:
-                    return lg
-            # Фолбэк: если не нашли по programID, вернуть первую
-            return all_logics[0] if all_logics else None
-        except Exception:
-            return None
-    while step < SIM_STEPS:
+    # Подписки TraCI: один bulk-снимок ТС и фаз светофоров на шаг
+    collector = StepCollector(controlled)
+    # Зоны конфликтов перекрёстков (--risk-scope junction): контекстные подписки на перекрёстки
+    zones = None
+    if args.risk_scope == 'junction' and args.near_miss:
+        from junction_risk import JunctionZones
+        zones = JunctionZones(controlled, tls_index, args.approach_radius)
+        print(f"Near-miss в зонах перекрёстков: {len(zones.zones)} зон, радиус подхода {args.approach_radius} м")
+    # Выборочный поиск near-miss (--risk-every, --risk-adaptive) и тренд риска для графика ограниченного размера
+    sampler = RiskSampler(args.risk_every, args.risk_adaptive, RISK_SAMPLE_DENSITY_CHANGE)
+    trend = RiskTrend(RISK_TREND_POINTS)
+    if checkpoint:
+        sampler.restore(checkpoint["risk_sampler"])
+        trend.restore(checkpoint["risk_trend"])
+    if sampler.enabled:
+        print(f"Поиск near-miss каждые {sampler.every} шагов{' (адаптивно по числу ТС)' if sampler.adaptive else ''}")
+    # Без поиска near-miss (--no-near-miss) по светофорам пишутся нули
+    no_counts = np.zeros(len(controlled), dtype=np.int64)
+    no_ttc_sums = np.zeros(len(controlled), dtype=np.float64)
+    # Профилирование стадий шага (--profile); без флага — заглушка без накладных расходов
+    profiler = StageProfiler() if args.profile else NullProfiler()
+    while step < args.steps:
         try:
+            t = profiler.now()
             traci.simulationStep()
             current_time = traci.simulation.getTime()
+            t = profiler.lap("simulation_step", t)
+            snapshot = collector.step()
+            t = profiler.lap("collect", t)
            
-            near_miss, risk = detect_near_miss()
-            interval_near_miss += near_miss
-            total_near_miss += near_miss
-            current_delay = sum(traci.vehicle.getWaitingTime(veh) for veh in traci.vehicle.getIDList())
-            interval_delay += current_delay
-            total_delay += current_delay
-            interval_risk_sum += risk
-            interval_steps += 1
-            risk_history.append(risk)
+            sampled = not args.near_miss or sampler.due(step, len(snapshot.ids))
+            if not args.near_miss:
+                near_miss, risk, tls_counts, tls_ttc_sums = 0, 0, no_counts, no_ttc_sums
+            elif not sampled:
+                # Шаг без поиска: значения последнего поиска; очереди по полосам для MPC — из снимка шага
+                if controller.track_lanes:
+                    controller.observe_vehicles(snapshot)
+                near_miss, risk, tls_counts, tls_ttc_sums = sampler.repeat()
+                if sampler.held_phase is not None:
+                    controller.add_phase_risk(snapshot.tls_phases, *sampler.held_phase)
+            elif zones is None:
+                vehicle_tls = controller.observe_vehicles(snapshot)
+                near_miss, risk, tls_counts, tls_ttc_sums = detect_near_miss_by_tls(
+                    snapshot.positions, snapshot.speeds, vehicle_tls, len(controlled))
+                sampler.hold(step, len(snapshot.ids), (near_miss, risk, tls_counts, tls_ttc_sums))
+            else:
+                # Очереди по полосам для MPC по-прежнему из снимка шага
+                if controller.track_lanes:
+                    controller.observe_vehicles(snapshot)
+                zone = zones.step(snapshot.tls_phases)
+                near_miss, risk, tls_counts, tls_ttc_sums = zone.near_miss, zone.risk, zone.tls_counts, zone.tls_ttc_sums
+                controller.add_phase_risk(snapshot.tls_phases, zone.phase_counts, zone.link_counts)
+                sampler.hold(step, len(snapshot.ids), (near_miss, risk, tls_counts, tls_ttc_sums),
+                             (zone.phase_counts, zone.link_counts))
+            if sampled:
+                trend.add(step, risk)
+            controller.add_step_risk(tls_counts, tls_ttc_sums)
+            t = profiler.lap("near_miss", t)
+            current_delay = float(snapshot.waiting.sum())
+            t = profiler.lap("delay", t)
+            step_recorder.append(step, current_time, len(snapshot.ids), near_miss, risk, current_delay, int(sampled),
+                                 tls_counts)
+            t = profiler.lap("record", t)
            
-            # Отслеживание смены фазы и фиксация фактической длительности
+            # Отслеживание смены фаз и фиксация фактической длительности
             try:
-                phase_index = traci.trafficlight.getPhase(tls_id)
-                # Инициализируем предыдущие значения при первом проходе
-                if prev_phase_index is None:
-                    prev_phase_index = phase_index
-                    # Восстановим время последнего переключения, чтобы корректно закрыть первую фазу
-                    try:
-                        elapsed = traci.trafficlight.getTimeSinceLastSwitch(tls_id)
-                        prev_switch_time = max(0.0, current_time - elapsed)
-                    except Exception:
-                        prev_switch_time = current_time
-                # Если фаза сменилась, считаем длительность предыдущей фазы
-                if phase_index != prev_phase_index and prev_switch_time is not None:
-                    observed_duration = max(0.0, current_time - prev_switch_time)
-                    # Пытаемся получить состояние предыдущей фазы из активной логики
-                    state = None
-                    try:
-                        logic = traci.trafficlight.getAllProgramLogics(tls_id)[0]
-                        if 0 <= prev_phase_index < len(logic.phases):
-                            state = logic.phases[prev_phase_index].state
-                    except Exception:
-                        state = None
-                    # Пишем в CSV
-                    if observed_file:
-                        observed_writer.writerow([step, tls_id, prev_phase_index, state or "?", round(observed_duration, 2), current_epoch])
-                    # Агрегируем статистику
-                    st = observed_stats.get(prev_phase_index, {"sum": 0.0, "count": 0})
-                    st["sum"] += observed_duration
-                    st["count"] += 1
-                    observed_stats[prev_phase_index] = st
-                    # Агрегируем по эпохам
-                    epoch_bucket = observed_stats_epochs.get(current_epoch, {})
-                    est = epoch_bucket.get(prev_phase_index, {"sum": 0.0, "count": 0})
-                    est["sum"] += observed_duration
-                    est["count"] += 1
-                    epoch_bucket[prev_phase_index] = est
-                    observed_stats_epochs[current_epoch] = epoch_bucket
-                    # Обновляем предыдущие
-                    prev_phase_index = phase_index
-                    prev_switch_time = current_time
+                controller.track_phases(step, current_time, snapshot.tls_phases)
             except Exception:
                 pass
+            t = profiler.lap("phase_tracking", t)
 
-            if enable_optimization and step % OPTIMIZE_INTERVAL == 0 and step > 0:
-                avg_interval_risk = interval_risk_sum / interval_steps if interval_steps else 0
-                current_logic = get_active_logic(tls_id)
-                try:
-                    # Ensure current_logic.phases is a list of traffic light phases
-                    # and that individual phase durations are integers.
-                    new_durations = optimize_phases(interval_near_miss, avg_interval_risk, current_logic, tls_id)
-                    # Читаем обратно применённые длительности фаз из активной логики
-                    applied_logic = get_active_logic(tls_id)
-                    applied_durations = [p.duration for p in applied_logic.phases]
-                    try:
-                        active_program_id = traci.trafficlight.getProgram(tls_id)
-                    except Exception:
-                        active_program_id = "?"
-                    print(f"Step {step}: Program {active_program_id} | Optimized: {new_durations} | Applied: {applied_durations}")
-                    # Сохраняем в CSV для последующей проверки
-                    if csv_file:
-                        csv_writer.writerow([step, tls_id, ";".join(map(str, new_durations)), ";".join(map(str, applied_durations))])
-                    # После успешной оптимизации переключаем эпоху ("после оптимизации")
-                    try:
-                        current_epoch += 1
-                    except Exception:
-                        pass
-                except Exception as e:
-                    print(f"Step {step}: Error optimizing phases: {e}")
-                    print("Continuing with current settings")
-                interval_near_miss = 0
-                interval_delay = 0
-                interval_risk_sum = 0
-                interval_steps = 0
+            if enable_optimization and step > 0:
+                # Светофоры, у которых закончился интервал или превышены пороги (--event-opt)
+                due = controller.due_tls()
+                if len(due):
+                    ks = None if len(due) == len(controlled) else due
+                    if async_optimizer:
+                        async_optimizer.submit(step, ks)
+                    else:
+                        controller.optimize_all(step, ks)
+                    t = profiler.lap("optimize", t)
+            elif schedule is not None and step > 0:
+                # Записанные планы на тех же шагах (интервал светофора — с его прошлого плана, как в opt)
+                plans = schedule.plans_at(step)
+                if plans:
+                    controller.apply_plans(step, plans)
+                    t = profiler.lap("optimize", t)
+            elif step % OPTIMIZE_INTERVAL == 0:
+                controller.reset_interval()
+            if async_optimizer:
+                async_optimizer.poll(step)
+                t = profiler.lap("optimize_apply", t)
            
+            if first_step is None:
+                # Время до первого шага: импорты, запуск SUMO, индекс светофоров, первый шаг
+                first_step = time.perf_counter() - t_start
+                print(f"Time to first step: {first_step:.3f}s")
             step += 1
+            # Контрольная точка — когда нет решения в полёте (async), иначе на следующем шаге
+            if checkpointer and checkpointer.due(step) and (async_optimizer is None or async_optimizer.pending is None):
+                parts = {"step_metrics": step_recorder, "tls_switches": switch_recorder,
+                         "tls_changes": csv_writer, "tlslog": tlslog_writer}
+                checkpointer.save(step, tls_index, {
+                    "mode": args.mode, "time": traci.simulation.getTime(), "controlled": controlled, "controller": controller.checkpoint_state(),
+                    "program_counter": program_counter(), "mpc_calls": call_counters(),
+                    "risk_sampler": sampler.checkpoint_state(), "risk_trend": trend.checkpoint_state(),
+                    "outputs": {name: part.rotate() for name, part in parts.items() if part is not None},
+                })
+                t = profiler.lap("checkpoint", t)
         except traci.TraCIException as e:
             print(f"Simulation step error: {e}")
             break
    
+    if async_optimizer:
+        async_optimizer.shutdown()
+        if async_optimizer.deadline_misses:
+            print(f"Async optimization deadline misses: {async_optimizer.deadline_misses}")
     traci.close()
+    if whatif_pool:
+        print(f"What-if evaluation: {whatif_pool.summary()}")
+        whatif_pool.shutdown()
     
-    # Создаем tlslog.xml из собранных данных наблюдений
+    # Закрываем CSV-файлы, если открывали
     try:
-        generate_tlslog_from_observations(observed_csv_path, TLSLOG_FILE, tls_id)
-        print(f"Создан tlslog.xml на основе наблюдений TraCI: {TLSLOG_FILE}")
-    except Exception as e:
-        print(f"Не удалось создать tlslog.xml: {e}")
-    
-    # Закрываем CSV-файл, если открывали
-    try:
-        if csv_file:
-            csv_file.close()
+        if csv_writer:
+            csv_writer.close()
             print(f"Лог изменений светофора сохранён: {csv_path}")
-        if observed_file:
-            observed_file.close()
-            print(f"Лог наблюдаемых длительностей фаз сохранён: {observed_csv_path}")
     except Exception:
         pass
+    # Сброс остатка метрик на диск и опциональный экспорт в CSV
+    step_recorder.close()
+    switch_recorder.close()
+    print(f"Метрики сохранены: {step_recorder.path}, {switch_recorder.path}")
+    if args.export_csv:
+        try:
+            observed_csv_path = os.path.join(output_dir, 'tls_observed.csv')
+            controller.export_switches_csv(observed_csv_path)
+            print(f"Лог наблюдаемых длительностей фаз сохранён: {observed_csv_path}")
+            step_recorder.export_csv(os.path.join(output_dir, 'step_metrics.csv'),
+                                     formatters={"tls_near_miss": lambda v: ";".join(map(str, v))})
+        except Exception as e:
+            print(f"Не удалось экспортировать CSV: {e}")
+
+    # Завершаем tlslog.xml (остаток буфера и закрывающий тег)
+    try:
+        if tlslog_writer:
+            tlslog_writer.close()
+            print(f"Создан tlslog.xml на основе наблюдений TraCI: {tlslog_path}")
+    except Exception as e:
+        print(f"Не удалось создать tlslog.xml: {e}")
+    
+    total_delay = float(step_recorder.column("delay").sum())
+    total_near_miss = int(step_recorder.column("near_miss").sum())
     print(f"Total delay: {total_delay}, Total near-miss: {total_near_miss}")
-    visualize_results(risk_history)
-    # Анализ tlslog.xml: сравнение средних длительностей фаз до/после оптимизации
+    risk_sampling = sampler.summary() if sampler.enabled else None
+    if risk_sampling:
+        # Near-miss пропущенных шагов — повтор последнего поиска: итог — оценка по всем шагам
+        print(f"Risk sampling: {risk_sampling}")
+    latency = None
+    if enable_optimization:
+        from phase_solver import solver_latency_summary
+        latency = solver_latency_summary()
+    if latency:
+        print(f"Optimizer latency: {latency}")
+    if enable_optimization or schedule is not None:
+        print(f"Optimization: {controller.opt_stats}")
+    # Прогноз очередей моделью MPC против измеренных в SUMO (ТС·с на полосах светофоров за время действия планов)
+    model_check = controller.model_check_summary()
+    if model_check:
+        print(f"MPC model check: {model_check}")
+    if profiler.enabled:
+        profiler.print_report()
+        profile_path = os.path.join(output_dir, 'profile.json')
+        profiler.export_json(profile_path, meta={
+            "mode": args.mode, "backend": args.backend, "steps": step, "controlled_tls": len(controlled),
+            "optimizer": latency, "time_to_first_step": first_step, "risk_sampling": risk_sampling,
+        })
+        print(f"Профиль сохранён: {profile_path}")
+    if args.plot:
+        visualize_results(trend, os.path.join(output_dir, 'risk_trend.png'))
+    # Анализ tlslog.xml (один потоковый проход по всем светофорам)
     try:
-        summary = analyze_tlslog(tls_id, TLSLOG_FILE)
+        from tlslog import summarize_tlslog
+        summaries = summarize_tlslog(tlslog_path, controlled)
+    except Exception as e:
+        summaries = {}
+        print(f"Ошибка анализа tlslog.xml: {e}")
+    for tls_id in controlled:
+        summary = summaries.get(tls_id)
         if summary:
-            print("TLSLOG summary (avg durations by state):")
+            print(f"TLSLOG summary for {tls_id} (avg durations by state):")
             print(f"  {summary}")
         else:
-            print("tlslog.xml пуст или не содержит записи по выбранному светофору")
-    except Exception as e:
-        print(f"Ошибка анализа tlslog.xml: {e}")
+            print(f"tlslog.xml пуст или не содержит записи по светофору {tls_id}")
 
-    # Сводка наблюдаемых длительностей по индексам фаз (TraCI)
-    try:
-        if observed_stats:
-            print("Observed phase durations (avg by phase index):")
-            for idx, st in sorted(observed_stats.items()):
-                avg = round(st["sum"] / max(1, st["count"]), 2)
-                print(f"  phase {idx}: {avg}s over {st['count']} switches")
-            # Сводка по эпохам: до/после оптимизации
-            if observed_stats_epochs:
-                print("Observed phase durations per epoch (avg by phase index):")
-                for epoch in sorted(observed_stats_epochs.keys()):
-                    bucket = observed_stats_epochs[epoch]
-                    label = "before first optimization" if epoch == 0 else f"after optimization #{epoch}"
-                    print(f"  Epoch {epoch} ({label}):")
-                    for idx, st in sorted(bucket.items()):
-                        avg = round(st["sum"] / max(1, st["count"]), 2)
-                        print(f"    phase {idx}: {avg}s over {st['count']} switches")
-        else:
-            print("Недостаточно наблюдений для расчёта фактических длительностей фаз.")
-    except Exception:
-        pass
+    if zones is not None:
+        for tls_id, (by_phase, by_link) in controller.conflict_summary().items():
+            print(f"Near-miss by phase for {tls_id}: {by_phase}")
+            for link, count, movement in by_link[:5]:
+                print(f"  link {link} ({movement}): {count}")
+
+    # Сводка наблюдаемых длительностей по индексам фаз (из записанных переключений)
+    observed = controller.observed_summary()
+    for tls_id in controlled:
+        if tls_id not in observed:
+            print(f"Недостаточно наблюдений для расчёта фактических длительностей фаз {tls_id}.")
+            continue
+        overall, by_epoch = observed[tls_id]
+        print(f"Observed phase durations for {tls_id} (avg by phase index):")
+        for idx, (avg, count) in sorted(overall.items()):
+            print(f"  phase {idx}: {avg}s over {count} switches")
+        # Сводка по эпохам: до/после оптимизации
+        print("Observed phase durations per epoch (avg by phase index):")
+        for epoch, bucket in sorted(by_epoch.items()):
+            label = "before first optimization" if epoch == 0 else f"after optimization #{epoch}"
+            print(f"  Epoch {epoch} ({label}):")
+            for idx, (avg, count) in sorted(bucket.items()):
+                print(f"    phase {idx}: {avg}s over {count} switches")
+
+    # Итоги прогона для вызывающего кода (бенчмарки, пакетные прогоны)
+    return {"steps": step, "total_delay": total_delay, "total_near_miss": total_near_miss,
+            "optimizer": latency, "optimization": controller.opt_stats, "profiler": profiler, "output_dir": output_dir,
+            "time_to_first_step": first_step, "risk_sampling": risk_sampling, "model_check": model_check}
 
 if __name__ == "__main__":
-    run_simulation()
\ No newline at end of file
+    run_simulation()
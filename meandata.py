@@ -0,0 +1,237 @@
+# meandata.py: Временные ряды по рёбрам и полосам из edgeData.xml / laneData.xml (meandata SUMO)
+# XML разбирается один раз потоково и сохраняется рядом с ним (.meandata/) как memory-mapped массив .npy
+# (объекты × интервалы × метрики, float32) с индексом ID и границ интервалов. Повторный анализ и сравнение
+# прогонов читают только нужные срезы с диска, без повторного разбора XML.
+import os
+import gzip
+import json
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from segments import segment_files
+
+STORE_DIR = ".meandata"
+STORE_VERSION = 1
+SOURCES = {"edge": "edgeData.xml", "lane": "laneData.xml"}
+METRICS = ("speed", "occupancy", "density", "waitingTime", "timeLoss", "sampledSeconds", "entered", "left")
+# Значение, если SUMO не записал атрибут (пустой интервал): скорость не определена, остальное — 0
+DEFAULTS = np.array([np.nan if name == "speed" else 0.0 for name in METRICS], dtype=np.float32)
+# Рост метрики — ухудшение (сортировка «худших» объектов при сравнении)
+HIGHER_IS_WORSE = {"speed": False, "occupancy": True, "density": True, "waitingTime": True, "timeLoss": True,
+                   "sampledSeconds": False, "entered": False, "left": False}
+RECORD_CHUNK = 65536  # записей в буфере до сброса во временный файл
+
+_RECORD = np.dtype([("slot", np.int32), ("interval", np.int32), ("values", np.float32, (len(METRICS),))])
+
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _source_key(path):
+    st = os.stat(path)
+    return [os.path.basename(path), st.st_size, st.st_mtime_ns]
+
+
+def convert(xml_path, prefix, kind):
+    """Потоковый разбор meandata kind ("edge"/"lane") в prefix.npy (memmap) и prefix.index.npz.
+    Один проход по XML: записи (объект, интервал, метрики) копятся во временном файле, затем раскладываются
+    в массив, размер которого известен только после прохода."""
+    ids = {}  # id -> строка массива
+    begins, ends = [], []
+    records = []
+    defaults = DEFAULTS.tolist()
+    tmp_path = prefix + ".records.tmp"
+    # Временный файл записей удаляется и при ошибке разбора (например, обрезанный XML)
+    try:
+        with open(tmp_path, "wb") as tmp, _open(xml_path) as f:
+            root = None
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    elif elem.tag == "interval":
+                        begins.append(float(elem.get("begin")))
+                        ends.append(float(elem.get("end")))
+                    continue
+                if elem.tag == kind:
+                    get = elem.get
+                    records.append((ids.setdefault(get("id"), len(ids)), len(begins) - 1,
+                                    [d if v is None else float(v) for v, d in zip(map(get, METRICS), defaults)]))
+                    if len(records) == RECORD_CHUNK:
+                        tmp.write(np.array(records, dtype=_RECORD).tobytes())
+                        records.clear()
+                elem.clear()
+                # Завершённый интервал больше не нужен: память не растёт с длиной файла
+                if elem.tag == "interval":
+                    root.clear()
+            tmp.write(np.array(records, dtype=_RECORD).tobytes())
+        values = np.lib.format.open_memmap(prefix + ".npy", mode="w+", dtype=np.float32,
+                                           shape=(len(ids), len(begins), len(METRICS)))
+        values[:] = DEFAULTS
+        stored = np.memmap(tmp_path, dtype=_RECORD, mode="r") if os.path.getsize(tmp_path) else np.empty(0, dtype=_RECORD)
+        for start in range(0, len(stored), RECORD_CHUNK):
+            chunk = stored[start:start + RECORD_CHUNK]
+            values[chunk["slot"], chunk["interval"]] = chunk["values"]
+        values.flush()
+        del values, stored
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    np.savez(prefix + ".index.npz", ids=np.array(list(ids), dtype=str), begin=np.array(begins), end=np.array(ends),
+             metrics=np.array(METRICS),
+             meta=np.array(json.dumps({"version": STORE_VERSION, "source": _source_key(xml_path)})))
+
+
+class MeanDataStore:
+    """Временные ряды meandata: values[объект, интервал, метрика] (memmap только для чтения)"""
+
+    def __init__(self, values, ids, begin, end, metrics):
+        self.values = values
+        self.ids = ids
+        self.begin = begin
+        self.end = end
+        self.metrics = list(metrics)
+        self._index = None
+
+    @classmethod
+    def from_source(cls, xml_path, kind, rebuild=False) -> Optional["MeanDataStore"]:
+        """Хранилище для файла meandata (строится или перестраивается, если XML изменился); None — файла нет"""
+        if not os.path.exists(xml_path):
+            return None
+        directory = os.path.join(os.path.dirname(os.path.abspath(xml_path)), STORE_DIR)
+        prefix = os.path.join(directory, kind)
+        stale = rebuild
+        try:
+            with np.load(prefix + ".index.npz") as index:
+                meta = json.loads(str(index["meta"]))
+            stale = stale or meta.get("version") != STORE_VERSION or meta.get("source") != _source_key(xml_path)
+        except (OSError, KeyError, ValueError):
+            stale = True
+        if stale:
+            os.makedirs(directory, exist_ok=True)
+            convert(xml_path, prefix, kind)
+        with np.load(prefix + ".index.npz") as index:
+            ids, begin, end, metrics = index["ids"], index["begin"], index["end"], index["metrics"].tolist()
+        return cls(np.load(prefix + ".npy", mmap_mode="r"), ids, begin, end, metrics)
+
+    @classmethod
+    def open(cls, run_path, kind="edge", rebuild=False) -> Optional["MeanDataStore"]:
+        """Хранилище прогона по каталогу (edgeData.xml или laneData.xml, в т.ч. .gz);
+        у продолженного прогона — интервалы всех сегментов (segments.py)"""
+        return cls.combine([(cls.from_source(path, kind, rebuild), segment)
+                            for path, segment in segment_files(run_path, SOURCES[kind])])
+
+    @classmethod
+    def combine(cls, parts) -> Optional["MeanDataStore"]:
+        """Хранилище из частей [(хранилище или None, сегмент)]: от каждой — интервалы, целиком лежащие
+        в окне сегмента; объекты объединяются. Один сегмент без окна — исходное хранилище (memmap),
+        иначе массив в памяти. Точки ставятся на границах интервалов (checkpoint.py), так что сетка интервалов
+        совпадает с непрерывным прогоном; интервал, через который проходит граница сегмента (точка вне сетки),
+        отбрасывается с предупреждением."""
+        parts = [(store, segment) for store, segment in parts if store is not None]
+        if not parts:
+            return None
+        if len(parts) == 1 and parts[0][1].begin is None and parts[0][1].end is None:
+            return parts[0][0]
+        columns = []
+        for store, segment in parts:
+            keep = np.ones(len(store.begin), dtype=bool)
+            if segment.begin is not None:
+                keep &= store.begin >= segment.begin
+            if segment.end is not None:
+                keep &= store.end <= segment.end
+                straddling = int(np.count_nonzero((store.begin < segment.end) & (store.end > segment.end)))
+                if straddling:
+                    print(f"meandata {segment.directory}: контрольная точка {segment.end:g} с не на границе интервала, "
+                          f"отброшено интервалов: {straddling}")
+            columns.append(np.flatnonzero(keep))
+        ids = list(dict.fromkeys(object_id for store, _ in parts for object_id in store.ids.tolist()))
+        values = np.empty((len(ids), sum(map(len, columns)), len(METRICS)), dtype=np.float32)
+        values[:] = DEFAULTS
+        rows = {object_id: k for k, object_id in enumerate(ids)}
+        begin, end = [], []
+        offset = 0
+        for (store, _), cols in zip(parts, columns):
+            index = np.fromiter((rows[i] for i in store.ids.tolist()), dtype=np.int64, count=len(store.ids))
+            order = [store.metrics.index(name) for name in METRICS]
+            values[index, offset:offset + len(cols)] = store.values[:, cols][:, :, order]
+            begin.append(store.begin[cols])
+            end.append(store.end[cols])
+            offset += len(cols)
+        return cls(values, np.array(ids, dtype=str), np.concatenate(begin), np.concatenate(end), METRICS)
+
+    def index_of(self, ids) -> np.ndarray:
+        """Строки массива для ID (-1 — нет в хранилище)"""
+        if self._index is None:
+            self._index = {object_id: k for k, object_id in enumerate(self.ids.tolist())}
+        return np.fromiter((self._index.get(i, -1) for i in ids), dtype=np.int64, count=len(ids))
+
+    def metric(self, name) -> np.ndarray:
+        """(объекты, интервалы) — срез memmap без копирования"""
+        return self.values[:, :, self.metrics.index(name)]
+
+    def summary(self, prefix) -> Dict[str, float]:
+        """Скалярные KPI: средняя скорость (взвешенная по sampledSeconds), средние занятость и плотность,
+        суммарные потери времени и ожидание"""
+        if not self.values.size:
+            return {f"{prefix}_speed_avg": 0.0, f"{prefix}_occupancy_avg": 0.0, f"{prefix}_density_avg": 0.0,
+                    f"{prefix}_time_loss": 0.0, f"{prefix}_waiting_time": 0.0}
+        speed = self.metric("speed")
+        weights = np.where(np.isnan(speed), 0.0, self.metric("sampledSeconds"))
+        total = float(weights.sum())
+        return {
+            f"{prefix}_speed_avg": float(np.nansum(speed * weights) / total) if total else 0.0,
+            f"{prefix}_occupancy_avg": float(self.metric("occupancy").mean()),
+            f"{prefix}_density_avg": float(self.metric("density").mean()),
+            f"{prefix}_time_loss": float(self.metric("timeLoss").sum(dtype=np.float64)),
+            f"{prefix}_waiting_time": float(self.metric("waitingTime").sum(dtype=np.float64)),
+        }
+
+
+def _nanmean(values, axis):
+    """Среднее без NaN; NaN, где значений нет (без предупреждений numpy)"""
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=axis)
+    sums = np.where(valid, values, 0.0).sum(axis=axis, dtype=np.float64)
+    return np.divide(sums, counts, out=np.full(counts.shape, np.nan), where=counts > 0)
+
+
+def align(base, other):
+    """Общие объекты и интервалы двух хранилищ: (ids, строки base, строки other, begin, столбцы base, столбцы other)"""
+    ids, rows_base, rows_other = np.intersect1d(base.ids, other.ids, assume_unique=True, return_indices=True)
+    begin, cols_base, cols_other = np.intersect1d(base.begin, other.begin, assume_unique=True, return_indices=True)
+    return ids, rows_base, rows_other, begin, cols_base, cols_other
+
+
+def metric_pair(base, other, metric) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(ids, begin, base (n, T), other (n, T)) по общим объектам и интервалам; с диска читаются только они"""
+    ids, rows_base, rows_other, begin, cols_base, cols_other = align(base, other)
+    return (ids, begin, np.asarray(base.metric(metric)[np.ix_(rows_base, cols_base)], dtype=np.float64),
+            np.asarray(other.metric(metric)[np.ix_(rows_other, cols_other)], dtype=np.float64))
+
+
+def top_changes(base, other, metric="speed", k=10) -> List[Tuple[str, float, float, float]]:
+    """k объектов с наибольшим ухудшением метрики (other относительно base, среднее по интервалам):
+    [(id, среднее base, среднее other, изменение)]"""
+    ids, _, a, b = metric_pair(base, other, metric)
+    mean_a, mean_b = _nanmean(a, axis=1), _nanmean(b, axis=1)
+    delta = _nanmean(b - a, axis=1)
+    worse = delta if HIGHER_IS_WORSE[metric] else -delta
+    order = np.argsort(np.where(np.isnan(worse), np.inf, -worse), kind="stable")[:k]
+    return [(str(ids[i]), float(mean_a[i]), float(mean_b[i]), float(delta[i])) for i in order if not np.isnan(delta[i])]
+
+
+def interval_deltas(base, other, metric="speed") -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """По интервалам: (begin, base, other, other - base) — среднее по общим объектам;
+    скорость взвешивается по sampledSeconds каждого прогона"""
+    ids, begin, a, b = metric_pair(base, other, metric)
+    if metric == "speed":
+        _, _, wa, wb = metric_pair(base, other, "sampledSeconds")
+        wa, wb = np.where(np.isnan(a), 0.0, wa), np.where(np.isnan(b), 0.0, wb)
+        sa, sb = wa.sum(axis=0), wb.sum(axis=0)
+        mean_a = np.divide(np.nansum(a * wa, axis=0), sa, out=np.full(len(begin), np.nan), where=sa > 0)
+        mean_b = np.divide(np.nansum(b * wb, axis=0), sb, out=np.full(len(begin), np.nan), where=sb > 0)
+    else:
+        mean_a, mean_b = _nanmean(a, axis=0), _nanmean(b, axis=0)
+    return begin, mean_a, mean_b, mean_b - mean_a
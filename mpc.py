@@ -0,0 +1,174 @@
+# mpc.py: Прогнозирующее управление (receding horizon) длительностями фаз на модели очередей
+# Для каждого светофора по очередям и интенсивностям прибытия на контролируемых полосах прогнозируется
+# суммарная задержка на MPC_HORIZON секунд вперёд для тысяч кандидатных планов сразу (NumPy),
+# выбирается план с минимумом задержки + штрафа за риск. Длина цикла — часть плана: кандидаты покрывают
+# циклы от минимально допустимого до CYCLE_TIME, а горизонт в секундах сравнивает их на одном отрезке времени.
+# План действует до следующего интервала, затем пересчитывается по новым оценкам.
+import time
+import zlib
+from typing import NamedTuple
+import numpy as np
+from config import MIN_PHASE_DURATION, MAX_PHASE_DURATION, CYCLE_TIME
+from config import MPC_HORIZON, MPC_CYCLE_STEP, MPC_CANDIDATES, MPC_RISK_WEIGHT, MPC_SEED, SATURATION_FLOW
+from phase_solver import solver_latency
+
+_GREEN = np.frombuffer(b"Gg", dtype=np.uint8)
+# Номер вызова по ключу: кандидаты воспроизводимы от прогона к прогону
+_calls = {}
+
+
+def call_counters():
+    """Номера вызовов по ключам (контрольные точки: продолжение генерирует те же кандидаты)"""
+    return dict(_calls)
+
+
+def restore_call_counters(calls):
+    _calls.clear()
+    _calls.update(calls)
+
+
+class LaneTraffic(NamedTuple):
+    """Оценки по контролируемым полосам одного светофора на момент оптимизации"""
+    queues: np.ndarray      # (L,) ТС в очереди (скорость < 0.1 м/с)
+    arrivals: np.ndarray    # (L,) интенсивность прибытия, ТС/с
+    link_lanes: np.ndarray  # (число связей,) индекс полосы связи (-1 — связь без полосы)
+
+
+def green_matrix(states, link_lanes, num_lanes):
+    """(P, L) bool: полоса обслуживается в фазе, если хотя бы одна её связь зелёная (G/g)"""
+    valid = link_lanes >= 0
+    green = np.zeros((len(states), num_lanes), dtype=bool)
+    for p, state in enumerate(states):
+        chars = np.frombuffer(state.encode(), dtype=np.uint8)[:len(link_lanes)]
+        is_green = np.isin(chars, _GREEN)
+        lanes = link_lanes[:len(chars)][valid[:len(chars)] & is_green]
+        green[p, lanes] = True
+    return green
+
+
+def phase_times(plans, horizon=MPC_HORIZON):
+    """(K, P) время каждой фазы плана за horizon секунд (циклы повторяются, последний обрезается)"""
+    plans = np.asarray(plans, dtype=np.float64)
+    cycle = plans.sum(axis=1, keepdims=True)
+    full = np.floor(horizon / cycle)
+    rest = horizon - full * cycle
+    start = np.cumsum(plans, axis=1) - plans
+    return full * plans + np.clip(rest - start, 0.0, plans)
+
+
+def predict_delay(plans, queues, arrivals, green, horizon=MPC_HORIZON, saturation_flow=SATURATION_FLOW):
+    """Суммарная задержка (ТС·с) для каждого плана (K, P) за horizon секунд.
+    Жидкостная модель точечной очереди: в фазе очередь растёт с arrivals и на зелёном
+    разгружается с saturation_flow; площадь под очередью считается точно (с учётом опустошения).
+    """
+    plans = np.asarray(plans, dtype=np.float64)
+    num_plans, num_phases = plans.shape
+    q = np.broadcast_to(np.asarray(queues, dtype=np.float64), (num_plans, len(queues))).copy()
+    delay = np.zeros(num_plans)
+    net_rates = arrivals[None, :] - saturation_flow * green  # (P, L)
+    elapsed = np.zeros((num_plans, 1))
+    cycles = int(np.ceil(horizon / max(float(plans.sum(axis=1).min()), 1e-9))) if num_plans else 0
+    for _ in range(cycles):
+        for p in range(num_phases):
+            # Фаза за пределами горизонта обрезается (у планов с коротким циклом горизонт вмещает больше циклов)
+            d = np.clip(horizon - elapsed, 0.0, plans[:, p:p + 1])
+            elapsed += d
+            net = net_rates[p]
+            # Время до опустошения очереди (для растущей очереди — вся фаза)
+            t_empty = np.where(net < 0, np.minimum(d, q / np.where(net < 0, -net, 1.0)), d)
+            delay += (q * t_empty + 0.5 * net * t_empty ** 2).sum(axis=1)
+            q = np.maximum(0.0, q + net * d)
+    return delay
+
+
+def cycle_lengths(base, free, lo=MIN_PHASE_DURATION, hi=MAX_PHASE_DURATION, longest=CYCLE_TIME, step=MPC_CYCLE_STEP):
+    """Допустимые длины цикла с шагом step: от наименьшей (фазы free по lo) до longest"""
+    base = np.asarray(base, dtype=np.float64)
+    fixed = float(base[~free].sum())
+    nf = int(free.sum())
+    shortest, top = fixed + nf * lo, min(float(longest), fixed + nf * hi)
+    if nf == 0 or shortest > top:
+        return np.empty(0)
+    return np.unique(np.append(np.arange(shortest, top, step), top))
+
+
+def candidate_plans(base, free, count, rng, lo=MIN_PHASE_DURATION, hi=MAX_PHASE_DURATION, total=CYCLE_TIME):
+    """Целые планы (K, P): фазы free равномерно распределяют остаток цикла в [lo, hi],
+    остальные фазы фиксированы как в base. total — длина цикла или массив длин (кандидаты делятся между ними
+    поровну). Первая строка — base, если его фазы в [lo, hi] (при одной длине цикла — и сумма равна ей)."""
+    base = np.asarray(base, dtype=np.float64)
+    totals = np.atleast_1d(np.asarray(total, dtype=np.float64))
+    nf = int(free.sum())
+    budgets = totals - base[~free].sum()
+    budgets = budgets[(nf * lo <= budgets) & (budgets <= nf * hi)]
+    if nf == 0 or not len(budgets):
+        return None
+    group = np.repeat(np.arange(len(budgets)), -(-2 * count // len(budgets)))
+    budget = budgets[group][:, None]
+    x = lo + (budget - nf * lo) * rng.dirichlet(np.ones(nf), size=len(budget))
+    # Округление до целых с сохранением суммы: остаток — фазам с наибольшей дробной частью
+    floor = np.floor(x)
+    remainder = np.rint(budget[:, 0] - floor.sum(axis=1)).astype(np.int64)
+    rank = np.argsort(np.argsort(floor - x, axis=1), axis=1)
+    split = floor + (rank < remainder[:, None])
+    valid = np.flatnonzero(np.all((split >= lo) & (split <= hi), axis=1))
+    # Поровну по длинам цикла: по очереди из каждой, а не первые count подряд
+    groups = group[valid]
+    rank = np.arange(len(valid)) - np.searchsorted(groups, groups)
+    split = split[valid[np.lexsort((groups, rank))]][:count]
+    plans = np.tile(base, (len(split), 1))
+    plans[:, free] = split
+    if np.all((base >= lo) & (base <= hi)) and (len(totals) > 1 or np.isclose(base.sum(), totals[0])):
+        plans = np.vstack([base[None, :], plans])
+    return plans
+
+
+def risk_cost(delay, risk, weight=None):
+    """Штраф за риск в ТС·с, соизмеримый с задержкой: рост ожидаемых near-miss на долю x относительно
+    среднего по кандидатам стоит как рост средней задержки на долю weight·x.
+    Одинаковый у всех кандидатов риск (нет разбивки по фазам) на выбор плана не влияет."""
+    weight = MPC_RISK_WEIGHT if weight is None else weight
+    risk = np.asarray(risk, dtype=np.float64)
+    mean_risk = float(risk.mean()) if len(risk) else 0.0
+    # Разброс на уровне ошибки округления (равномерный риск, сумма фаз = цикл) — не разброс
+    if mean_risk <= 0 or float(np.ptp(risk)) <= 1e-9 * mean_risk:
+        return np.zeros(len(risk))
+    return weight * float(np.mean(delay)) * (risk - risk.min()) / mean_risk
+
+
+def rank_phase_plans(current_logic, traffic, near_miss, interval_steps, key=None, phase_risk=None,
+                     candidates=MPC_CANDIDATES, horizon=MPC_HORIZON):
+    """Кандидатные планы (K, P), отсортированные по прогнозной стоимости (задержка + риск), и их стоимости.
+    Фазы без зелёного (жёлтые/переходные) сохраняют текущую длительность в пределах [lo, hi]; длина цикла
+    выбирается вместе с разбиением (cycle_lengths).
+    phase_risk — near-miss в секунду по фазам; без него риск равномерен и на выбор плана не влияет.
+    """
+    states = [phase.state for phase in current_logic.phases]
+    current = np.array([phase.duration for phase in current_logic.phases], dtype=np.float64)
+    green = green_matrix(states, traffic.link_lanes, len(traffic.queues))
+    free = green.any(axis=1)
+    base = np.where(free, current, np.clip(current, MIN_PHASE_DURATION, MAX_PHASE_DURATION))
+    call = _calls.get(key, 0)
+    _calls[key] = call + 1
+    rng = np.random.default_rng([MPC_SEED, zlib.crc32(str(key).encode()), call])
+    plans = candidate_plans(base, free, candidates, rng, total=cycle_lengths(base, free))
+    if plans is None or not len(plans):
+        return np.empty((0, len(states))), np.empty(0)
+    cost = predict_delay(plans, traffic.queues, traffic.arrivals, green, horizon)
+    if phase_risk is None:
+        phase_risk = np.full(len(states), near_miss / max(1, interval_steps))
+    cost += risk_cost(cost, phase_times(plans, horizon) @ np.asarray(phase_risk, dtype=np.float64))
+    # Стабильная сортировка: при равной стоимости первым остаётся текущий план
+    order = np.argsort(cost, kind="stable")
+    return plans[order], cost[order]
+
+
+def plan_phase_durations(current_logic, traffic, near_miss, interval_steps, key=None, phase_risk=None,
+                         candidates=MPC_CANDIDATES, horizon=MPC_HORIZON):
+    """Лучший по прогнозу план длительностей (list[int]) или None, если планов нет"""
+    t0 = time.perf_counter()
+    first = key not in _calls
+    plans, _ = rank_phase_plans(current_logic, traffic, near_miss, interval_steps, key, phase_risk, candidates, horizon)
+    best = [int(d) for d in plans[0]] if len(plans) else None
+    solver_latency.record("mpc", time.perf_counter() - t0, first=first)
+    return best
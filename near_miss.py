@@ -0,0 +1,112 @@
+# near_miss.py: Векторизованный поиск near-miss (TTC) по равномерной сетке
+import numpy as np
+from config import PROXIMITY_THRESHOLD
+
+# Порог TTC (сек), ниже которого пара считается near-miss
+TTC_THRESHOLD = 2.0
+
+# До стольких ТС все пары перебираются напрямую: сетка дороже при малом числе ТС
+SMALL_N = 32
+
+# Соседние ячейки сетки: половина окрестности 3x3, чтобы каждая пара ячеек встречалась один раз
+_HALF_NEIGHBOURS = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _cross_pairs(starts_a, counts_a, starts_b, counts_b):
+    """Все пары индексов (i, j) между элементами ячеек a и b (в отсортированном порядке)"""
+    sizes = counts_a * counts_b
+    total = int(sizes.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    # Смещение внутри блока пар каждой ячейки
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    local = np.arange(total, dtype=np.int64) - offsets
+    cb = np.repeat(counts_b, sizes)
+    i = np.repeat(starts_a, sizes) + local // cb
+    j = np.repeat(starts_b, sizes) + local % cb
+    return i, j
+
+
+def candidate_pairs(positions, cell_size=PROXIMITY_THRESHOLD):
+    """Пары-кандидаты (i, j), i != j, из соседних ячеек сетки со стороной cell_size.
+    Любая пара на расстоянии <= cell_size гарантированно попадает в результат.
+    """
+    n = len(positions)
+    empty = np.empty(0, dtype=np.int64)
+    if n < 2:
+        return empty, empty
+    if n <= SMALL_N:
+        i, j = np.triu_indices(n, 1)
+        return i.astype(np.int64), j.astype(np.int64)
+    cells = np.floor(positions / cell_size).astype(np.int64)
+    cx = cells[:, 0] - cells[:, 0].min()
+    cy = cells[:, 1] - cells[:, 1].min() + 1
+    # Ширина столбца с запасом в 2 ячейки, чтобы cy +- 1 не переходил в соседний столбец
+    width = int(cy.max()) + 2
+    keys = cx * width + cy
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    cell_keys, starts, counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+
+    parts_i, parts_j = [], []
+    # Пары внутри одной ячейки: берём только i < j
+    i, j = _cross_pairs(starts, counts, starts, counts)
+    mask = i < j
+    parts_i.append(i[mask])
+    parts_j.append(j[mask])
+    # Пары между соседними ячейками
+    for dx, dy in _HALF_NEIGHBOURS:
+        target = cell_keys + dx * width + dy
+        pos = np.searchsorted(cell_keys, target)
+        pos = np.minimum(pos, len(cell_keys) - 1)
+        found = cell_keys[pos] == target
+        if not found.any():
+            continue
+        i, j = _cross_pairs(starts[found], counts[found], starts[pos[found]], counts[pos[found]])
+        parts_i.append(i)
+        parts_j.append(j)
+    i = np.concatenate(parts_i)
+    j = np.concatenate(parts_j)
+    return order[i], order[j]
+
+
+def near_miss_pairs(positions, speeds, threshold=PROXIMITY_THRESHOLD, ttc_threshold=TTC_THRESHOLD):
+    """Пары с TTC < ttc_threshold среди ТС на расстоянии <= threshold.
+    Возвращает (i, j, ttc) — индексы ТС во входных массивах и значения TTC.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    speeds = np.asarray(speeds, dtype=np.float64).reshape(-1)
+    i, j = candidate_pairs(positions, threshold)
+    if len(i) == 0:
+        return i, j, np.empty(0, dtype=np.float64)
+    delta = positions[i] - positions[j]
+    dist = np.hypot(delta[:, 0], delta[:, 1])
+    rel_speed = np.abs(speeds[i] - speeds[j])
+    mask = (dist <= threshold) & (rel_speed > 0)
+    ttc = np.full(len(i), np.inf)
+    ttc[mask] = dist[mask] / rel_speed[mask]
+    hit = ttc < ttc_threshold
+    return i[hit], j[hit], ttc[hit]
+
+
+def compute_near_miss(positions, speeds, threshold=PROXIMITY_THRESHOLD, ttc_threshold=TTC_THRESHOLD):
+    """(near_miss_count, avg_risk) по массивам позиций (n, 2) и скоростей (n,)"""
+    _, _, ttc = near_miss_pairs(positions, speeds, threshold, ttc_threshold)
+    if len(ttc) == 0:
+        return 0, 0
+    return int(len(ttc)), float(ttc.mean())
+
+
+def attribute_near_miss(i, j, ttc, groups, n_groups):
+    """Распределение near-miss пар по группам (например, светофорам).
+    groups[k] — индекс группы ТС k или -1; пара относится к группе первого ТС, иначе второго.
+    Возвращает (counts, ttc_sums) длины n_groups.
+    """
+    if n_groups == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    pair_groups = np.where(groups[i] >= 0, groups[i], groups[j])
+    valid = pair_groups >= 0
+    counts = np.bincount(pair_groups[valid], minlength=n_groups)
+    ttc_sums = np.bincount(pair_groups[valid], weights=ttc[valid], minlength=n_groups)
+    return counts, ttc_sums
@@ -0,0 +1,207 @@
+# phase_solver.py: Решатели задачи выбора длительностей фаз (аналитический и cvxpy)
+# Задача: min c·d + 0.5·dᵀ·diag(q)·d + const, MIN_PHASE_DURATION <= d <= MAX_PHASE_DURATION, sum(d) == CYCLE_TIME.
+# Для линейной цели (q отсутствует) оптимум находится жадно за O(n log n), для остальных — через cvxpy.
+import time
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+import numpy as np
+from config import MIN_PHASE_DURATION, MAX_PHASE_DURATION, CYCLE_TIME, PHASE_SOLVER, SOLVER_LATENCY_WINDOW
+
+# Ключи задач, которые уже решались (первое решение cvxpy включает компиляцию)
+_seen = set()
+
+
+class LatencyStats:
+    """Латентность оптимизатора за прогон: счётчики и суммы по всем вызовам, p95 — по последним window вызовам.
+    Память не растёт с длиной прогона; record можно вызывать из фонового потока (ASYNC_OPTIMIZE)."""
+
+    def __init__(self, window=SOLVER_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self.reset()
+
+    def reset(self):
+        """Начало прогона: сводка считается заново"""
+        with self._lock:
+            self.calls = 0
+            self.backends = set()
+            self.wall_sum = 0.0
+            self.resolve_calls = 0
+            self.resolve_wall_sum = 0.0
+            self.solver_calls = 0
+            self.solver_sum = 0.0
+            self.recent_wall = deque(maxlen=self._window)
+
+    def record(self, backend, wall, solver=None, first=False):
+        """Вызов оптимизатора: бэкенд, wall-time и время самого решателя (сек)"""
+        with self._lock:
+            self.calls += 1
+            self.backends.add(backend)
+            self.wall_sum += wall
+            self.recent_wall.append(wall)
+            if not first:
+                self.resolve_calls += 1
+                self.resolve_wall_sum += wall
+            if solver is not None:
+                self.solver_calls += 1
+                self.solver_sum += solver
+
+    def summary(self):
+        """Сводка (мс): первые решения включают компиляцию, повторные — нет"""
+        with self._lock:
+            if not self.calls:
+                return None
+            summary = {
+                "calls": self.calls,
+                "backends": sorted(self.backends),
+                "wall_ms_mean": round(self.wall_sum / self.calls * 1000, 3),
+                "wall_ms_p95": round(float(np.percentile(np.array(self.recent_wall), 95)) * 1000, 3),
+            }
+            if self.resolve_calls:
+                summary["resolve_wall_ms_mean"] = round(self.resolve_wall_sum / self.resolve_calls * 1000, 3)
+            if self.solver_calls:
+                summary["solver_ms_mean"] = round(self.solver_sum / self.solver_calls * 1000, 3)
+            return summary
+
+
+# Латентность оптимизатора текущего прогона (main сбрасывает её в начале прогона)
+solver_latency = LatencyStats()
+
+
+class PhaseObjective(NamedTuple):
+    """Цель оптимизации длительностей фаз"""
+    linear: np.ndarray                     # c — коэффициенты при длительностях
+    constant: float = 0.0
+    quadratic: Optional[np.ndarray] = None  # диагональ q >= 0; если задана — нужна cvxpy
+
+
+def round_durations(values, lo=MIN_PHASE_DURATION, hi=MAX_PHASE_DURATION, total=CYCLE_TIME):
+    """Округление до целых с коррекцией суммы до total в пределах [lo, hi]"""
+    new_durations = [int(round(d)) for d in values]
+    num_phases = len(new_durations)
+    diff = total - sum(new_durations)
+    # Простая коррекция: распределяем разницу по фазам, не выходя за MIN/MAX
+    i = 0
+    while diff != 0 and i < num_phases:
+        if diff > 0:
+            add = min(diff, hi - new_durations[i])
+            new_durations[i] += add
+            diff -= add
+        else:
+            sub = min(-diff, new_durations[i] - lo)
+            new_durations[i] -= sub
+            diff += sub
+        i = (i + 1) % num_phases
+    return new_durations
+
+
+def is_feasible(num_phases, lo=MIN_PHASE_DURATION, hi=MAX_PHASE_DURATION, total=CYCLE_TIME):
+    return num_phases > 0 and num_phases * lo <= total <= num_phases * hi
+
+
+class AnalyticSolver:
+    """Точное решение линейной задачи: все фазы на минимуме, остаток цикла отдаём
+    фазам с наименьшим коэффициентом до максимума. При целых границах решение целое."""
+    name = "analytic"
+
+    def supports(self, objective):
+        return objective.quadratic is None
+
+    def solve(self, objective, key=None, lo=MIN_PHASE_DURATION, hi=MAX_PHASE_DURATION, total=CYCLE_TIME):
+        c = np.asarray(objective.linear, dtype=np.float64)
+        num_phases = len(c)
+        if not is_feasible(num_phases, lo, hi, total):
+            return None
+        durations = np.full(num_phases, lo, dtype=np.float64)
+        remaining = total - num_phases * lo
+        # Стабильная сортировка: при равных коэффициентах приоритет у фаз с меньшим индексом
+        for k in np.argsort(c, kind="stable"):
+            if remaining <= 0:
+                break
+            add = min(hi - lo, remaining)
+            durations[k] += add
+            remaining -= add
+        return durations
+
+
+class CvxpySolver:
+    """Решение через cvxpy: задача компилируется один раз на (key, num_phases) и решается с warm start"""
+    name = "cvxpy"
+
+    def __init__(self):
+        # Кэш скомпилированных задач: (key, num_phases, quadratic) -> задача cvxpy с параметрами
+        self._cache = {}
+        self.last_stats = None
+
+    def supports(self, objective):
+        return True
+
+    def _build(self, num_phases, quadratic, lo, hi, total):
+        """Параметризованная (DPP) задача выбора длительностей фаз"""
+        import cvxpy as cp
+        durations = cp.Variable(num_phases, nonneg=True)
+        linear = cp.Parameter(num_phases)
+        constant = cp.Parameter()
+        constraints = [durations >= lo, durations <= hi, cp.sum(durations) == total]
+        # Избегаем депрекейтнутого умножения матриц: используем elementwise multiply
+        expr = cp.sum(cp.multiply(linear, durations)) + constant
+        params = {"linear": linear, "constant": constant}
+        if quadratic:
+            q = cp.Parameter(num_phases, nonneg=True)
+            expr = expr + 0.5 * cp.sum(cp.multiply(q, cp.square(durations)))
+            params["quadratic"] = q
+        return {"problem": cp.Problem(cp.Minimize(expr), constraints), "durations": durations, "params": params}
+
+    def solve(self, objective, key=None, lo=MIN_PHASE_DURATION, hi=MAX_PHASE_DURATION, total=CYCLE_TIME):
+        import cvxpy as cp
+        num_phases = len(objective.linear)
+        quadratic = objective.quadratic is not None
+        cache_key = (key, num_phases, quadratic, lo, hi, total)
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            cached = self._build(num_phases, quadratic, lo, hi, total)
+            self._cache[cache_key] = cached
+        params = cached["params"]
+        params["linear"].value = np.asarray(objective.linear, dtype=np.float64)
+        params["constant"].value = float(objective.constant)
+        if quadratic:
+            params["quadratic"].value = np.asarray(objective.quadratic, dtype=np.float64)
+        problem = cached["problem"]
+        problem.solve(warm_start=True)
+        self.last_stats = problem.solver_stats
+        if problem.status != cp.OPTIMAL:
+            return None
+        return np.asarray(cached["durations"].value, dtype=np.float64)
+
+
+SOLVERS = {"analytic": AnalyticSolver(), "cvxpy": CvxpySolver()}
+
+
+def select_solver(objective, preferred=PHASE_SOLVER):
+    """Выбор бэкенда: явно заданный (если поддерживает цель) или по структуре цели"""
+    if preferred in SOLVERS and SOLVERS[preferred].supports(objective):
+        return SOLVERS[preferred]
+    if SOLVERS["analytic"].supports(objective):
+        return SOLVERS["analytic"]
+    return SOLVERS["cvxpy"]
+
+
+def solve_phase_durations(objective, key=None, preferred=PHASE_SOLVER):
+    """Целые длительности фаз для цели или None, если задача не решена"""
+    solver = select_solver(objective, preferred)
+    first_solve = (solver.name, key, len(objective.linear)) not in _seen
+    _seen.add((solver.name, key, len(objective.linear)))
+    t0 = time.perf_counter()
+    values = solver.solve(objective, key)
+    wall = time.perf_counter() - t0
+    stats = solver.last_stats if solver.name == "cvxpy" else None
+    solver_latency.record(solver.name, wall, stats.solve_time if stats is not None else None, first_solve)
+    if values is None:
+        return None
+    return round_durations(values)
+
+
+def solver_latency_summary():
+    """Сводка латентности оптимизатора за текущий прогон (мс) или None, если вызовов не было"""
+    return solver_latency.summary()
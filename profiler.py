@@ -0,0 +1,70 @@
+# profiler.py: Профилирование стадий шага симуляции (включается флагом --profile)
+import json
+import time
+from array import array
+import numpy as np
+
+
+class StageProfiler:
+    """Латентности стадий шага в наносекундах (time.perf_counter_ns) в компактных массивах.
+    Использование: t = prof.now(); ...; t = prof.lap("stage", t); ...
+    """
+    enabled = True
+
+    def __init__(self):
+        self.samples = {}  # stage -> array('q') латентностей, нс
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def lap(self, stage, t0):
+        """Записать время с t0 для стадии и вернуть текущий момент (начало следующей стадии)"""
+        t1 = time.perf_counter_ns()
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples[stage] = array("q")
+        samples.append(t1 - t0)
+        return t1
+
+    def report(self):
+        """{stage: count, total/mean/p50/p95/p99 (мс), share} — доля от суммарного времени всех стадий"""
+        totals = {stage: sum(samples) for stage, samples in self.samples.items()}
+        grand_total = sum(totals.values()) or 1
+        stages = {}
+        for stage, samples in self.samples.items():
+            values = np.frombuffer(samples, dtype=np.int64) / 1e6
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {
+                "count": len(values),
+                "total_ms": round(totals[stage] / 1e6, 3),
+                "mean_ms": round(float(values.mean()), 4),
+                "p50_ms": round(float(p50), 4),
+                "p95_ms": round(float(p95), 4),
+                "p99_ms": round(float(p99), 4),
+                "share": round(totals[stage] / grand_total, 4),
+            }
+        return stages
+
+    def print_report(self):
+        stages = self.report()
+        print("Profile (per-stage latency, ms):")
+        print(f"  {'stage':18} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'total':>11} {'share':>7}")
+        for stage, st in sorted(stages.items(), key=lambda kv: -kv[1]["total_ms"]):
+            print(f"  {stage:18} {st['count']:>7} {st['p50_ms']:>9.3f} {st['p95_ms']:>9.3f} {st['p99_ms']:>9.3f} "
+                  f"{st['total_ms']:>11.1f} {st['share'] * 100:>6.1f}%")
+
+    def export_json(self, path, meta=None):
+        """Машиночитаемый отчёт для отслеживания регрессий между версиями"""
+        with open(path, "w") as f:
+            json.dump({"meta": meta or {}, "stages": self.report()}, f, indent=2)
+
+
+class NullProfiler:
+    """Заглушка без накладных расходов, когда профилирование выключено"""
+    enabled = False
+
+    def now(self):
+        return 0
+
+    def lap(self, stage, t0):
+        return 0
@@ -0,0 +1,255 @@
+# recorder.py: Колоночный буфер метрик (по шагам и по переключениям фаз) на NumPy
+# Столбцы предвыделены блоками по chunk_size строк; заполненный блок сбрасывается на диск
+# (Arrow IPC, если установлен pyarrow, иначе .npz на блок), так что память не растёт с длиной прогона.
+# Выходные файлы прогона ротируются частями (контрольные точки, checkpoint.py): часть 0 — сам файл,
+# следующие — name.00001.ext, name.00002.ext, ...; читатели проходят все части по порядку (part_paths).
+import os
+import csv
+import glob
+import numpy as np
+from config import RECORDER_CHUNK_SIZE, RECORDER_FORMAT
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def part_path(path, part):
+    """Путь части part файла path: часть 0 — сам path, далее name.00001.ext"""
+    if part == 0:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{part:05d}{ext}"
+
+
+def part_paths(path):
+    """Существующие части файла path по порядку"""
+    stem, ext = os.path.splitext(path)
+    parts = sorted(glob.glob(f"{glob.escape(stem)}.[0-9][0-9][0-9][0-9][0-9]{ext}"))
+    return ([path] if os.path.exists(path) else []) + parts
+
+
+def remove_parts(path, first=0):
+    """Удалить части файла path с номера first (хвост после контрольной точки или прошлый прогон)"""
+    for part in part_paths(path):
+        stem = os.path.splitext(part)[0]
+        index = int(stem.rsplit(".", 1)[1]) if part != path else 0
+        if index >= first:
+            os.remove(part)
+
+
+class RotatingCsvWriter:
+    """csv.writer с ротацией частей; в каждой части — заголовок"""
+
+    def __init__(self, path, header, resume=None):
+        self.path = path
+        self.header = header
+        self.part = resume["part"] if resume else 0
+        self.rows = resume["rows"] if resume else 0
+        remove_parts(path, self.part)
+        self._open()
+
+    def _open(self):
+        self.file = open(part_path(self.path, self.part), "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.header)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def rotate(self):
+        """Закрыть текущую часть и начать следующую; возвращает состояние для продолжения"""
+        self.file.close()
+        self.part += 1
+        self._open()
+        return {"part": self.part, "rows": self.rows}
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def resolve_format(fmt=RECORDER_FORMAT):
+    """auto -> arrow при наличии pyarrow, иначе npz"""
+    if fmt == "auto":
+        return "arrow" if _arrow() is not None else "npz"
+    if fmt == "arrow" and _arrow() is None:
+        print("pyarrow не установлен, метрики сохраняются в .npz")
+        return "npz"
+    return fmt
+
+
+class ColumnarRecorder:
+    """Таблица фиксированных столбцов: [(имя, dtype) или (имя, dtype, форма ячейки)].
+    append(*values) — строка в порядке столбцов; column(имя) — весь столбец (диск + текущий блок).
+    resume — состояние из rotate() (контрольная точка): записанное до неё сохраняется, хвост удаляется.
+    """
+
+    def __init__(self, name, columns, directory=".", chunk_size=RECORDER_CHUNK_SIZE, fmt=RECORDER_FORMAT, resume=None):
+        self.name = name
+        self.directory = directory
+        self.chunk_size = max(1, int(chunk_size))
+        self.format = resolve_format(fmt)
+        self.specs = [(spec[0], np.dtype(spec[1]), tuple(spec[2]) if len(spec) > 2 else ()) for spec in columns]
+        self.names = [spec[0] for spec in self.specs]
+        self.buffers = [np.zeros((self.chunk_size,) + shape, dtype=dtype) for _, dtype, shape in self.specs]
+        self.size = 0  # строк в текущем блоке
+        self.rows = resume["rows"] if resume else 0  # всего строк
+        self.chunks = resume["chunks"] if resume else 0  # сброшенных блоков
+        self.part = resume["part"] if resume else 0  # часть файла Arrow
+        self._arrow_writer = None
+        # Файлы прошлого прогона (или записанные после контрольной точки) в любом формате,
+        # чтобы load_table не смешал их с новыми
+        arrow_path = os.path.join(directory, f"{name}.arrow")
+        remove_parts(arrow_path, self.part if resume and self.format == "arrow" else 0)
+        for path in glob.glob(os.path.join(directory, f"{name}.*.npz")):
+            if not (resume and self.format == "npz" and int(path.rsplit(".", 2)[1]) < self.chunks):
+                os.remove(path)
+
+    @property
+    def path(self):
+        if self.format == "arrow":
+            return part_path(os.path.join(self.directory, f"{self.name}.arrow"), self.part)
+        return os.path.join(self.directory, f"{self.name}.*.npz")
+
+    def _chunk_paths(self):
+        if self.format == "arrow":
+            return part_paths(os.path.join(self.directory, f"{self.name}.arrow"))
+        return sorted(glob.glob(self.path))
+
+    def append(self, *values):
+        k = self.size
+        for buf, value in zip(self.buffers, values):
+            buf[k] = value
+        self.size = k + 1
+        self.rows += 1
+        if self.size == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Сброс заполненной части текущего блока на диск"""
+        if not self.size:
+            return
+        n = self.size
+        if self.format == "arrow":
+            self._write_arrow(n)
+        else:
+            path = os.path.join(self.directory, f"{self.name}.{self.chunks:05d}.npz")
+            np.savez(path, **{name: buf[:n] for name, buf in zip(self.names, self.buffers)})
+        self.chunks += 1
+        self.size = 0
+
+    def _write_arrow(self, n):
+        pa = _arrow()
+        arrays = []
+        for (_, _, shape), buf in zip(self.specs, self.buffers):
+            values = buf[:n]
+            if shape:
+                width = int(np.prod(shape))
+                arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), width))
+            else:
+                arrays.append(pa.array(values))
+        batch = pa.RecordBatch.from_arrays(arrays, names=self.names)
+        if self._arrow_writer is None:
+            self._arrow_sink = pa.OSFile(self.path, "wb")
+            self._arrow_writer = pa.ipc.new_stream(self._arrow_sink, batch.schema)
+        self._arrow_writer.write_batch(batch)
+        self._arrow_sink.flush()
+
+    def _read_chunks(self, name):
+        """Сброшенные блоки столбца name"""
+        j = self.names.index(name)
+        _, dtype, shape = self.specs[j]
+        if self.format == "arrow":
+            if not self.chunks:
+                return []
+            pa = _arrow()
+            chunks = []
+            for path in self._chunk_paths():
+                with pa.OSFile(path, "rb") as source:
+                    table = pa.ipc.open_stream(source).read_all()
+                values = table.column(name).combine_chunks()
+                if shape:
+                    values = values.flatten()
+                chunks.append(values.to_numpy(zero_copy_only=False).astype(dtype, copy=False).reshape((-1,) + shape))
+            return chunks
+        chunks = []
+        for path in self._chunk_paths():
+            with np.load(path) as data:
+                chunks.append(data[name])
+        return chunks
+
+    def column(self, name):
+        j = self.names.index(name)
+        return np.concatenate(self._read_chunks(name) + [self.buffers[j][:self.size]])
+
+    def columns(self):
+        return {name: self.column(name) for name in self.names}
+
+    def rotate(self):
+        """Сброс блока и закрытие текущей части Arrow; возвращает состояние для продолжения (resume)"""
+        self.flush()
+        if self._arrow_writer is not None:
+            self.close()
+            self.part += 1
+        return {"rows": self.rows, "chunks": self.chunks, "part": self.part}
+
+    def close(self):
+        self.flush()
+        if self._arrow_writer is not None:
+            self._arrow_writer.close()
+            self._arrow_sink.close()
+            self._arrow_writer = None
+            self._arrow_sink = None
+
+    def export_csv(self, path, header=None, formatters=None):
+        """Экспорт в CSV (опционально, после прогона). formatters: {столбец: функция значения}"""
+        data = self.columns()
+        formatters = formatters or {}
+        cols = []
+        for name in self.names:
+            fmt = formatters.get(name)
+            values = data[name].tolist()
+            cols.append([fmt(v) for v in values] if fmt else values)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header or self.names)
+            writer.writerows(zip(*cols))
+
+
+def load_table(directory, name):
+    """Столбцы таблицы, записанной ColumnarRecorder (любой формат): {столбец: np.ndarray} или None"""
+    arrow_paths = part_paths(os.path.join(directory, f"{name}.arrow"))
+    if arrow_paths:
+        pa = _arrow()
+        if pa is None:
+            raise ImportError(f"Для чтения {arrow_paths[0]} нужен pyarrow")
+        tables = []
+        for arrow_path in arrow_paths:
+            with pa.OSFile(arrow_path, "rb") as source:
+                tables.append(pa.ipc.open_stream(source).read_all())
+        table = pa.concat_tables(tables)
+        columns = {}
+        for column_name in table.column_names:
+            values = table.column(column_name).combine_chunks()
+            if pa.types.is_fixed_size_list(values.type):
+                width = values.type.list_size
+                columns[column_name] = values.flatten().to_numpy(zero_copy_only=False).reshape(-1, width)
+            else:
+                columns[column_name] = values.to_numpy(zero_copy_only=False)
+        return columns
+    paths = sorted(glob.glob(os.path.join(directory, f"{name}.*.npz")))
+    if not paths:
+        return None
+    parts = []
+    for path in paths:
+        with np.load(path) as data:
+            parts.append({key: data[key] for key in data.files})
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
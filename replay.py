@@ -0,0 +1,42 @@
+# replay.py: Воспроизведение записанного расписания планов (tls_changes.csv) без оптимизатора
+# Каждая строка tls_changes.csv — план, установленный на шаге step основного цикла; в режиме --mode replay
+# те же длительности устанавливаются на тех же шагах (программы opt_N в том же порядке), так что при том же
+# seed и спросе прогон повторяет исходный, а при других — измеряет ту же политику управления.
+import os
+import csv
+from recorder import part_paths
+
+
+def _durations(value):
+    """'8.0;6.0;36.0' -> [8, 6, 36] (целые — как их записал оптимизатор)"""
+    values = [float(d) for d in value.split(";") if d]
+    return [int(d) if d.is_integer() else d for d in values]
+
+
+class ReplaySchedule:
+    """Планы по шагам: {step: [(tls_id, длительности)]} из tls_changes.csv (все части) или каталога прогона"""
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, "tls_changes.csv")
+        paths = part_paths(path)
+        if not paths:
+            raise FileNotFoundError(f"Расписание планов не найдено: {path}")
+        self.path = path
+        self.by_step = {}
+        self.plans = 0
+        for part in paths:
+            with open(part, newline="") as f:
+                for row in csv.DictReader(f):
+                    # Применённые длительности (из активной логики), иначе запрошенные
+                    durations = _durations(row.get("applied_durations") or "") or _durations(row["requested_durations"])
+                    self.by_step.setdefault(int(row["step"]), []).append((row["tls_id"], durations))
+                    self.plans += 1
+
+    @property
+    def tls_ids(self):
+        return list(dict.fromkeys(tls_id for plans in self.by_step.values() for tls_id, _ in plans))
+
+    def plans_at(self, step):
+        """[(tls_id, длительности)], записанные на шаге step"""
+        return self.by_step.get(step, ())
@@ -0,0 +1,137 @@
+# risk_sampling.py: Выборочный поиск near-miss и тренд риска ограниченного размера для длинных прогонов
+# RiskSampler решает, на каком шаге искать near-miss: каждые every шагов, а в адаптивном режиме раньше,
+# если число ТС заметно изменилось с последнего поиска. На пропущенных шагах повторяются значения последнего
+# поиска (ступенчатое удержание), поэтому суммы near-miss и интервальный риск остаются оценками по всем шагам.
+# RiskTrend хранит тренд риска для графика корзинами min/max/среднее: память не зависит от длины прогона.
+import numpy as np
+
+
+class RiskSampler:
+    """Политика шагов поиска near-miss и значения последнего поиска"""
+
+    def __init__(self, every=1, adaptive=False, density_change=0.2):
+        self.every = max(1, int(every))
+        self.adaptive = adaptive
+        self.density_change = density_change
+        self.last_step = None
+        self.last_vehicles = 0
+        self.held = None  # (near_miss, risk, tls_counts, tls_ttc_sums)
+        self.held_phase = None  # (phase_counts, link_counts) — зоны перекрёстков
+        self.sampled = 0
+        self.skipped = 0
+
+    @property
+    def enabled(self):
+        return self.every > 1
+
+    def due(self, step, vehicles):
+        """Искать near-miss на этом шаге (иначе — значения последнего поиска)"""
+        if self.held is None or self.last_step is None or step - self.last_step >= self.every:
+            return True
+        if self.adaptive:
+            return abs(vehicles - self.last_vehicles) > max(1.0, self.density_change * self.last_vehicles)
+        return False
+
+    def hold(self, step, vehicles, result, phase=None):
+        """Результат поиска на шаге step: удерживается до следующего поиска"""
+        self.last_step = step
+        self.last_vehicles = vehicles
+        self.held = result
+        self.held_phase = phase
+        self.sampled += 1
+
+    def repeat(self):
+        """Шаг без поиска: значения последнего поиска"""
+        self.skipped += 1
+        return self.held
+
+    def summary(self):
+        total = self.sampled + self.skipped
+        return {"every": self.every, "adaptive": self.adaptive, "sampled_steps": self.sampled,
+                "skipped_steps": self.skipped, "sampled_share": round(self.sampled / total, 4) if total else None}
+
+    def checkpoint_state(self):
+        return dict(vars(self))
+
+    def restore(self, state):
+        # Политика — из аргументов текущего запуска, состояние — из контрольной точки
+        for name in ("last_step", "last_vehicles", "held", "held_phase", "sampled", "skipped"):
+            setattr(self, name, state[name])
+
+
+class RiskTrend:
+    """Прореженный тренд риска: корзины по width шагов с min/max/суммой; при переполнении max_points
+    соседние корзины сливаются и width удваивается. При width = 1 ряд совпадает с исходным."""
+
+    FIELDS = ("bucket", "low", "high", "total", "step_total", "count")
+
+    def __init__(self, max_points=2000):
+        self.max_points = max(2, int(max_points))
+        self.width = 1
+        self.size = 0
+        self.bucket = np.empty(self.max_points, dtype=np.int64)
+        self.low = np.empty(self.max_points, dtype=np.float64)
+        self.high = np.empty(self.max_points, dtype=np.float64)
+        self.total = np.empty(self.max_points, dtype=np.float64)
+        self.step_total = np.empty(self.max_points, dtype=np.float64)
+        self.count = np.empty(self.max_points, dtype=np.int64)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, step, value):
+        key = step // self.width
+        while self.size and self.bucket[self.size - 1] != key and self.size == self.max_points:
+            self._merge()
+            key = step // self.width
+        k = self.size - 1
+        if self.size and self.bucket[k] == key:
+            self.low[k] = min(self.low[k], value)
+            self.high[k] = max(self.high[k], value)
+            self.total[k] += value
+            self.step_total[k] += step
+            self.count[k] += 1
+            return
+        k = self.size
+        self.bucket[k] = key
+        self.low[k] = self.high[k] = self.total[k] = value
+        self.step_total[k] = step
+        self.count[k] = 1
+        self.size += 1
+
+    def _merge(self):
+        """Удвоение ширины корзин: корзины с одинаковым bucket // 2 сливаются"""
+        self.width *= 2
+        n = self.size
+        keys = self.bucket[:n] // 2
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        m = len(starts)
+        self.bucket[:m] = keys[starts]
+        self.low[:m] = np.minimum.reduceat(self.low[:n], starts)
+        self.high[:m] = np.maximum.reduceat(self.high[:n], starts)
+        for name in ("total", "step_total", "count"):
+            values = getattr(self, name)
+            values[:m] = np.add.reduceat(values[:n], starts)
+        self.size = m
+
+    def series(self):
+        """(шаг — средний шаг корзины, среднее, минимум, максимум)"""
+        n = self.size
+        count = self.count[:n]
+        return self.step_total[:n] / count, self.total[:n] / count, self.low[:n].copy(), self.high[:n].copy()
+
+    def checkpoint_state(self):
+        return {"width": self.width, **{name: getattr(self, name)[:self.size].copy() for name in self.FIELDS}}
+
+    def restore(self, state):
+        n = len(state["bucket"])
+        if n > self.max_points:
+            # Точка записана с большим max_points: корзины сливаются до нового размера
+            for name in self.FIELDS:
+                setattr(self, name, np.empty(n, dtype=getattr(self, name).dtype))
+        self.width = state["width"]
+        self.size = n
+        for name in self.FIELDS:
+            getattr(self, name)[:n] = state[name]
+        while self.size > self.max_points:
+            self._merge()
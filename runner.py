@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# runner.py: параллельный запуск сценариев (режим × seed × масштаб спроса) в пуле процессов
+#   python3 runner.py --modes baseline opt --seeds 1 2 3 --scales 1 2 --workers 8 --backend libsumo
+# Каждый сценарий пишет все выходные файлы в свой каталог out/runs/<mode>_seed<S>_x<K>/,
+# затем KPI всех прогонов собираются через analyze_kpi в out/runs/results.json.
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import contextlib
+import multiprocessing as mp
+from typing import Dict, List
+
+from config import BACKEND
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def scenario_name(mode: str, seed: int, scale: float) -> str:
+    return f"{mode}_seed{seed}_x{scale:g}"
+
+
+def build_scenarios(modes, seeds, scales, out_dir, backend, steps=None, base_port=None) -> List[Dict]:
+    """Список сценариев; каждому — свой каталог. Порт TraCI (только backend traci, libsumo его игнорирует):
+    без base_port каждый процесс пула берёт свободный порт при запуске SUMO, иначе — base_port + i"""
+    scenarios = []
+    for k, (mode, seed, scale) in enumerate(itertools.product(modes, seeds, scales)):
+        name = scenario_name(mode, seed, scale)
+        scenarios.append({
+            "name": name,
+            "mode": mode,
+            "seed": seed,
+            "scale": scale,
+            "backend": backend,
+            "steps": steps,
+            "port": None if base_port is None else base_port + k,
+            "output_dir": os.path.join(os.path.abspath(out_dir), name),
+        })
+    return scenarios
+
+
+def scenario_argv(spec: Dict) -> List[str]:
+    argv = [
+        "--mode", spec["mode"],
+        "--seed", str(spec["seed"]),
+        "--scale", str(spec["scale"]),
+        "--backend", spec["backend"],
+        "--output-dir", spec["output_dir"],
+        "--non-interactive",
+        "--no-gui",
+    ]
+    if spec.get("port") is not None:
+        argv += ["--port", str(spec["port"])]
+    if spec.get("steps"):
+        argv += ["--steps", str(spec["steps"])]
+    return argv
+
+
+def run_scenario(spec: Dict) -> Dict:
+    """Выполняется в отдельном процессе пула: прогон main.run_simulation с логом в run.log"""
+    os.makedirs(spec["output_dir"], exist_ok=True)
+    # osm.sumocfg и сеть задаются относительными путями
+    os.chdir(ROOT_DIR)
+    result = dict(spec)
+    t0 = time.perf_counter()
+    log_path = os.path.join(spec["output_dir"], "run.log")
+    with open(log_path, "w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            import main
+            main.run_simulation(scenario_argv(spec))
+            result["status"] = "ok"
+        except SystemExit as e:
+            result["status"] = "failed"
+            result["error"] = str(e.code)
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = repr(e)
+    result["elapsed_sec"] = round(time.perf_counter() - t0, 2)
+    with open(os.path.join(spec["output_dir"], "scenario.json"), "w") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def collect_results(results: List[Dict], out_dir: str) -> str:
+    """KPI каждого успешного прогона через analyze_kpi.load_runs (разбор в пуле процессов) -> results.json"""
+    from analyze_kpi import load_runs, scalar_kpi
+    done = [result for result in results if result.get("status") == "ok"]
+    for result, kpi in zip(done, load_runs([result["output_dir"] for result in done])):
+        result["kpi"] = scalar_kpi(kpi)
+    path = os.path.join(out_dir, "results.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Parallel scenario runner for main.py")
+    parser.add_argument("--modes", nargs="+", default=["baseline", "opt"], choices=["baseline", "opt"])
+    parser.add_argument("--seeds", nargs="+", type=int, default=[42])
+    parser.add_argument("--scales", nargs="+", type=float, default=[1.0], help="Масштабы спроса SUMO (--scale)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default=os.path.join("out", "runs"), help="Корневой каталог результатов")
+    parser.add_argument("--backend", default=BACKEND, choices=["traci", "libsumo"])
+    parser.add_argument("--steps", type=int, help="Число шагов симуляции (по умолчанию SIM_STEPS)")
+    parser.add_argument("--base-port", type=int, help="Первый порт TraCI (backend traci): сценарии получают base-port + i, "
+                        "занятый заменяется свободным. По умолчанию каждый процесс берёт свободный порт; libsumo порт игнорирует")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    scenarios = build_scenarios(args.modes, args.seeds, args.scales, args.out, args.backend, args.steps, args.base_port)
+    workers = max(1, min(args.workers, len(scenarios)))
+    print(f"Сценариев: {len(scenarios)}, процессов: {workers}, backend: {args.backend}")
+
+    results = []
+    t0 = time.perf_counter()
+    # spawn + maxtasksperchild=1: каждый сценарий в чистом процессе (libsumo — один экземпляр на процесс)
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes=workers, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_scenario, scenarios):
+            results.append(result)
+            print(f"  [{len(results)}/{len(scenarios)}] {result['name']}: {result['status']} ({result['elapsed_sec']}s)")
+    results.sort(key=lambda r: r["name"])
+    print(f"Все сценарии завершены за {time.perf_counter() - t0:.1f}s")
+
+    path = collect_results(results, args.out)
+    print(f"KPI прогонов сохранены: {path}")
+    failed = [r["name"] for r in results if r["status"] != "ok"]
+    if failed:
+        print(f"Ошибки в сценариях: {', '.join(failed)} (см. run.log в каталогах)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# segments.py: Сегменты выходных файлов SUMO прогона, продолженного с контрольной точки (--resume)
+# Продолженный SUMO пишет tripinfos.xml, summary.xml, edgeData.xml, laneData.xml в resume_NNNNNNN/ начиная
+# с момента точки, а в каталоге прогона (и в более ранних resume_*) остаётся записанное до сбоя, в том числе
+# после точки. Сегмент действует на времени [begin, end) до начала следующего: анализ берёт из каждого файла
+# только своё окно, так что KPI продолженного прогона совпадают с непрерывным.
+import os
+import json
+from typing import List, NamedTuple, Optional, Tuple
+
+RESUME_PREFIX = "resume_"
+SEGMENT_FILE = "segment.json"
+
+
+class Segment(NamedTuple):
+    """Каталог выходных файлов SUMO и окно времени SUMO [begin, end) (None — без границы)"""
+    directory: str
+    begin: Optional[float] = None
+    end: Optional[float] = None
+
+    def contains(self, time: float) -> bool:
+        return (self.begin is None or time >= self.begin) and (self.end is None or time < self.end)
+
+
+def segment_dir(output_dir, step):
+    return os.path.join(output_dir, f"{RESUME_PREFIX}{step:07d}")
+
+
+def segment_files(run_path, name) -> List[Tuple[str, Segment]]:
+    """Выходной файл SUMO name (или name.gz) в каждом сегменте прогона: [(путь, сегмент)]"""
+    files = []
+    for segment in run_segments(run_path):
+        path = os.path.join(segment.directory, name)
+        if not os.path.exists(path) and os.path.exists(path + ".gz"):
+            path += ".gz"
+        files.append((path, segment))
+    return files
+
+
+def write_segment(directory, step, time):
+    """Начало сегмента продолженного прогона: шаг и время SUMO контрольной точки"""
+    with open(os.path.join(directory, SEGMENT_FILE), "w") as f:
+        json.dump({"step": step, "time": time}, f)
+
+
+def run_segments(run_path) -> List[Segment]:
+    """Сегменты прогона по времени: каталог прогона, затем resume_* (без продолжений — один сегмент без окна)"""
+    starts = []
+    try:
+        names = os.listdir(run_path)
+    except OSError:
+        names = []
+    for name in names:
+        directory = os.path.join(run_path, name)
+        if not name.startswith(RESUME_PREFIX) or not os.path.isdir(directory):
+            continue
+        try:
+            with open(os.path.join(directory, SEGMENT_FILE)) as f:
+                time = float(json.load(f)["time"])
+        except (OSError, ValueError, KeyError):
+            # Без segment.json — время по номеру шага (шаг симуляции 1 с, начало в 0)
+            try:
+                time = float(int(name[len(RESUME_PREFIX):]))
+            except ValueError:
+                continue
+        starts.append((time, directory))
+    starts.sort()
+    begins = [None] + [time for time, _ in starts]
+    ends = [time for time, _ in starts] + [None]
+    directories = [run_path] + [directory for _, directory in starts]
+    return [Segment(directory, begin, end) for directory, begin, end in zip(directories, begins, ends)]
@@ -0,0 +1,50 @@
+# test_async_optimizer.py: политика skip отбрасывает решение, пропустившее срок, даже если оно уже запущено
+import threading
+from controller import AsyncOptimizer
+
+
+class FakeController:
+    """Первое решение блокируется до release; фиксирует, видело ли оно устаревание"""
+
+    whatif = None
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+        self.saw_stale = []
+        self.applied = []
+
+    def interval_inputs(self, ks):
+        return ["job"]
+
+    def reset_interval(self, ks):
+        pass
+
+    def memo_lookup(self, jobs):
+        return ["key"], [None]
+
+    def solve(self, jobs, cached, snapshot=None, stale=None):
+        self.calls += 1
+        call = self.calls
+        if call == 1:
+            self.release.wait(5)
+        self.saw_stale.append(stale())
+        return [call]
+
+    def apply_results(self, step, jobs, keys, results):
+        self.applied.append((step, results))
+
+
+def test_skip_drops_running_solve():
+    controller = FakeController()
+    optimizer = AsyncOptimizer(controller, apply_delay=1, policy="skip")
+    optimizer.submit(0)
+    optimizer.poll(1)  # решение ещё считается: пропуск срока
+    assert optimizer.deadline_misses == 1
+    controller.release.set()
+    optimizer.submit(2)
+    optimizer.pending[-1].result(5)
+    optimizer.poll(3)
+    optimizer.shutdown()
+    assert controller.saw_stale == [True, False]
+    assert controller.applied == [(3, [2])]
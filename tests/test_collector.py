@@ -0,0 +1,63 @@
+# test_collector.py: ТС входит в снимок шага уже на шаге своего отправления
+import os
+from types import SimpleNamespace
+import pytest
+import traci.constants as tc
+import collector
+from collector import StepCollector, VEHICLE_GETTERS
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VALUES = {tc.VAR_POSITION: (1.0, 2.0), tc.VAR_SPEED: 3.0, tc.VAR_WAITING_TIME: 0.0, tc.VAR_LANE_ID: "e_0",
+          tc.VAR_ANGLE: 90.0}
+
+
+class LateSubscriptions:
+    """Бэкенд, у которого подписка возвращает значения ТС только со следующего шага"""
+
+    def __init__(self):
+        self.departed = ()
+        self.subscribed = set()
+        self.simulation = SimpleNamespace(subscribe=lambda vars: None,
+                                          getSubscriptionResults=lambda: {tc.VAR_DEPARTED_VEHICLES_IDS: self.departed})
+        self.vehicle = SimpleNamespace(getIDList=lambda: (), subscribe=lambda veh, vars: None,
+                                       getAllSubscriptionResults=lambda: {})
+        for var, getter in VEHICLE_GETTERS.items():
+            setattr(self.vehicle, getter, lambda veh, var=var: VALUES[var])
+        self.trafficlight = SimpleNamespace(subscribe=lambda tls, vars: None, getAllSubscriptionResults=lambda: {})
+
+
+def test_departed_vehicle_read_through_getters(monkeypatch):
+    backend = LateSubscriptions()
+    monkeypatch.setattr(collector, "traci", backend)
+    step_collector = StepCollector()
+    backend.departed = ("v0",)
+    snapshot = step_collector.step()
+    assert snapshot.ids == ("v0",)
+    assert snapshot.lanes == ("e_0",)
+    assert snapshot.speeds.tolist() == [3.0]
+    assert snapshot.positions.tolist() == [[1.0, 2.0]]
+
+
+def test_vehicle_in_snapshot_on_departure_step(monkeypatch, tmp_path):
+    pytest.importorskip("libsumo")
+    from backend import traci
+    from main import start_sumo
+    monkeypatch.chdir(ROOT_DIR)
+    start_sumo("libsumo", False, output_dir=str(tmp_path))
+    try:
+        step_collector = StepCollector()
+        departures = 0
+        for _ in range(300):
+            traci.simulationStep()
+            departed = traci.simulation.getDepartedIDList()
+            snapshot = step_collector.step()
+            index = {veh: k for k, veh in enumerate(snapshot.ids)}
+            assert set(snapshot.ids) == set(traci.vehicle.getIDList())
+            for veh in departed:
+                k = index[veh]
+                assert snapshot.lanes[k] == traci.vehicle.getLaneID(veh)
+                assert snapshot.speeds[k] == traci.vehicle.getSpeed(veh)
+            departures += len(departed)
+        assert departures > 0
+    finally:
+        traci.close()
@@ -0,0 +1,34 @@
+# test_controller_regression.py: контроллер по умолчанию (режим opt) не хуже фиксированной программы сети
+# на полном часе osm-сценария в SUMO (libsumo; без него тест пропускается)
+import os
+import pytest
+from analyze_kpi import load_run
+
+pytest.importorskip("libsumo")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def runs(tmp_path_factory):
+    from main import run_simulation
+    cwd = os.getcwd()
+    os.chdir(ROOT_DIR)
+    try:
+        results = {}
+        for mode in ("baseline", "opt"):
+            output_dir = str(tmp_path_factory.mktemp(mode))
+            summary = run_simulation(["--backend", "libsumo", "--non-interactive", "--no-plot", "--mode", mode,
+                                      "--output-dir", output_dir])
+            results[mode] = (summary, load_run(output_dir, use_cache=False))
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def test_default_controller_delay_not_worse_than_baseline(runs):
+    assert runs["opt"][0]["total_delay"] <= runs["baseline"][0]["total_delay"]
+
+
+@pytest.mark.parametrize("metric", ["avg_travel", "p95_travel", "avg_wait"])
+def test_default_controller_trips_not_worse_than_baseline(runs, metric):
+    assert runs["opt"][1]["trip"][metric] <= runs["baseline"][1]["trip"][metric]
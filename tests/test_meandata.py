@@ -0,0 +1,14 @@
+# test_meandata.py: разбор meandata в хранилище временных рядов
+import os
+import pytest
+import xml.etree.ElementTree as ET
+from meandata import convert
+
+
+def test_truncated_xml_leaves_no_records_file(tmp_path):
+    xml_path = tmp_path / "edgeData.xml"
+    xml_path.write_text('<meandata>\n    <interval begin="0" end="60" id="e">\n        <edge id="a" speed="1"/>\n')
+    prefix = str(tmp_path / "edge")
+    with pytest.raises(ET.ParseError):
+        convert(str(xml_path), prefix, "edge")
+    assert not os.path.exists(prefix + ".records.tmp")
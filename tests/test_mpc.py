@@ -0,0 +1,58 @@
+# test_mpc.py: штраф за риск по фазам в ранжировании планов MPC
+from collections import namedtuple
+import numpy as np
+import mpc
+from mpc import LaneTraffic, rank_phase_plans, risk_cost
+
+Phase = namedtuple("Phase", "state duration")
+Logic = namedtuple("Logic", "phases")
+
+# Две зелёные фазы с жёлтыми между ними; полосы 0-1 обслуживаются в фазе 0, полосы 2-3 — в фазе 2
+LOGIC = Logic([Phase("GGrr", 54), Phase("yyrr", 6), Phase("rrGG", 54), Phase("rryy", 6)])
+# Спрос, при котором лучший цикл не минимальный: штрафу за риск есть куда сдвигать зелёное время
+TRAFFIC = LaneTraffic(queues=np.array([10.0, 10.0, 9.0, 9.0]), arrivals=np.array([0.3, 0.3, 0.28, 0.28]),
+                      link_lanes=np.array([0, 1, 2, 3]))
+
+
+def best_plan(phase_risk, key):
+    plans, _ = rank_phase_plans(LOGIC, TRAFFIC, near_miss=10, interval_steps=300, key=key, phase_risk=phase_risk)
+    return plans[0]
+
+
+def test_uniform_risk_does_not_change_plan():
+    mpc.restore_call_counters({})
+    without = best_plan(None, "uniform")
+    mpc.restore_call_counters({})
+    uniform = best_plan(np.full(4, 0.05), "uniform")
+    np.testing.assert_array_equal(without, uniform)
+
+
+def test_skewed_phase_risk_changes_plan(monkeypatch):
+    monkeypatch.setattr(mpc, "MPC_RISK_WEIGHT", 0.1)
+    mpc.restore_call_counters({})
+    neutral = best_plan(None, "skewed")
+    mpc.restore_call_counters({})
+    # Конфликты почти только в фазе 0: её доля цикла сокращается в пользу фазы 2 (длина цикла тоже выбирается)
+    risky = best_plan(np.array([0.5, 0.0, 0.01, 0.0]), "skewed")
+    assert risky[0] / risky.sum() < neutral[0] / neutral.sum()
+    assert risky[2] / risky.sum() > neutral[2] / neutral.sum()
+
+
+def test_risk_weight_scales_shift(monkeypatch):
+    risk = np.array([0.5, 0.0, 0.01, 0.0])
+    shifts = []
+    for weight in (0.1, 1.0):
+        monkeypatch.setattr(mpc, "MPC_RISK_WEIGHT", weight)
+        mpc.restore_call_counters({})
+        shifts.append(best_plan(risk, "weight")[0])
+    assert shifts[1] <= shifts[0]
+
+
+def test_risk_cost_relative_to_delay():
+    delay = np.array([50000.0, 51000.0, 54000.0])
+    risk = np.array([3.0, 1.0, 2.0])
+    cost = risk_cost(delay, risk, weight=0.5)
+    # Рост риска на 100% от среднего стоит 50% средней задержки: near-miss «стоит» тысячи ТС·с, а не 1
+    np.testing.assert_allclose(cost, 0.5 * 51666.666666666664 * np.array([1.0, 0.0, 0.5]))
+    np.testing.assert_array_equal(risk_cost(delay, np.full(3, 7.0)), np.zeros(3))
+    np.testing.assert_array_equal(risk_cost(delay, np.zeros(3)), np.zeros(3))
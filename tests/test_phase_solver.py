@@ -0,0 +1,38 @@
+# test_phase_solver.py: аналитический решатель фаз совпадает с cvxpy на случайных линейных задачах
+import numpy as np
+import pytest
+from phase_solver import PhaseObjective, AnalyticSolver, CvxpySolver, is_feasible
+
+pytest.importorskip("cvxpy")
+
+
+def random_problems(count, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        num_phases = int(rng.integers(2, 9))
+        lo = int(rng.integers(1, 10))
+        hi = lo + int(rng.integers(1, 60))
+        total = int(rng.integers(num_phases * lo, num_phases * hi + 1))
+        objective = PhaseObjective(linear=rng.normal(size=num_phases), constant=float(rng.integers(0, 100)))
+        yield objective, lo, hi, total
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_analytic_matches_cvxpy(seed):
+    analytic, cvx = AnalyticSolver(), CvxpySolver()
+    for objective, lo, hi, total in random_problems(50, seed):
+        d_analytic = analytic.solve(objective, None, lo, hi, total)
+        d_cvxpy = cvx.solve(objective, None, lo, hi, total)
+        assert d_cvxpy is not None
+        assert np.all(d_analytic >= lo) and np.all(d_analytic <= hi)
+        assert d_analytic.sum() == total
+        # Сравниваются значения цели: при равных коэффициентах оптимум может быть не единственным
+        v_analytic = float(objective.linear @ d_analytic)
+        v_cvxpy = float(objective.linear @ d_cvxpy)
+        assert v_analytic == pytest.approx(v_cvxpy, rel=1e-4, abs=1e-4)
+
+
+def test_infeasible_cycle():
+    objective = PhaseObjective(linear=np.ones(3), constant=0.0)
+    assert not is_feasible(3, 10, 20, 100)
+    assert AnalyticSolver().solve(objective, None, 10, 20, 100) is None
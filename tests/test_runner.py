@@ -0,0 +1,34 @@
+# test_runner.py: порты TraCI параллельных сценариев не конфликтуют
+import os
+import socket
+import shutil
+import pytest
+from runner import build_scenarios, scenario_argv
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_free_port_by_default(tmp_path):
+    scenarios = build_scenarios(["baseline", "opt"], [1, 2], [1.0], str(tmp_path), "traci")
+    assert [spec["port"] for spec in scenarios] == [None] * 4
+    assert all("--port" not in scenario_argv(spec) for spec in scenarios)
+    fixed = build_scenarios(["opt"], [1, 2], [1.0], str(tmp_path), "traci", base_port=9000)
+    assert [scenario_argv(spec)[-1] for spec in fixed] == ["9000", "9001"]
+
+
+def test_busy_port_replaced_by_free_one(monkeypatch, tmp_path):
+    pytest.importorskip("sumolib")
+    from sumolib import checkBinary
+    if shutil.which(checkBinary("sumo")) is None:
+        pytest.skip("нет бинарника sumo")
+    from backend import traci
+    from main import start_sumo
+    monkeypatch.chdir(ROOT_DIR)
+    with socket.socket() as busy:
+        busy.bind(("localhost", 0))
+        start_sumo("traci", False, output_dir=str(tmp_path), port=busy.getsockname()[1])
+        try:
+            traci.simulationStep()
+            assert traci.simulation.getTime() == 1.0
+        finally:
+            traci.close()
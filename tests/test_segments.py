@@ -0,0 +1,87 @@
+# test_segments.py: KPI прогона, продолженного с контрольной точки, собираются из сегментов по окнам времени
+import os
+from types import SimpleNamespace
+import numpy as np
+import checkpoint
+from analyze_kpi import load_run
+from checkpoint import Checkpointer
+from meandata import MeanDataStore, interval_deltas
+from segments import run_segments, segment_dir, write_segment
+
+
+def write_tripinfos(directory, arrivals):
+    with open(os.path.join(directory, "tripinfos.xml"), "w") as f:
+        f.write("<tripinfos>\n")
+        for k, arrival in enumerate(arrivals):
+            f.write(f'    <tripinfo id="v{k}" arrival="{arrival}" duration="10" waitingTime="1"/>\n')
+        f.write("</tripinfos>\n")
+
+
+def write_edge_data(directory, intervals):
+    with open(os.path.join(directory, "edgeData.xml"), "w") as f:
+        f.write("<meandata>\n")
+        for begin in intervals:
+            f.write(f'    <interval begin="{begin}" end="{begin + 60}" id="e">\n')
+            for edge in ("a", "b"):
+                speed, seconds, loss = edge_values(edge, begin)
+                f.write(f'        <edge id="{edge}" speed="{speed}" sampledSeconds="{seconds}" timeLoss="{loss}"/>\n')
+            f.write("    </interval>\n")
+        f.write("</meandata>\n")
+
+
+def edge_values(edge, begin):
+    """Значения интервала непрерывного прогона: продолженный с точки прогон повторяет их"""
+    k = begin // 60 + (7 if edge == "b" else 0)
+    return 5 + k % 4, 10 * k + 1, 3 * k
+
+
+def resumed_run(tmp_path):
+    """Непрерывный прогон до 660 с, сбой на 610 с и продолжение с точки на 480 с.
+    Checkpointer ставит точку на границе интервала meandata (60 с), продолженный SUMO начинает интервалы с неё."""
+    run = str(tmp_path / "resumed")
+    os.makedirs(run)
+    write_tripinfos(run, [100, 470, 500, 600])
+    write_edge_data(run, range(0, 600, 60))
+    resume = segment_dir(run, 480)
+    os.makedirs(resume)
+    write_segment(resume, 480, 480.0)
+    write_tripinfos(resume, [500, 600, 650])
+    write_edge_data(resume, range(480, 660, 60))
+    continuous = str(tmp_path / "continuous")
+    os.makedirs(continuous)
+    write_tripinfos(continuous, [100, 470, 500, 600, 650])
+    write_edge_data(continuous, range(0, 660, 60))
+    return run, continuous
+
+
+def test_segments_split_at_checkpoint_time(tmp_path):
+    run, _ = resumed_run(tmp_path)
+    assert [(s.begin, s.end) for s in run_segments(run)] == [(None, 480.0), (480.0, None)]
+
+
+def test_resumed_run_matches_continuous(tmp_path):
+    run, continuous = resumed_run(tmp_path)
+    resumed, full = load_run(run, use_cache=False), load_run(continuous, use_cache=False)
+    assert resumed["trip"] == full["trip"]
+    assert resumed["edge"] == full["edge"]
+
+
+def test_resumed_run_meandata_intervals_match_continuous(tmp_path):
+    run, continuous = resumed_run(tmp_path)
+    resumed, full = MeanDataStore.open(run, "edge"), MeanDataStore.open(continuous, "edge")
+    np.testing.assert_array_equal(resumed.begin, full.begin)
+    np.testing.assert_array_equal(resumed.values, full.values)
+    _, base, other, delta = interval_deltas(full, resumed)
+    assert np.all(delta == 0)
+
+
+def test_checkpoint_waits_for_meandata_boundary(tmp_path, monkeypatch):
+    clock = SimpleNamespace(time=0.0)
+    monkeypatch.setattr(checkpoint, "traci", SimpleNamespace(simulation=SimpleNamespace(getTime=lambda: clock.time)))
+    checkpointer = Checkpointer(str(tmp_path), 1000, None, [], grids=[(0.0, 60.0)])
+    due = []
+    for step in range(990, 1090):
+        clock.time = float(step)
+        if checkpointer.due(step):
+            due.append(step)
+    assert due[0] == 1020
@@ -0,0 +1,27 @@
+# test_solver_latency.py: сводка латентности оптимизатора ограничена по памяти и сбрасывается между прогонами
+import pytest
+from phase_solver import LatencyStats
+
+
+def test_window_bounds_memory_but_means_cover_all_calls():
+    stats = LatencyStats(window=10)
+    for k in range(1000):
+        stats.record("mpc", 0.001 * (k % 2), first=k == 0)
+    assert len(stats.recent_wall) == 10
+    summary = stats.summary()
+    assert summary["calls"] == 1000
+    assert summary["backends"] == ["mpc"]
+    assert summary["wall_ms_mean"] == pytest.approx(0.5)
+    assert summary["resolve_wall_ms_mean"] == pytest.approx(500 / 999, abs=1e-3)
+    assert "solver_ms_mean" not in summary
+
+
+def test_reset_starts_new_run():
+    stats = LatencyStats(window=10)
+    stats.record("cvxpy", 0.002, solver=0.001, first=True)
+    assert stats.summary()["solver_ms_mean"] == pytest.approx(1.0)
+    stats.reset()
+    assert stats.summary() is None
+    stats.record("analytic", 0.004)
+    assert stats.summary() == {"calls": 1, "backends": ["analytic"], "wall_ms_mean": 4.0, "wall_ms_p95": 4.0,
+                               "resolve_wall_ms_mean": 4.0}
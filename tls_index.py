@@ -0,0 +1,153 @@
+# tls_index.py: Индекс метаданных светофоров (полосы, связи, программы, фазы, геометрия перекрёстков)
+# Строится один раз при старте из osm.net.xml.gz (sumolib) и TraCI и сохраняется на диск:
+# повторные прогоны на той же сети не тратят время на обнаружение.
+import os
+import pickle
+from typing import NamedTuple, Tuple
+from backend import traci
+from config import NET_FILE, SUMOCFG_FILE
+
+INDEX_VERSION = 1
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tls_index.pkl")
+
+
+class PhaseInfo(NamedTuple):
+    """Фаза программы (те же поля, что у traci.trafficlight.Phase)"""
+    duration: float
+    state: str
+    minDur: float
+    maxDur: float
+    name: str
+
+
+class LogicInfo(NamedTuple):
+    """Программа светофора (те же поля, что у traci.trafficlight.Logic)"""
+    programID: str
+    type: int
+    currentPhaseIndex: int
+    phases: Tuple[PhaseInfo, ...]
+
+
+def logic_info(logic):
+    """LogicInfo из объекта логики traci/libsumo"""
+    phases = tuple(PhaseInfo(float(p.duration), p.state, float(p.minDur), float(p.maxDur), p.name) for p in logic.phases)
+    return LogicInfo(logic.programID, int(logic.type), int(logic.currentPhaseIndex), phases)
+
+
+def _fingerprint(path):
+    try:
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    except OSError:
+        return (os.path.abspath(path), None, None)
+
+
+def _junctions_from_net(net_file, tls_ids):
+    """Перекрёстки каждого светофора по сети sumolib: id, позиция, форма"""
+    import sumolib
+    net = sumolib.net.readNet(net_file, withPrograms=False)
+    junctions = {}
+    for tls_id in tls_ids:
+        nodes = {}
+        try:
+            for in_lane, _out_lane, _link_no in net.getTLS(tls_id).getConnections():
+                node = in_lane.getEdge().getToNode()
+                nodes[node.getID()] = {
+                    "id": node.getID(),
+                    "position": tuple(node.getCoord()),
+                    "type": node.getType(),
+                    "shape": tuple(tuple(p) for p in node.getShape()),
+                }
+        except KeyError:
+            pass
+        junctions[tls_id] = list(nodes.values())
+    return junctions
+
+
+class TlsIndex:
+    """Статические данные светофоров + активная программа.
+    Активная программа меняется только нами (install_program), поэтому TraCI для неё не опрашивается.
+    """
+
+    def __init__(self, entries, key=None):
+        self.entries = entries  # tls_id -> dict
+        self.key = key
+
+    @classmethod
+    def discover(cls, tls_ids, net_file=NET_FILE):
+        """Полный опрос TraCI и разбор сети"""
+        junctions = _junctions_from_net(net_file, tls_ids)
+        entries = {}
+        for tls_id in tls_ids:
+            logics = {lg.programID: logic_info(lg) for lg in traci.trafficlight.getAllProgramLogics(tls_id)}
+            entries[tls_id] = {
+                "controlled_lanes": tuple(traci.trafficlight.getControlledLanes(tls_id)),
+                "controlled_links": tuple(tuple(tuple(link) for link in links)
+                                          for links in traci.trafficlight.getControlledLinks(tls_id)),
+                "programs": logics,
+                "active_program": traci.trafficlight.getProgram(tls_id),
+                "junctions": junctions.get(tls_id, []),
+            }
+        return cls(entries)
+
+    @classmethod
+    def load_or_build(cls, tls_ids, net_file=NET_FILE, path=INDEX_FILE):
+        """Индекс с диска, если сеть и конфиг не менялись, иначе — опрос и сохранение"""
+        key = (INDEX_VERSION, _fingerprint(net_file), _fingerprint(SUMOCFG_FILE), tuple(sorted(tls_ids)))
+        try:
+            with open(path, "rb") as f:
+                stored = pickle.load(f)
+            if stored.key == key:
+                print(f"Индекс светофоров загружен: {path}")
+                return stored
+        except Exception:
+            pass
+        index = cls.discover(tls_ids, net_file)
+        index.key = key
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(index, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Не удалось сохранить индекс светофоров: {e}")
+        return index
+
+    def __contains__(self, tls_id):
+        return tls_id in self.entries
+
+    def controlled_lanes(self, tls_id):
+        return self.entries[tls_id]["controlled_lanes"]
+
+    def controlled_links(self, tls_id):
+        return self.entries[tls_id]["controlled_links"]
+
+    def junctions(self, tls_id):
+        return self.entries[tls_id]["junctions"]
+
+    def programs(self, tls_id):
+        return self.entries[tls_id]["programs"]
+
+    def active_program(self, tls_id):
+        return self.entries[tls_id]["active_program"]
+
+    def active_logic(self, tls_id):
+        """Активная логика (LogicInfo); фолбэк — первая программа"""
+        entry = self.entries[tls_id]
+        logic = entry["programs"].get(entry["active_program"])
+        if logic is None and entry["programs"]:
+            logic = next(iter(entry["programs"].values()))
+        return logic
+
+    def phase_state(self, tls_id, phase_index):
+        logic = self.active_logic(tls_id)
+        if logic is not None and 0 <= phase_index < len(logic.phases):
+            return logic.phases[phase_index].state
+        return None
+
+    def install_program(self, tls_id, logic):
+        """Инвалидация при установке новой программы opt_N: она становится активной"""
+        info = logic if isinstance(logic, LogicInfo) else logic_info(logic)
+        entry = self.entries[tls_id]
+        entry["programs"][info.programID] = info
+        entry["active_program"] = info.programID
@@ -0,0 +1,98 @@
+# tlslog.py: Потоковая запись tlslog.xml во время симуляции и потоковый анализ
+# Формат записей: <tlsState time="t" id="TLS_ID" state="ryG..."/>, time — накопленное наблюдаемое время светофора.
+# При контрольных точках файл ротируется частями (tlslog.xml, tlslog.00001.xml, ...), каждая — целый XML.
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+from recorder import part_path, part_paths, remove_parts
+
+TLSLOG_BUFFER_SIZE = 256  # записей в буфере до сброса на диск
+
+
+class TlsLogWriter:
+    """Запись tlslog.xml по мере переключений фаз; в памяти не больше buffer_size записей.
+    resume — состояние из rotate() (контрольная точка)"""
+
+    def __init__(self, path, tls_ids=None, buffer_size=TLSLOG_BUFFER_SIZE, resume=None):
+        self.path = path
+        self.tls_ids = set(tls_ids) if tls_ids is not None else None
+        self.buffer_size = max(1, int(buffer_size))
+        self.buffer = []
+        self.cumulative_time = dict(resume["cumulative_time"]) if resume else {}  # tls_id -> накопленное время
+        self.count = resume["count"] if resume else 0
+        self.part = resume["part"] if resume else 0
+        remove_parts(path, self.part)
+        self._open()
+
+    def _open(self):
+        self.file = open(part_path(self.path, self.part), "w")
+        self.file.write('<?xml version="1.0" ?>\n<tlsStates>\n')
+
+    def add_switch(self, tls_id, state, duration):
+        """Событие переключения в начало завершившейся фазы длительностью duration"""
+        if self.tls_ids is not None and tls_id not in self.tls_ids:
+            return
+        t = self.cumulative_time.get(tls_id, 0.0)
+        self.buffer.append(f'    <tlsState time={quoteattr(str(round(t, 2)))} id={quoteattr(tls_id)} '
+                           f'state={quoteattr(state)}/>\n')
+        self.cumulative_time[tls_id] = t + duration
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.write("</tlsStates>\n")
+        self.file.close()
+        self.file = None
+
+    def rotate(self):
+        """Закрыть текущую часть и начать следующую; возвращает состояние для продолжения"""
+        self.close()
+        self.part += 1
+        self._open()
+        return {"part": self.part, "cumulative_time": dict(self.cumulative_time), "count": self.count}
+
+
+def summarize_tlslog(tlslog_path, tls_ids=None):
+    """Один потоковый проход по tlslog.xml (все части по порядку): {tls_id: {state: avg_duration_seconds}}.
+    Длительность состояния — разница времени между соседними событиями светофора.
+    """
+    wanted = set(tls_ids) if tls_ids is not None else None
+    last = {}  # tls_id -> (time, state) предыдущего события
+    sums = {}  # tls_id -> {state: [sum, count]}
+    for path in part_paths(tlslog_path) or [tlslog_path]:
+        with open(path, "rb") as f:
+            root = None
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag != "tlsState":
+                    continue
+                tls_id = elem.get("id")
+                if wanted is None or tls_id in wanted:
+                    try:
+                        t = float(elem.get("time"))
+                        s = elem.get("state")
+                    except Exception:
+                        t = None
+                    if t is not None:
+                        prev = last.get(tls_id)
+                        if prev is not None:
+                            acc = sums.setdefault(tls_id, {}).setdefault(prev[1], [0.0, 0])
+                            acc[0] += max(0.0, t - prev[0])
+                            acc[1] += 1
+                        last[tls_id] = (t, s)
+                # Записи — прямые потомки корня: удаляем обработанные, память не растёт
+                root.clear()
+    return {tls_id: {state: round(total / count, 2) for state, (total, count) in by_state.items()}
+            for tls_id, by_state in sums.items()}
@@ -1,9 +1,10 @@
 # utils.py: Вспомогательные функции
+import sys
 import numpy as np
-import cvxpy as cp
-import traci
-import matplotlib.pyplot as plt
-from config import MIN_PHASE_DURATION, MAX_PHASE_DURATION, CYCLE_TIME, PROXIMITY_THRESHOLD
+from backend import traci
+from config import PROXIMITY_THRESHOLD, PHASE_CONTROLLER
+from near_miss import compute_near_miss, near_miss_pairs, attribute_near_miss
+# Оптимизатор (phase_solver, mpc) импортируется при первом расчёте: режимы baseline и replay его не загружают
 
 def get_junction_info(traci, junction_id):
     """Получение информации о перекрестке"""
@@ -24,13 +25,17 @@ def get_junction_info(traci, junction_id):
         print(f"Ошибка при получении информации о перекрестке {junction_id}: {e}")
         return None
 
-def get_traffic_light_info(traci, tls_id):
-    """Получение детальной информации о светофоре"""
+def get_traffic_light_info(traci, tls_id, tls_index=None):
+    """Получение детальной информации о светофоре (статические данные — из tls_index, если он передан)"""
     try:
-        # Получаем список контролируемых полос
-        controlled_lanes = traci.trafficlight.getControlledLanes(tls_id)
-        # Получаем список контролируемых связей (links)
-        controlled_links = traci.trafficlight.getControlledLinks(tls_id)
+        if tls_index is not None and tls_id in tls_index:
+            controlled_lanes = tls_index.controlled_lanes(tls_id)
+            controlled_links = tls_index.controlled_links(tls_id)
+        else:
+            # Получаем список контролируемых полос
+            controlled_lanes = traci.trafficlight.getControlledLanes(tls_id)
+            # Получаем список контролируемых связей (links)
+            controlled_links = traci.trafficlight.getControlledLinks(tls_id)
         # Получаем текущую программу светофора
         program = traci.trafficlight.getProgram(tls_id)
         # Получаем все программы светофора
@@ -41,7 +46,9 @@ def get_traffic_light_info(traci, tls_id):
         state = traci.trafficlight.getRedYellowGreenState(tls_id)
         # Если это кластер, получаем информацию о перекрестках
         junctions = []
-        if "#" in tls_id: # Признак кластера
+        if tls_index is not None and tls_id in tls_index:
+            junctions = tls_index.junctions(tls_id)
+        elif "#" in tls_id: # Признак кластера
             # Получаем список перекрестков в кластере
             # Примечание: это эвристика, так как SUMO не предоставляет прямой API для этого
             parts = tls_id.split("_")
@@ -141,82 +148,119 @@ def select_traffic_light(traci, tls_ids, tls_id=None):
         print(f"Неверный ввод. Выбран первый светофор: {tls_ids[0]}")
         return tls_ids[0]
 
-def detect_near_miss():
-    """Детекция near-miss на основе TTC < 2 сек, с фильтром по расстоянию"""
-    vehicles = traci.vehicle.getIDList()
-    near_miss_count = 0
-    risk_metrics = []
-    for i, veh1 in enumerate(vehicles):
-        pos1 = np.array(traci.vehicle.getPosition(veh1))
-        speed1 = traci.vehicle.getSpeed(veh1)
-        for veh2 in vehicles[i+1:]: # Избежать двойного счета и self
-            pos2 = np.array(traci.vehicle.getPosition(veh2))
-            dist = np.linalg.norm(pos1 - pos2)
-            if dist > PROXIMITY_THRESHOLD: # Фильтр для эффективности
-                continue
-            speed2 = traci.vehicle.getSpeed(veh2)
-            rel_speed = abs(speed1 - speed2)
-            if rel_speed > 0 and dist / rel_speed < 2.0:
-                near_miss_count += 1
-                risk_metrics.append(dist / rel_speed)
-    avg_risk = np.mean(risk_metrics) if risk_metrics else 0
-    return near_miss_count, avg_risk
+def select_traffic_lights(traci, tls_ids, tls_spec=None, interactive=True):
+    """Выбор набора управляемых светофоров.
+    tls_spec: "all" — все светофоры сети, "id1,id2" — список, один ID или None.
+    Без интерактивного режима и без tls_spec выбираются все светофоры.
+    """
+    if not tls_ids:
+        print("Нет доступных светофоров в сети")
+        return []
+    if tls_spec == "all" or (tls_spec is None and not interactive):
+        print(f"Выбраны все светофоры сети: {len(tls_ids)}")
+        return list(tls_ids)
+    if tls_spec and "," in tls_spec:
+        selected = [tls for tls in tls_spec.split(",") if tls]
+        print(f"Выбраны светофоры: {', '.join(selected)}")
+        return selected
+    if not interactive:
+        if tls_spec in tls_ids:
+            print(f"Выбран светофор: {tls_spec}")
+            return [tls_spec]
+        print(f"Светофор {tls_spec} не найден. Выбран первый светофор: {tls_ids[0]}")
+        return [tls_ids[0]]
+    tls_id = select_traffic_light(traci, tls_ids, tls_spec)
+    return [tls_id] if tls_id else []
+
+def detect_near_miss(positions=None, speeds=None):
+    """Детекция near-miss на основе TTC < 2 сек, с фильтром по расстоянию.
+    Позиции и скорости читаются из TraCI один раз за шаг (или передаются готовыми массивами),
+    пары-кандидаты ищутся по сетке с ячейкой PROXIMITY_THRESHOLD.
+    """
+    if positions is None or speeds is None:
+        vehicles = traci.vehicle.getIDList()
+        positions = np.array([traci.vehicle.getPosition(veh) for veh in vehicles], dtype=np.float64).reshape(-1, 2)
+        speeds = np.array([traci.vehicle.getSpeed(veh) for veh in vehicles], dtype=np.float64)
+    return compute_near_miss(positions, speeds, PROXIMITY_THRESHOLD)
+
+def detect_near_miss_by_tls(positions, speeds, vehicle_tls, num_tls):
+    """Near-miss по сети с распределением по светофорам.
+    vehicle_tls[k] — индекс светофора, контролирующего полосу ТС k (или -1).
+    Возвращает (near_miss_count, avg_risk, counts_per_tls, ttc_sums_per_tls).
+    """
+    i, j, ttc = near_miss_pairs(positions, speeds, PROXIMITY_THRESHOLD)
+    counts, ttc_sums = attribute_near_miss(i, j, ttc, vehicle_tls, num_tls)
+    if len(ttc) == 0:
+        return 0, 0, counts, ttc_sums
+    return int(len(ttc)), float(ttc.mean()), counts, ttc_sums
 
 # Global counter for program IDs
 _program_counter = 0
 
-def optimize_phases(near_miss_count, avg_risk, current_logic, tls_id):
-    """Оптимизация фаз с cvxpy (MPC), с зависимым objective"""
+def program_counter():
+    """Номер последней установленной программы opt_N (контрольные точки)"""
+    return _program_counter
+
+def restore_program_counter(value):
     global _program_counter
-    _program_counter += 1
-    
-    num_phases = len(current_logic.phases)
-    durations = cp.Variable(num_phases, nonneg=True)
-   
-    constraints = [durations >= MIN_PHASE_DURATION, durations <= MAX_PHASE_DURATION, cp.sum(durations) == CYCLE_TIME]
-   
-    # Исправленный objective: Делаем зависимым от durations. Пример: weights per phase (симулируем риск по направлениям)
-    # В реальности: Соберите phase-specific risk из данных SUMO
-    phase_weights = np.linspace(1, 1.5, num_phases) # Больше веса для "опасных" фаз (e.g., повороты)
-    # Избегаем депрекейтнутого умножения матриц: используем elementwise multiply
-    delay_estimate = cp.sum(cp.multiply(phase_weights, durations)) # Weighted delay approx
-    risk_penalty = avg_risk * cp.sum(durations) # Всегда CYCLE_TIME, но для баланса
-    objective = cp.Minimize(0.5 * delay_estimate + 0.5 * risk_penalty + near_miss_count) # + const для минимизации
-   
-    problem = cp.Problem(objective, constraints)
-    problem.solve()
-   
-    if problem.status != cp.OPTIMAL:
+    _program_counter = int(value)
+
+def phase_objective(near_miss_count, avg_risk, num_phases, phase_risk=None):
+    """Цель оптимизации фаз: взвешенная задержка + штраф за риск + константа near-miss.
+    phase_risk — near-miss в секунду по фазам (зоны перекрёстков): веса фаз от 1 до 1.5 по реальному риску.
+    """
+    if phase_risk is not None and np.max(phase_risk) > 0:
+        phase_weights = 1 + 0.5 * np.asarray(phase_risk, dtype=np.float64) / np.max(phase_risk)
+    else:
+        # Без данных по фазам: weights per phase (симулируем риск по направлениям)
+        phase_weights = np.linspace(1, 1.5, num_phases) # Больше веса для "опасных" фаз (e.g., повороты)
+    # 0.5 * weighted delay + 0.5 * avg_risk * sum(durations) (всегда CYCLE_TIME, но для баланса)
+    from phase_solver import PhaseObjective
+    linear = 0.5 * phase_weights + 0.5 * avg_risk
+    return PhaseObjective(linear=linear, constant=float(near_miss_count))
+
+def compute_phase_durations(near_miss_count, avg_risk, current_logic, tls_id, traffic=None, interval_steps=1,
+                            phase_risk=None):
+    """Расчёт новых длительностей фаз без обращения к TraCI.
+    PHASE_CONTROLLER == 'mpc' и есть оценки по полосам (traffic) — прогнозирующий план по модели очередей,
+    иначе — линейная цель phase_objective. phase_risk — риск по фазам (если известен).
+    """
+    if PHASE_CONTROLLER == 'mpc' and traffic is not None:
+        from mpc import plan_phase_durations
+        new_durations = plan_phase_durations(current_logic, traffic, near_miss_count, interval_steps, key=tls_id,
+                                             phase_risk=phase_risk)
+    else:
+        num_phases = len(current_logic.phases)
+        objective = phase_objective(near_miss_count, avg_risk, num_phases, phase_risk)
+        from phase_solver import solve_phase_durations
+        new_durations = solve_phase_durations(objective, key=tls_id)
+    if new_durations is None:
         print("Optimization failed, using current durations")
         return [phase.duration for phase in current_logic.phases]
-   
-    # Округляем до целых, корректируем сумму до CYCLE_TIME
-    new_durations = [int(round(d)) for d in durations.value]
-    total = sum(new_durations)
-    if total != CYCLE_TIME:
-        diff = CYCLE_TIME - total
-        # Простая коррекция: распределяем разницу по фазам, не выходя за MIN/MAX
-        i = 0
-        while diff != 0 and i < num_phases:
-            if diff > 0:
-                add = min(diff, MAX_PHASE_DURATION - new_durations[i])
-                new_durations[i] += add
-                diff -= add
-            else:
-                sub = min(-diff, new_durations[i] - MIN_PHASE_DURATION)
-                new_durations[i] -= sub
-                diff += sub
-            i = (i + 1) % num_phases
+    return new_durations
+
+def optimize_phases(near_miss_count, avg_risk, current_logic, tls_id, tls_index=None):
+    """Оптимизация фаз (MPC): расчёт длительностей и установка новой программы"""
+    new_durations = compute_phase_durations(near_miss_count, avg_risk, current_logic, tls_id)
+    apply_phase_durations(new_durations, current_logic, tls_id, tls_index)
+    return new_durations
+
+def apply_phase_durations(new_durations, current_logic, tls_id, tls_index=None):
+    """Установка программы opt_N с заданными длительностями фаз.
+    Если передан tls_index (TlsIndex), новая программа регистрируется в нём как активная.
+    """
+    global _program_counter
+    _program_counter += 1
    
     # Копируем полные phases с новыми durations
     new_phases = []
     for i, phase in enumerate(current_logic.phases):
         # Жестко фиксируем фактическую длительность: minDur=maxDur=duration
-        new_phases.append(traci.trafficlight.Phase(new_durations[i], phase.state, new_durations[i], new_durations[i], phase.name))
+        new_phases.append(traci.trafficlight.Phase(new_durations[i], phase.state, new_durations[i], new_durations[i], (), phase.name))
    
     # Create new program with unique ID to trigger tlslog.xml writing
     new_program_id = f"opt_{_program_counter}"
-    new_logic = traci.trafficlight.Logic(new_program_id, current_logic.type, current_logic.currentPhaseIndex, phases=new_phases)
+    new_logic = traci.trafficlight.Logic(new_program_id, current_logic.type, current_logic.currentPhaseIndex, new_phases)
    
     try:
         # Обновляем полное описание программы
@@ -224,6 +268,8 @@ def optimize_phases(near_miss_count, avg_risk, current_logic, tls_id):
         # Активируем новую программу (это вызовет запись в tlslog.xml)
         try:
             traci.trafficlight.setProgram(tls_id, new_program_id)
+            if tls_index is not None:
+                tls_index.install_program(tls_id, new_logic)
         except traci.TraCIException:
             pass
         # Перезапускаем цикл с первой фазы, чтобы новые длительности применились немедленно
@@ -236,46 +282,37 @@ def optimize_phases(near_miss_count, avg_risk, current_logic, tls_id):
    
     return new_durations
 
-def visualize_results(risk_history):
-    """Визуализация трендов риска"""
-    plt.plot(risk_history)
+def visualize_results(risk_history, output_path='risk_trend.png'):
+    """Визуализация трендов риска: массив по шагам или RiskTrend (среднее по корзинам и полоса min/max)"""
+    if hasattr(risk_history, "series"):
+        steps, mean, low, high = risk_history.series()
+        band = risk_history.width > 1
+    else:
+        mean = np.asarray(risk_history)
+        steps, low, high, band = np.arange(len(mean)), None, None, False
+    # matplotlib загружается только здесь: прогоны без графика не тратят время на импорт
+    import matplotlib
+    if "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg") # Только сохранение в файл, без оконного бэкенда
+    import matplotlib.pyplot as plt
+    plt.figure()
+    plt.plot(steps, mean)
+    if band:
+        # Прореженный ряд: пики внутри корзин не теряются
+        plt.fill_between(steps, low, high, alpha=0.3, linewidth=0)
     plt.xlabel('Time steps')
     plt.ylabel('Avg Risk')
     plt.title('Risk Trend')
-    plt.savefig('risk_trend.png') # Save instead of show
-    print("Visualization saved to risk_trend.png")
+    plt.savefig(output_path) # Save instead of show
+    plt.close()
+    print(f"Visualization saved to {output_path}")
 
 def analyze_tlslog(tls_id, tlslog_path):
     """Анализ tlslog.xml: рассчитывает средние длительности по состояниям для указанного светофора.
     Возвращает словарь {state: avg_duration_seconds}.
     """
-    import xml.etree.ElementTree as ET
+    from tlslog import summarize_tlslog
     try:
-        tree = ET.parse(tlslog_path)
+        return summarize_tlslog(tlslog_path, [tls_id]).get(tls_id)
     except Exception:
         return None
-    root = tree.getroot()
-    # Формат записей: <tlsState time="t" id="TLS_ID" state="ryG..."/>
-    events = []
-    for evt in root.findall('.//tlsState'):
-        if evt.get('id') == tls_id:
-            try:
-                t = float(evt.get('time'))
-                s = evt.get('state')
-            except Exception:
-                continue
-            events.append((t, s))
-    if len(events) < 2:
-        return None
-    # Считаем длительности как разницу времени между соседними событиями для каждого состояния
-    durations_by_state = {}
-    counts_by_state = {}
-    for i in range(len(events) - 1):
-        t0, s0 = events[i]
-        t1, _ = events[i + 1]
-        dur = max(0.0, t1 - t0)
-        durations_by_state[s0] = durations_by_state.get(s0, 0.0) + dur
-        counts_by_state[s0] = counts_by_state.get(s0, 0) + 1
-    # Усредняем
-    avg_by_state = {state: round(durations_by_state[state] / counts_by_state[state], 2) for state in durations_by_state}
-    return avg_by_state
\ No newline at end of file
@@ -0,0 +1,179 @@
+# whatif.py: Проверка кандидатных планов фаз прогоном «что если» в отдельных процессах SUMO
+# На шаге оптимизации состояние симуляции сохраняется (traci.simulation.saveState), каждый кандидат
+# проигрывается с этого состояния (loadState) в headless SUMO рабочего процесса на WHATIF_HORIZON шагов,
+# побеждает план с наименьшей задержкой на контролируемых полосах. Процессы SUMO живут весь прогон.
+import os
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
+from backend import traci
+from config import PHASE_CONTROLLER, MIN_PHASE_DURATION, MAX_PHASE_DURATION, CYCLE_TIME
+from config import WHATIF_WORKERS, WHATIF_CANDIDATES, WHATIF_HORIZON, WHATIF_BUDGET_SEC
+from mpc import rank_phase_plans
+
+STATE_FILE = "whatif_state.xml.gz"
+
+
+def _install_logic(tls_id, info, program_id=None, durations=None):
+    """Программа из LogicInfo (или логики traci) в SUMO рабочего процесса; durations — фиксированные длительности"""
+    phases = []
+    for i, phase in enumerate(info.phases):
+        if durations is None:
+            phases.append(traci.trafficlight.Phase(phase.duration, phase.state, phase.minDur, phase.maxDur, (), phase.name))
+        else:
+            phases.append(traci.trafficlight.Phase(durations[i], phase.state, durations[i], durations[i], (), phase.name))
+    logic = traci.trafficlight.Logic(program_id or info.programID, info.type, info.currentPhaseIndex, phases)
+    traci.trafficlight.setCompleteRedYellowGreenDefinition(tls_id, logic)
+
+
+def _worker_main(tasks, results, backend, seed, scale, output_dir, extra_args):
+    """Рабочий процесс: один headless SUMO на весь прогон, задачи — (eval_id, idx, ...) из очереди"""
+    import contextlib
+    from main import start_sumo
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "worker.log"), "w") as log, contextlib.redirect_stdout(log):
+        start_sumo(backend, False, seed, scale, output_dir, extra_args=extra_args)
+        results.put((0, -1, None))  # готов
+        known = set()  # (tls_id, programID), уже установленные в этом SUMO
+        counter = 0
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            eval_id, idx, deadline, state_path, programs, active, tls_id, logic, lanes, durations, horizon = task
+            if time.time() > deadline:
+                results.put((eval_id, idx, None))
+                continue
+            try:
+                # Программы, упомянутые в состоянии, должны существовать до loadState
+                for program_tls, info in programs:
+                    if (program_tls, info.programID) not in known:
+                        _install_logic(program_tls, info)
+                        known.add((program_tls, info.programID))
+                traci.simulation.loadState(state_path)
+                # Активная программа из состояния не восстанавливается — выставляем как в основном прогоне
+                for program_tls, program_id in active.items():
+                    traci.trafficlight.setProgram(program_tls, program_id)
+                counter += 1
+                program_id = f"whatif_{counter}"
+                _install_logic(tls_id, logic, program_id, durations)
+                traci.trafficlight.setProgram(tls_id, program_id)
+                traci.trafficlight.setPhase(tls_id, 0)
+                queued = 0
+                for _ in range(horizon):
+                    traci.simulationStep()
+                    queued += sum(traci.lane.getLastStepHaltingNumber(lane) for lane in lanes)
+                results.put((eval_id, idx, float(queued)))
+            except Exception as e:
+                print(f"what-if task failed: {e}")
+                results.put((eval_id, idx, None))
+        traci.close()
+
+
+def candidate_durations(job, best, tls_id, count=WHATIF_CANDIDATES):
+    """Кандидаты для проверки: решение оптимизатора, следующие по прогнозу MPC планы, текущий план"""
+    plans = [list(best)]
+    if PHASE_CONTROLLER == "mpc" and job.traffic is not None:
+        ranked, _ = rank_phase_plans(job.logic, job.traffic, job.near_miss, job.steps, key=f"{tls_id}/whatif", phase_risk=job.phase_risk,
+                                     candidates=max(100, 10 * count))
+        plans += [[int(d) for d in plan] for plan in ranked[:count]]
+    current = [int(round(phase.duration)) for phase in job.logic.phases]
+    # MPC выбирает и длину цикла (до CYCLE_TIME), линейная цель — разбиение цикла CYCLE_TIME
+    cycle_ok = sum(current) <= CYCLE_TIME if PHASE_CONTROLLER == "mpc" else sum(current) == CYCLE_TIME
+    if cycle_ok and all(MIN_PHASE_DURATION <= d <= MAX_PHASE_DURATION for d in current):
+        plans.append(current)
+    return list(dict.fromkeys(tuple(plan) for plan in plans))[:count]
+
+
+class WhatIfPool:
+    """Пул рабочих процессов SUMO для проверки планов; одна оценка укладывается в budget секунд"""
+
+    def __init__(self, output_dir, backend, seed=None, scale=None, prefixed=True, extra_args=(), workers=WHATIF_WORKERS,
+                 horizon=WHATIF_HORIZON, budget=WHATIF_BUDGET_SEC, candidates=WHATIF_CANDIDATES):
+        self.output_dir = output_dir
+        # Основной SUMO запущен с --output-prefix (output_dir): тогда имя файла состояния — без каталога
+        self.prefixed = prefixed
+        self.horizon = horizon
+        self.budget = budget
+        self.candidates = candidates
+        self.eval_id = 0
+        self.evaluations = []  # (кандидатов, проверено, wall сек) по оценкам
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.processes = []
+        for k in range(max(1, workers)):
+            worker_dir = os.path.join(output_dir, "whatif", f"worker_{k}")
+            process = ctx.Process(target=_worker_main, daemon=True,
+                                  args=(self.tasks, self.results, backend, seed, scale, worker_dir, list(extra_args)))
+            process.start()
+            self.processes.append(process)
+        # Ждём запуска SUMO во всех процессах, чтобы первая оценка не ушла на старт
+        for _ in self.processes:
+            self.results.get(timeout=120)
+
+    def snapshot(self, tls_ids, tls_index):
+        """Сохранить состояние основного прогона (вызывать в основном потоке):
+        (путь к файлу состояния, активные программы, все программы светофоров)"""
+        # SUMO дописывает --output-prefix и к имени файла состояния
+        path = os.path.join(os.path.abspath(self.output_dir), STATE_FILE)
+        traci.simulation.saveState(STATE_FILE if self.prefixed else path)
+        active = {tls_id: tls_index.active_program(tls_id) for tls_id in tls_ids}
+        programs = [(tls_id, logic) for tls_id in tls_ids for logic in tls_index.programs(tls_id).values()]
+        return path, active, programs
+
+    def select(self, snapshot, jobs, results, tls_ids, tls_index):
+        """Лучший по прогону кандидат для каждого светофора (results — решения оптимизатора).
+        Можно вызывать из рабочего потока: TraCI основного прогона не используется."""
+        t0 = time.perf_counter()
+        state_path, active, programs = snapshot
+        self.eval_id += 1
+        deadline = time.time() + self.budget
+        plans = {}
+        for j, (job, best) in enumerate(zip(jobs, results)):
+            if best is None:
+                continue
+            tls_id = tls_ids[job.k]
+            lanes = tuple(dict.fromkeys(tls_index.controlled_lanes(tls_id)))
+            for plan in candidate_durations(job, best, tls_id, self.candidates):
+                idx = len(plans)
+                plans[idx] = (j, plan)
+                self.tasks.put((self.eval_id, idx, deadline, state_path, programs, active, tls_id, job.logic, lanes,
+                                plan, self.horizon))
+        scores = {}
+        while len(scores) < len(plans):
+            try:
+                eval_id, idx, score = self.results.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            # Запоздавшие ответы прошлых оценок отбрасываются
+            if eval_id == self.eval_id:
+                scores[idx] = score
+        chosen = list(results)
+        best_score = {}
+        for idx, (j, plan) in plans.items():
+            score = scores.get(idx)
+            if score is None:
+                continue
+            if j not in best_score or score < best_score[j]:
+                best_score[j] = score
+                chosen[j] = list(plan)
+        evaluated = sum(1 for s in scores.values() if s is not None)
+        self.evaluations.append((len(plans), evaluated, time.perf_counter() - t0))
+        return chosen
+
+    def summary(self):
+        if not self.evaluations:
+            return None
+        total, evaluated, wall = np.array(self.evaluations, dtype=np.float64).T
+        return {"evaluations": len(self.evaluations), "candidates": int(total.sum()), "evaluated": int(evaluated.sum()),
+                "wall_ms_mean": round(float(wall.mean()) * 1000, 1), "wall_ms_max": round(float(wall.max()) * 1000, 1)}
+
+    def shutdown(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()